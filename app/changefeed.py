@@ -0,0 +1,427 @@
+"""
+Resource change feed.
+
+Routers call `record_change` for every create, update and delete. This adds
+a `ResourceChange` row to the same transaction, so an event exists exactly
+when its change was committed, and its id is the sequence number clients
+resume from. Once the transaction commits, the event is pushed to the
+in-process `ChangeBroker`, which hands it to every matching subscriber.
+
+On PostgreSQL, the transaction instead sends a `pg_notify` (delivered on
+commit) to wake the `PostgresChangeListener` of every worker, which reads
+the committed rows from the database and feeds them into its local broker.
+That way a watcher connected to any worker sees the changes made through
+all of them.
+
+Clients resume after the last sequence number they saw, so events must be
+published in sequence order. PostgreSQL takes the number from a sequence
+when the row is flushed, not when it commits, so concurrent transactions
+can commit their rows out of order. The listener therefore publishes rows
+in id order and holds back the rows after a missing id until the
+transactions that could still commit it have ended; stream backlogs are
+read only up to the last published id (`ChangeBroker.horizon`). SQLite
+write transactions are serialized (see `app.db`), so their rows commit in
+order. Other databases have no notifications: there, each worker of a
+multi-worker setup runs a `PollingChangeListener` that reads new change
+rows from the database and publishes them, in place of publishing its own
+commits.
+"""
+import asyncio
+import select
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy import select as sql_select
+from sqlalchemy.orm import Session
+from sqlmodel import SQLModel
+
+from app.models import ResourceChange
+from app.resource_types import resource_type_of
+
+NOTIFY_CHANNEL = "resource_changes"
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+# Put on a subscriber's queue in place of further events once it falls too
+# far behind. The stream ends, and the client resumes from its last event.
+OVERFLOW = object()
+
+_PENDING_KEY = "pending_resource_changes"
+
+def record_change(session: Session, change_type: str, resource: SQLModel) -> ResourceChange:
+    """
+    Records a change to a resource in the session's transaction.
+
+    Args:
+        session: The session the change is made in. The event is published
+            once this session commits.
+        change_type: "Create", "Update" or "Delete".
+        resource: The created, updated or deleted resource.
+    """
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        # Assigns the transaction its id before the row takes a sequence
+        # number, which `PostgresChangeListener` relies on to tell whether
+        # a missing number can still be committed.
+        connection.execute(sql_select(func.txid_current()))
+    resource_type = resource_type_of(type(resource))
+    change = ResourceChange(
+        change_type=change_type,
+        subscription_id=resource.subscription_id,
+        resource_group=resource.resource_group,
+        resource_type=resource_type.full_type,
+        name=resource.name,
+        resource_id=resource_type.resource_id(resource.subscription_id, resource.resource_group, resource.name),
+    )
+    session.add(change)
+    return change
+
+def to_event(change: ResourceChange) -> Dict[str, Any]:
+    """
+    Converts a change row to the event sent to clients.
+    """
+    return {
+        "sequenceNumber": change.id,
+        "eventTime": change.event_time.isoformat(),
+        "changeType": change.change_type,
+        "resourceId": change.resource_id,
+        "resourceType": change.resource_type,
+        "subscriptionId": change.subscription_id,
+        "resourceGroup": change.resource_group,
+        "name": change.name,
+    }
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session: Session, flush_context) -> None:
+    # Ids are assigned by now, while session.new still lists the flushed rows.
+    changes = [obj for obj in session.new if isinstance(obj, ResourceChange)]
+    if not changes:
+        return
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        # Wakes every listener, including our own, on commit; they read the
+        # rows themselves.
+        connection.execute(sql_select(func.pg_notify(NOTIFY_CHANNEL, "")))
+    elif BROKER.publish_commits:
+        session.info.setdefault(_PENDING_KEY, []).extend(to_event(change) for change in changes)
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session) -> None:
+    events = session.info.pop(_PENDING_KEY, None)
+    if events:
+        BROKER.publish(events)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+class ChangeFilter:
+    """
+    Selects the events a change feed client asked for. Empty criteria match
+    everything; resource groups and types compare case-insensitively.
+    """
+
+    def __init__(
+        self,
+        subscription_id: Optional[str] = None,
+        resource_group: Optional[str] = None,
+        resource_type: Optional[str] = None,
+    ):
+        self.subscription_id = subscription_id
+        self.resource_group = resource_group.lower() if resource_group else None
+        self.resource_type = resource_type.lower() if resource_type else None
+
+    def __call__(self, change_event: Dict[str, Any]) -> bool:
+        if self.subscription_id and change_event["subscriptionId"] != self.subscription_id:
+            return False
+        if self.resource_group and change_event["resourceGroup"].lower() != self.resource_group:
+            return False
+        if self.resource_type and change_event["resourceType"].lower() != self.resource_type:
+            return False
+        return True
+
+class Subscription:
+    """
+    A change feed client's queue of live events. Created and read on the
+    event loop; fed from any thread through `ChangeBroker.publish`.
+    """
+
+    def __init__(self, matches: Callable[[Dict[str, Any]], bool], loop: asyncio.AbstractEventLoop):
+        self.matches = matches
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, change_event: Dict[str, Any]) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(change_event)
+        except asyncio.QueueFull:
+            # Drop the backlog so the marker fits; the client resumes from
+            # the database instead.
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+class ChangeBroker:
+    """
+    Fans committed change events out to the subscribers of this process.
+    """
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self._listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+        self._lock = threading.Lock()
+        # Whether commits in this process are published directly; cleared
+        # while a `PollingChangeListener` publishes them instead.
+        self.publish_commits = True
+        # The last sequence number published by a running listener, which
+        # stream backlogs are read up to; None while commits are published
+        # directly.
+        self.horizon: Optional[int] = None
+
+    def subscribe(self, matches: Callable[[Dict[str, Any]], bool]) -> Subscription:
+        """
+        Registers a subscriber. Must be called from the event loop that will
+        read the subscription's queue.
+        """
+        subscription = Subscription(matches, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def add_listener(self, listener: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """
+        Registers a callback that receives every published batch of events,
+        on the publishing thread, before subscribers are offered them.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[List[Dict[str, Any]]], None]) -> None:
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def publish(self, events: List[Dict[str, Any]]) -> None:
+        """
+        Delivers events to listeners and matching subscribers. Safe to call
+        from any thread.
+        """
+        with self._lock:
+            listeners = list(self._listeners)
+            subscriptions = list(self._subscriptions)
+        for listener in listeners:
+            listener(events)
+        for subscription in subscriptions:
+            for change_event in events:
+                if subscription.matches(change_event):
+                    try:
+                        subscription.loop.call_soon_threadsafe(subscription.offer, change_event)
+                    except RuntimeError:  # The subscriber's loop has closed.
+                        self.unsubscribe(subscription)
+                        break
+
+BROKER = ChangeBroker()
+
+class PostgresChangeListener:
+    """
+    Background thread that LISTENs for the change notifications of all
+    workers and publishes the committed change rows to the local broker, in
+    sequence order.
+
+    A missing sequence number belongs to a transaction that has not ended
+    yet, or to one that rolled back. Rows after it are held back until
+    every transaction that was running when the gap was seen has ended
+    (the snapshot's xmin has passed the xmax noted then); `record_change`
+    makes sure such a transaction already had its id when it took the
+    number. The missing number is then either committed and read, or lost
+    for good, and the held rows are published.
+
+    If the connection fails, the listener reconnects with backoff and
+    catches up from the last published row.
+    """
+
+    def __init__(
+        self,
+        engine,
+        broker: ChangeBroker = BROKER,
+        poll_interval: float = 1.0,
+        batch_size: int = 1000,
+        max_backoff: float = 30.0,
+    ):
+        self.engine = engine
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_id = 0
+        # While rows are held back: the xmax noted when the gap was seen,
+        # and the last row id read then. Once that xmax has passed, every
+        # id up to that row is settled.
+        self._gap_xmax: Optional[int] = None
+        self._gap_through = 0
+        self._settled_through = 0
+
+    def start(self) -> None:
+        # LISTEN before reading the last id, so no later change is missed.
+        connection = self._listen()
+        with Session(self.engine) as session:
+            self._last_id = session.execute(sql_select(func.max(ResourceChange.id))).scalar() or 0
+        self.broker.horizon = self._last_id
+        self._thread = threading.Thread(
+            target=self._run, args=(connection,), name="change-feed-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.broker.horizon = None
+
+    def _listen(self):
+        # A dedicated connection, outside the pool, kept in autocommit so
+        # notifications are delivered as soon as they arrive.
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        except Exception:
+            connection.invalidate()
+            raise
+        return connection
+
+    def _wait(self, connection) -> bool:
+        """
+        Waits up to the poll interval for notifications. Returns whether
+        any arrived.
+        """
+        dbapi_connection = connection.driver_connection
+        readable, _, _ = select.select([dbapi_connection], [], [], self.poll_interval)
+        if not readable:
+            return False
+        dbapi_connection.poll()
+        notified = bool(dbapi_connection.notifies)
+        dbapi_connection.notifies.clear()
+        return notified
+
+    def _run(self, connection) -> None:
+        backoff = self.poll_interval
+        while not self._stop.is_set():
+            try:
+                if connection is None:
+                    connection = self._listen()
+                # Picks up whatever was committed while no one listened.
+                self._catch_up()
+                backoff = self.poll_interval
+                while not self._stop.is_set():
+                    if self._wait(connection) or self._gap_xmax is not None:
+                        self._catch_up()
+            except Exception as exc:
+                print(f"Change feed listener failed, reconnecting in {backoff:g}s: {exc!r}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                if connection is not None:
+                    connection.invalidate()
+                    connection = None
+
+    def _snapshot(self, session: Session) -> Tuple[int, int]:
+        """
+        Returns the xmin and xmax of a snapshot taken now.
+        """
+        snapshot = func.txid_current_snapshot()
+        return session.execute(sql_select(func.txid_snapshot_xmin(snapshot), func.txid_snapshot_xmax(snapshot))).one()
+
+    def _catch_up(self) -> None:
+        """
+        Publishes the rows committed after the last published one, up to the
+        first unsettled gap.
+        """
+        while True:
+            with Session(self.engine) as session:
+                # Taken before the rows are read, so the transactions that
+                # ended by then have their rows in the read.
+                xmin, _ = self._snapshot(session)
+                changes = session.execute(
+                    sql_select(ResourceChange)
+                    .where(ResourceChange.id > self._last_id)
+                    .order_by(ResourceChange.id)
+                    .limit(self.batch_size)
+                ).scalars().all()
+                if self._gap_xmax is not None and xmin >= self._gap_xmax:
+                    self._settled_through = self._gap_through
+                    self._gap_xmax = None
+                events = []
+                for change in changes:
+                    if change.id != self._last_id + 1 and change.id > self._settled_through:
+                        if self._gap_xmax is None:
+                            self._gap_xmax = self._snapshot(session)[1]
+                            self._gap_through = changes[-1].id
+                        break
+                    events.append(to_event(change))
+                    self._last_id = change.id
+            if events:
+                self.broker.publish(events)
+                self.broker.horizon = self._last_id
+            if len(events) < self.batch_size:
+                return
+
+class PollingChangeListener:
+    """
+    Background thread that reads the changes committed by all workers from
+    the database and publishes them to the local broker, for databases
+    without notifications. While it runs, the broker publishes no commits
+    directly, so every event is published once, in sequence order.
+    """
+
+    def __init__(self, engine, broker: ChangeBroker = BROKER, poll_interval: float = 0.25, batch_size: int = 1000):
+        self.engine = engine
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.broker.publish_commits = False
+        with Session(self.engine) as session:
+            last_id = session.execute(sql_select(func.max(ResourceChange.id))).scalar() or 0
+        self.broker.horizon = last_id
+        self._thread = threading.Thread(
+            target=self._run, args=(last_id,), name="change-feed-poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.broker.horizon = None
+        self.broker.publish_commits = True
+
+    def _run(self, last_id: int) -> None:
+        while not self._stop.is_set():
+            with Session(self.engine) as session:
+                changes = session.execute(
+                    sql_select(ResourceChange)
+                    .where(ResourceChange.id > last_id)
+                    .order_by(ResourceChange.id)
+                    .limit(self.batch_size)
+                ).scalars().all()
+            if changes:
+                last_id = changes[-1].id
+                self.broker.publish([to_event(change) for change in changes])
+                self.broker.horizon = last_id
+            if len(changes) < self.batch_size:
+                self._stop.wait(self.poll_interval)
@@ -6,7 +6,8 @@ a single instance of the settings.
 """
 import os
 from functools import lru_cache
-from pydantic import ConfigDict
+from typing import List, Literal, Optional
+from pydantic import ConfigDict, model_validator
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -16,21 +17,79 @@ class Settings(BaseSettings):
     APP_ENV: str = "prod"
     API_SPECS_PATH: str = os.path.join(os.getcwd(), 'azure-rest-api-specs', 'specification')
 
+    # Services whose API specs are indexed for mock endpoints and validation
+    SPEC_SERVICES: List[str] = ["compute", "networking", "storage"]
+    # Reload changed spec files without a restart
+    SPEC_WATCH: bool = False
+    SPEC_WATCH_INTERVAL: float = 2.0  # Seconds between scans when polling
+
+    # Validate PUT bodies against the request schemas in the API specs
+    VALIDATE_REQUEST_BODIES: bool = True
+
+    # Directory holding the content of blobs in the blob data plane
+    BLOB_STORAGE_PATH: str = os.path.join(os.getcwd(), 'data', 'blobs')
+    # Directory holding the message log of the queue data plane
+    QUEUE_STORAGE_PATH: str = os.path.join(os.getcwd(), 'data', 'queues')
+    # Sync the queue log to disk before answering; without it, messages
+    # survive an emulator crash but not a machine crash
+    QUEUE_FSYNC: bool = True
+
+    # Observability settings
+    METRICS_ENABLED: bool = True
+    TRACING_ENABLED: bool = False  # Requires the opentelemetry-api package
+
     # Security settings
     MOCK_AUTH_TOKEN: str = "mock-token"
 
+    # Emulate ARM's per-subscription request throttling: token buckets of
+    # this size, refilled at this many tokens per second
+    THROTTLING_ENABLED: bool = False
+    THROTTLE_READS_BUCKET_SIZE: int = 250
+    THROTTLE_READS_PER_SECOND: float = 25.0
+    THROTTLE_WRITES_BUCKET_SIZE: int = 200
+    THROTTLE_WRITES_PER_SECOND: float = 10.0
+    # File holding the buckets shared by several workers
+    THROTTLE_STATE_PATH: str = os.path.join(os.getcwd(), 'data', 'throttle.bin')
+
     # Database settings loaded from .env file
-    POSTGRES_USER: str
-    POSTGRES_PASSWORD: str
-    POSTGRES_DB: str
-    DATABASE_HOST: str
+    DATABASE_BACKEND: Literal["postgresql", "sqlite"] = "postgresql"
+    DATABASE_ECHO: bool = False  # Log every SQL statement
+    # Database file of the sqlite backend
+    SQLITE_PATH: str = os.path.join(os.getcwd(), 'data', 'emulator.db')
+    # Required by the postgresql backend
+    POSTGRES_USER: Optional[str] = None
+    POSTGRES_PASSWORD: Optional[str] = None
+    POSTGRES_DB: Optional[str] = None
+    DATABASE_HOST: Optional[str] = None
     DATABASE_PORT: int = 5432
+    # Connections the PostgreSQL server accepts from the emulator, divided
+    # between the pools of the workers
+    DATABASE_MAX_CONNECTIONS: int = 90
+
+    # Worker processes serving the emulator; read by uvicorn for --workers
+    WEB_CONCURRENCY: int = 1
+
+    @model_validator(mode="after")
+    def check_postgres_settings(self) -> "Settings":
+        """
+        Requires the connection settings of the postgresql backend.
+        """
+        if self.DATABASE_BACKEND == "postgresql":
+            missing = [
+                name for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB", "DATABASE_HOST")
+                if getattr(self, name) is None
+            ]
+            if missing:
+                raise ValueError(f"{', '.join(missing)} must be set when DATABASE_BACKEND is postgresql")
+        return self
 
     @property
     def DATABASE_URL(self) -> str:
         """
         Constructs the database connection URL from individual settings.
         """
+        if self.DATABASE_BACKEND == "sqlite":
+            return f"sqlite:///{self.SQLITE_PATH}"
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.DATABASE_HOST}:{self.DATABASE_PORT}/{self.POSTGRES_DB}"
 
     model_config = ConfigDict(
@@ -0,0 +1,29 @@
+"""
+Content hashes of the desired state of resources.
+
+PUT handlers store the hash of each resource's normalized request alongside
+it. When a PUT arrives with the same hash, as Terraform sends for every
+unchanged resource on each apply, the stored resource is returned without
+writing anything, so no row is locked or rewritten and no change event is
+recorded.
+"""
+import hashlib
+import json
+
+from pydantic import BaseModel
+
+def content_hash(body: BaseModel) -> str:
+    """
+    Returns a hash of the state a PUT request asks for.
+
+    The body is hashed as parsed by the request model, with keys sorted, so
+    formatting, key order and fields the model ignores do not change it.
+    The subscription, resource group and name are left out: they are part
+    of the resource's identity, so they are equal for the stored resource.
+    """
+    normalized = json.dumps(
+        body.model_dump(mode="json"),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
@@ -0,0 +1,280 @@
+"""
+Bulk synthetic resource generator for scale testing.
+
+This module generates large, seeded, realistic datasets for the models in
+`app.models` and bulk-loads them into the emulator database. On PostgreSQL
+rows are streamed with `COPY`; on other databases they are written with
+batched multi-row inserts.
+
+Usage:
+    python -m app.datagen --resource-groups 2000 --vms 100000 \\
+        --vnets 50000 --storage-accounts 50000 --seed 42
+"""
+import argparse
+import csv
+import io
+import ipaddress
+import random
+import re
+import time
+from bisect import bisect
+from itertools import accumulate, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Table, insert
+from sqlalchemy.engine import Engine
+from sqlmodel import select
+
+from app.config import get_settings
+from app.db import create_db_and_tables, create_db_engine
+from app.models import StorageAccount, Subnet, VirtualMachine, VirtualNetwork
+from app.resource_types import resource_type_of
+
+class WeightedChoice:
+    """
+    A weighted choice with cumulative weights computed once, since
+    `random.choices` otherwise rebuilds them on every draw.
+    """
+
+    def __init__(self, choices: List[tuple]):
+        self.values, weights = zip(*choices)
+        self.cum_weights = list(accumulate(weights))
+        self.total = self.cum_weights[-1]
+
+    def __call__(self, rng: random.Random) -> Any:
+        return self.values[bisect(self.cum_weights, rng.random() * self.total)]
+
+LOCATIONS = WeightedChoice([
+    ("eastus", 30), ("eastus2", 15), ("westus2", 15), ("westeurope", 15),
+    ("northeurope", 10), ("southeastasia", 5), ("uksouth", 5), ("centralus", 5),
+])
+VM_SIZES = WeightedChoice([
+    ("Standard_B2s", 20), ("Standard_D2s_v3", 30), ("Standard_D4s_v3", 20),
+    ("Standard_D8s_v3", 10), ("Standard_E4s_v3", 10), ("Standard_F4s_v2", 8), ("Standard_NC6", 2),
+])
+PROVISIONING_STATES = WeightedChoice([("Succeeded", 97), ("Failed", 2), ("Updating", 1)])
+STORAGE_SKUS = WeightedChoice([("Standard_LRS", 60), ("Standard_GRS", 20), ("Standard_ZRS", 10), ("Premium_LRS", 10)])
+STORAGE_KINDS = WeightedChoice([("StorageV2", 85), ("BlobStorage", 10), ("FileStorage", 5)])
+# Subnets are /24 prefixes of their network's /16 address space.
+SUBNET_PREFIX_LENGTH = 24
+MAX_SUBNETS_PER_NETWORK = 2 ** (SUBNET_PREFIX_LENGTH - 16)
+
+WORKLOADS = ["web", "api", "worker", "db", "cache", "batch", "jump", "build"]
+
+class SyntheticDataGenerator:
+    """
+    Generates deterministic rows for the emulator's resource tables.
+
+    Resources are spread across resource groups with a skewed distribution,
+    as in real subscriptions where a few groups hold most of the resources.
+    """
+
+    def __init__(self, resource_groups: int, seed: int = 0, prefix: str = "synth", subscriptions: int = 10):
+        self.prefix = prefix
+        self.seed = seed
+        self.resource_groups = [f"{prefix}-rg-{index:05d}" for index in range(resource_groups)]
+        subscription_ids = [f"00000000-0000-0000-0000-{index:012d}" for index in range(max(1, subscriptions))]
+        self.subscription_of = {
+            group: subscription_ids[index % len(subscription_ids)]
+            for index, group in enumerate(self.resource_groups)
+        }
+
+    def _rng(self, salt: str) -> random.Random:
+        # Each table gets its own stream so changing one count does not
+        # change the rows generated for the others.
+        return random.Random(f"{self.seed}:{salt}")
+
+    def _pick_group(self, rng: random.Random) -> str:
+        # Half of the resources are spread evenly, the other half follow a
+        # Pareto distribution clamped to the number of groups.
+        if rng.random() < 0.5:
+            return rng.choice(self.resource_groups)
+        index = min(int(rng.paretovariate(1.2)) - 1, len(self.resource_groups) - 1)
+        return self.resource_groups[(index * 7919) % len(self.resource_groups)]
+
+    def _placement(self, rng: random.Random) -> Dict[str, str]:
+        resource_group = self._pick_group(rng)
+        return {"resource_group": resource_group, "subscription_id": self.subscription_of[resource_group]}
+
+    @staticmethod
+    def _keyed(model, row: Dict[str, Any]) -> Dict[str, Any]:
+        # Bulk loads bypass the ORM, which sets the key on other writes.
+        row["resource_id_key"] = resource_type_of(model).resource_id_key(row["subscription_id"], row["resource_group"], row["name"])
+        return row
+
+    def virtual_machines(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("vm")
+        for index in range(count):
+            yield self._keyed(VirtualMachine, {
+                "name": f"{self.prefix}-vm-{rng.choice(WORKLOADS)}-{index:07d}",
+                **self._placement(rng),
+                "location": LOCATIONS(rng),
+                "vm_size": VM_SIZES(rng),
+                "provisioning_state": PROVISIONING_STATES(rng),
+            })
+
+    def virtual_networks(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("vnet")
+        for index in range(count):
+            yield self._keyed(VirtualNetwork, {
+                "name": f"{self.prefix}-vnet-{index:07d}",
+                **self._placement(rng),
+                "location": LOCATIONS(rng),
+                "address_space": f"10.{index % 256}.0.0/16",
+            })
+
+    def subnets(self, virtual_networks: Iterable[Tuple[int, str]], per_network: int) -> Iterator[Dict[str, Any]]:
+        """
+        Generates up to `per_network` subnets for each (id, address space)
+        of the given networks, each within its network's address space.
+        """
+        if per_network > MAX_SUBNETS_PER_NETWORK:
+            raise ValueError(f"At most {MAX_SUBNETS_PER_NETWORK} subnets fit in a network")
+        rng = self._rng("subnet")
+        for vnet_id, address_space in virtual_networks:
+            count = rng.randint(1, per_network) if per_network else 0
+            prefixes = ipaddress.ip_network(address_space).subnets(new_prefix=SUBNET_PREFIX_LENGTH)
+            for index, prefix in enumerate(islice(prefixes, count)):
+                yield {
+                    "name": f"{rng.choice(WORKLOADS)}-subnet-{index}",
+                    "address_prefix": str(prefix),
+                    "virtual_network_id": vnet_id,
+                }
+
+    def storage_accounts(self, count: int) -> Iterator[Dict[str, Any]]:
+        rng = self._rng("storage")
+        # Storage account names are restricted to 3-24 lowercase letters and digits.
+        name_prefix = re.sub(r"[^a-z0-9]", "", self.prefix.lower())[:14]
+        for index in range(count):
+            yield self._keyed(StorageAccount, {
+                "name": f"{name_prefix}sa{index:08d}",
+                **self._placement(rng),
+                "location": LOCATIONS(rng),
+                "sku": STORAGE_SKUS(rng),
+                "kind": STORAGE_KINDS(rng),
+            })
+
+def _batches(rows: Iterable[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def _copy_batch(engine: Engine, table: Table, batch: List[Dict[str, Any]]) -> None:
+    """
+    Loads a batch into PostgreSQL with `COPY ... FROM STDIN`.
+    """
+    columns = list(batch[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+def bulk_load(engine: Engine, table: Table, rows: Iterable[Dict[str, Any]], batch_size: int = 10000) -> int:
+    """
+    Bulk-loads rows into a table and returns the number of rows written.
+
+    PostgreSQL uses `COPY`; other dialects use multi-row `INSERT` statements.
+    """
+    use_copy = engine.dialect.name == "postgresql"
+    total = 0
+    for batch in _batches(rows, batch_size):
+        if use_copy:
+            _copy_batch(engine, table, batch)
+        else:
+            with engine.begin() as connection:
+                connection.execute(insert(table), batch)
+        total += len(batch)
+    return total
+
+def generate(
+    engine: Engine,
+    resource_groups: int,
+    vms: int,
+    vnets: int,
+    storage_accounts: int,
+    subnets_per_vnet: int = 3,
+    subscriptions: int = 10,
+    seed: int = 0,
+    prefix: str = "synth",
+    batch_size: int = 10000,
+) -> Dict[str, int]:
+    """
+    Generates and bulk-loads a synthetic dataset.
+
+    Returns:
+        The number of rows written per table.
+    """
+    if subnets_per_vnet > MAX_SUBNETS_PER_NETWORK:
+        raise ValueError(f"At most {MAX_SUBNETS_PER_NETWORK} subnets fit in a network")
+    generator = SyntheticDataGenerator(resource_groups, seed=seed, prefix=prefix, subscriptions=subscriptions)
+    counts = {
+        "virtualmachine": bulk_load(engine, VirtualMachine.__table__, generator.virtual_machines(vms), batch_size),
+        "virtualnetwork": bulk_load(engine, VirtualNetwork.__table__, generator.virtual_networks(vnets), batch_size),
+        "storageaccount": bulk_load(engine, StorageAccount.__table__, generator.storage_accounts(storage_accounts), batch_size),
+    }
+
+    # Subnets reference their network by id, which is only known after load,
+    # and are carved out of the network's stored address space.
+    with engine.connect() as connection:
+        vnets = connection.execute(
+            select(VirtualNetwork.id, VirtualNetwork.address_space)
+            .where(VirtualNetwork.name.startswith(f"{prefix}-vnet-"))
+            .order_by(VirtualNetwork.id)
+        ).all()
+    counts["subnet"] = bulk_load(engine, Subnet.__table__, generator.subnets(vnets, subnets_per_vnet), batch_size)
+    return counts
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate and bulk-load synthetic Azure resources.")
+    parser.add_argument("--database-url", help="Database to load into. Defaults to the configured DATABASE_URL.")
+    parser.add_argument("--subscriptions", type=int, default=10)
+    parser.add_argument("--resource-groups", type=int, default=1000)
+    parser.add_argument("--vms", type=int, default=100000)
+    parser.add_argument("--vnets", type=int, default=20000)
+    parser.add_argument("--subnets-per-vnet", type=int, default=3, help=f"At most {MAX_SUBNETS_PER_NETWORK}.")
+    parser.add_argument("--storage-accounts", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefix", default="synth", help="Name prefix; use a new one to load more data into the same database.")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    engine = create_db_engine(get_settings(), args.database_url)
+    create_db_and_tables(engine)
+
+    start = time.perf_counter()
+    counts = generate(
+        engine,
+        resource_groups=args.resource_groups,
+        vms=args.vms,
+        vnets=args.vnets,
+        storage_accounts=args.storage_accounts,
+        subnets_per_vnet=args.subnets_per_vnet,
+        subscriptions=args.subscriptions,
+        seed=args.seed,
+        prefix=args.prefix,
+        batch_size=args.batch_size,
+    )
+    elapsed = time.perf_counter() - start
+
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+    print(f"Loaded {total} rows in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
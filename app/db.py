@@ -3,15 +3,215 @@ Database management module.
 
 This module is refactored to support dependency injection for the database
 engine and sessions, making the application more testable.
+
+With the sqlite backend the database is a single file in WAL mode, so
+readers never block the writer or each other. SQLite allows one writer at
+a time, and a transaction that read before writing fails outright (rather
+than waiting) if another writer committed in between. Handlers that read
+and then write therefore call `begin_write` first: their transaction starts
+with `BEGIN IMMEDIATE`, taking the write lock before reading. Within a
+process, writers queue on a lock before that, so they are served in turn
+instead of polling SQLite's busy handler.
+
+Several worker processes can serve the same database (see
+`WEB_CONCURRENCY`). Each creates its engine in its own lifespan, after the
+workers were forked, so no connection is shared between processes, and
+the connections allowed by the server are divided between the workers'
+pools. The schema is created by whichever worker gets there first, while
+the others wait on a lock.
 """
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterator, Optional
+
 from fastapi import Request
-from sqlmodel import Session, SQLModel
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.config import Settings
+from app.metrics import DB_SESSION_HOLD
+from app.migrations import migrate
+
+try:
+    import fcntl
+except ImportError:  # Windows; run a single worker there.
+    fcntl = None
+
+_session_hold = DB_SESSION_HOLD.labels()
+
+# Execution option set by `begin_write`; ignored by other dialects.
+_BEGIN_IMMEDIATE = "sqlite_begin_immediate"
+# Connection record info key marking a connection that holds the writer lock.
+_HOLDS_WRITE_LOCK = "holds_write_lock"
+
+# Threads of the threadpool that runs sync routes and dependencies, each
+# of which can keep a connection open.
+SQLITE_POOL_SIZE = 40
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # In WAL mode, commits survive application crashes; only an OS crash
+    # can lose the last transactions.
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    # Milliseconds to wait for the write lock held by another process.
+    "busy_timeout": "30000",
+    "cache_size": "-65536",  # 64 MiB
+    "temp_store": "MEMORY",
+    "mmap_size": str(256 * 1024 * 1024),
+}
+
+# Key of the PostgreSQL advisory lock held while creating the schema.
+SCHEMA_LOCK_KEY = 0x636D6B72  # "cmkr"
+
+def create_db_engine(settings: Settings, database_url: Optional[str] = None) -> Engine:
+    """
+    Creates the engine of the configured database.
+
+    Args:
+        settings: The application settings.
+        database_url: A database to connect to instead of the configured one.
+    """
+    database_url = database_url or settings.DATABASE_URL
+    if not database_url.startswith("sqlite:///") or ":memory:" in database_url:
+        if database_url.startswith("sqlite"):
+            return create_engine(database_url, echo=settings.DATABASE_ECHO)
+        return create_engine(
+            database_url,
+            echo=settings.DATABASE_ECHO,
+            pool_size=pool_size(settings),
+            max_overflow=0,
+            pool_timeout=60,
+        )
+
+    directory = os.path.dirname(database_url[len("sqlite:///"):])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    engine = create_engine(
+        database_url,
+        echo=settings.DATABASE_ECHO,
+        # Connections are used by one thread at a time, but not always the
+        # thread that opened them.
+        connect_args={"check_same_thread": False},
+        pool_size=SQLITE_POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=60,
+    )
+    configure_sqlite(engine)
+    return engine
+
+def pool_size(settings: Settings) -> int:
+    """
+    The connections of each worker's pool: an even share of the connections
+    the database server allows.
+    """
+    return max(2, settings.DATABASE_MAX_CONNECTIONS // max(1, settings.WEB_CONCURRENCY))
+
+def configure_sqlite(engine: Engine) -> None:
+    """
+    Sets the pragmas and the transaction handling described above on the
+    connections of a SQLite engine. This also makes SAVEPOINTs work, which
+    the pysqlite driver's own transaction handling breaks.
+    """
+    write_lock = threading.Lock()
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy issue BEGIN itself, so it can choose the kind.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        if conn.get_execution_options().get(_BEGIN_IMMEDIATE):
+            write_lock.acquire()
+            conn.info[_HOLDS_WRITE_LOCK] = True
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            conn.exec_driver_sql("BEGIN")
+
+    def release(conn, *args):
+        if conn.info.pop(_HOLDS_WRITE_LOCK, False):
+            write_lock.release()
+
+    event.listen(engine, "commit", release)
+    event.listen(engine, "rollback", release)
+
+    # Also release the lock if BEGIN IMMEDIATE itself failed.
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        if connection_record.info.pop(_HOLDS_WRITE_LOCK, False):
+            write_lock.release()
+
+def begin_write(session: Session) -> None:
+    """
+    Starts the session's transaction as a write transaction.
+
+    Must be called before the transaction reads anything. On SQLite this
+    takes the database's write lock up front, so the transaction cannot
+    fail on writing after another writer committed; on PostgreSQL, whose
+    row locks handle this, it does nothing.
+    """
+    session.connection(execution_options={_BEGIN_IMMEDIATE: True})
+
+@contextmanager
+def schema_lock(engine: Engine) -> Iterator[None]:
+    """
+    Holds a lock shared by all processes using the database: an advisory
+    lock on PostgreSQL and a lock file next to a SQLite database file.
+    In-memory databases belong to one process and are not locked.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+                connection.commit()
+        return
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or fcntl is None or not database or database == ":memory:":
+        yield
+        return
+    lock_fd = os.open(f"{database}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(lock_fd)  # Also releases the lock.
 
 def create_db_and_tables(engine):
     """
-    Creates all tables defined by SQLModel models using the provided engine.
+    Creates all tables defined by SQLModel models using the provided engine,
+    after upgrading the tables of a database created by an earlier release
+    (see `app.migrations`).
+
+    Workers starting together create the schema one at a time, so only the
+    first migrates and creates the tables and the others find them in place.
+    """
+    with schema_lock(engine):
+        migrate(engine)
+        SQLModel.metadata.create_all(engine)
+
+@contextmanager
+def _observed_session(engine: Engine) -> Iterator[Session]:
+    """
+    Opens a session, recording the time it is held open in the
+    `emulator_db_session_hold_seconds` histogram.
     """
-    SQLModel.metadata.create_all(engine)
+    start = time.perf_counter()
+    try:
+        with Session(engine) as session:
+            yield session
+    finally:
+        _session_hold.observe(time.perf_counter() - start)
 
 def get_session(request: Request):
     """
@@ -19,8 +219,18 @@ def get_session(request: Request):
 
     This function depends on the database engine being available in the
     application state (`request.app.state.engine`), which is set up
-    during the application's lifespan event.
+    during the application's lifespan event. The time the session is held
+    open is recorded in the `emulator_db_session_hold_seconds` histogram.
     """
-    engine = request.app.state.engine
-    with Session(engine) as session:
+    with _observed_session(request.app.state.engine) as session:
         yield session
+
+def get_session_factory(request: Request) -> Callable[[], ContextManager[Session]]:
+    """
+    FastAPI dependency for long-running handlers, such as streams, that
+    should not hold one session for their whole duration. Returns a
+    function opening a short-lived session each time it is called, as a
+    context manager.
+    """
+    engine = request.app.state.engine
+    return lambda: _observed_session(engine)
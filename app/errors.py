@@ -0,0 +1,70 @@
+"""
+Azure-style error responses.
+
+ARM clients expect failures in the `{"error": {"code": ..., "message": ...}}`
+envelope rather than FastAPI's default `{"detail": ...}` body. Raising
+`AzureError` from a route or dependency produces that envelope. The storage
+data plane reports errors as XML instead, which `StorageError` produces.
+"""
+from typing import Any, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+class AzureError(Exception):
+    """
+    An error that is rendered in the Azure Resource Manager error format.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        code: str,
+        message: str,
+        details: Optional[List[Dict[str, Any]]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+        self.details = details
+        self.headers = headers
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the error as an ARM error response body.
+        """
+        error: Dict[str, Any] = {"code": self.code, "message": self.message}
+        if self.details:
+            error["details"] = self.details
+        return {"error": error}
+
+async def azure_error_handler(request: Request, exc: AzureError) -> JSONResponse:
+    """
+    Exception handler that renders an `AzureError` as a JSON response.
+    """
+    return JSONResponse(status_code=exc.status_code, content=exc.to_dict(), headers=exc.headers)
+
+class StorageError(AzureError):
+    """
+    An error that is rendered in the Azure Storage data plane error format.
+    """
+
+    def to_xml(self) -> str:
+        """
+        Returns the error as a storage service error response body.
+        """
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f"<Error><Code>{escape(self.code)}</Code><Message>{escape(self.message)}</Message></Error>"
+        )
+
+async def storage_error_handler(request: Request, exc: StorageError) -> Response:
+    """
+    Exception handler that renders a `StorageError` as an XML response.
+    """
+    headers = {"x-ms-error-code": exc.code, **(exc.headers or {})}
+    content = b"" if request.method == "HEAD" else exc.to_xml()
+    return Response(content, status_code=exc.status_code, headers=headers, media_type="application/xml")
@@ -0,0 +1,600 @@
+"""
+A Kusto Query Language (KQL) subset for Resource Graph style queries.
+
+Queries are parsed into a list of tabular operators and compiled into a
+single SQL statement over all resource tables, so filtering, grouping,
+ordering and paging all happen in the database. Supported syntax:
+
+    Resources
+    | where <predicate>                 (and / or / not(), ==, !=, =~, !~, <, <=, >, >=,
+                                         contains, has, startswith, endswith, in, in~,
+                                         their ! negations, isempty(), isnotempty())
+    | project <col>[, <alias> = <col>]
+    | summarize [<alias> =] count() [by <col>, ...]
+    | count
+    | order by <col> [asc|desc], ...   (also 'sort by')
+    | take <n>                          (also 'limit')
+
+Leading `where` operators are pushed into every per-table branch of the
+query. Conditions on `type` are evaluated up front, so tables that cannot
+match are not queried at all, and equality with `id` is looked up through
+the tables' indexed, lower-cased resource IDs.
+
+`has` matches whole terms, as in Kusto, with one approximation: terms are
+split at the characters in `TERM_SEPARATORS`, the punctuation found in
+resource names, IDs and properties, rather than at every character other
+than an ASCII letter or digit, since SQLite has no regular expressions. A value of several terms matches them
+in sequence, separated as in the value.
+"""
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from sqlalchemy import String, and_, cast, func, literal, not_, null, or_, select, union_all
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.selectable import Select
+
+from app.resource_types import RESOURCE_TYPES, ResourceType
+
+class KQLError(ValueError):
+    """Raised for queries that are invalid or use unsupported syntax."""
+
+# --- Parsing ----------------------------------------------------------------
+
+class Where(NamedTuple):
+    predicate: tuple
+
+class Project(NamedTuple):
+    columns: List[Tuple[str, str]]  # (alias, source)
+
+class Summarize(NamedTuple):
+    alias: str
+    by: List[str]
+
+class OrderBy(NamedTuple):
+    keys: List[Tuple[str, bool]]  # (column, descending)
+
+class Take(NamedTuple):
+    count: int
+
+Operator = Union[Where, Project, Summarize, OrderBy, Take]
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op>==|!=|=~|!~|<=|>=|<|>|=|\(|\)|,|\|)
+      | (?P<word>!?[A-Za-z_][A-Za-z0-9_.]*~?)
+    )""", re.VERBOSE)
+
+_COMPARISONS = {
+    "==", "!=", "=~", "!~", "<", "<=", ">", ">=",
+    "contains", "!contains", "has", "!has",
+    "startswith", "!startswith", "endswith", "!endswith",
+    "in", "!in", "in~", "!in~",
+}
+
+def _tokenize(text: str) -> List[Tuple[str, Any]]:
+    tokens: List[Tuple[str, Any]] = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            raise KQLError(f"Unexpected character at position {position}: {text[position:position + 10]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "number":
+            value = float(value) if "." in value else int(value)
+        tokens.append((kind, value))
+    return tokens
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def _peek(self) -> Optional[Tuple[str, Any]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> Tuple[str, Any]:
+        token = self._peek()
+        if token is None:
+            raise KQLError("Unexpected end of query.")
+        self.position += 1
+        return token
+
+    def _accept(self, value: str) -> bool:
+        token = self._peek()
+        if token is not None and token[0] in ("op", "word") and token[1] == value:
+            self.position += 1
+            return True
+        return False
+
+    def _expect(self, value: str) -> None:
+        if not self._accept(value):
+            token = self._peek()
+            found = token[1] if token else "end of query"
+            raise KQLError(f"Expected '{value}' but found '{found}'.")
+
+    def _word(self) -> str:
+        kind, value = self._next()
+        if kind != "word":
+            raise KQLError(f"Expected a column name but found '{value}'.")
+        return value
+
+    def parse(self) -> List[Operator]:
+        table = self._word()
+        if table.lower() != "resources":
+            raise KQLError(f"Unsupported table '{table}'. Only 'Resources' can be queried.")
+        operators: List[Operator] = []
+        while self._accept("|"):
+            operators.append(self._operator())
+        if self._peek() is not None:
+            raise KQLError(f"Unexpected '{self._peek()[1]}'.")
+        return operators
+
+    def _operator(self) -> Operator:
+        name = self._word()
+        if name == "where":
+            return Where(self._or())
+        if name == "project":
+            columns = [self._project_item()]
+            while self._accept(","):
+                columns.append(self._project_item())
+            return Project(columns)
+        if name == "summarize":
+            alias = "count_"
+            if self.tokens[self.position + 1:self.position + 2] == [("op", "=")]:
+                alias = self._word()
+                self._expect("=")
+            self._expect("count")
+            self._expect("(")
+            self._expect(")")
+            by: List[str] = []
+            if self._accept("by"):
+                by.append(self._word())
+                while self._accept(","):
+                    by.append(self._word())
+            return Summarize(alias, by)
+        if name == "count":
+            return Summarize("Count", [])
+        if name in ("order", "sort"):
+            self._expect("by")
+            keys = [self._order_key()]
+            while self._accept(","):
+                keys.append(self._order_key())
+            return OrderBy(keys)
+        if name in ("take", "limit"):
+            kind, value = self._next()
+            if kind != "number" or not isinstance(value, int) or value < 0:
+                raise KQLError(f"'{name}' expects a non-negative integer.")
+            return Take(value)
+        raise KQLError(f"Unsupported operator '{name}'.")
+
+    def _project_item(self) -> Tuple[str, str]:
+        source = self._word()
+        if self._accept("="):
+            return source, self._word()
+        return source.replace(".", "_"), source
+
+    def _order_key(self) -> Tuple[str, bool]:
+        column = self._word()
+        if self._accept("asc"):
+            return column, False
+        self._accept("desc")
+        # KQL sorts in descending order unless told otherwise.
+        return column, True
+
+    def _or(self) -> tuple:
+        left = self._and()
+        while self._accept("or"):
+            left = ("or", left, self._and())
+        return left
+
+    def _and(self) -> tuple:
+        left = self._unary()
+        while self._accept("and"):
+            left = ("and", left, self._unary())
+        return left
+
+    def _unary(self) -> tuple:
+        if self._accept("not"):
+            self._expect("(")
+            inner = self._or()
+            self._expect(")")
+            return ("not", inner)
+        if self._accept("("):
+            inner = self._or()
+            self._expect(")")
+            return inner
+        return self._comparison()
+
+    def _comparison(self) -> tuple:
+        column = self._word()
+        if column in ("isempty", "isnotempty"):
+            self._expect("(")
+            argument = self._word()
+            self._expect(")")
+            return ("empty", argument, column == "isnotempty")
+
+        kind, op = self._next()
+        if op not in _COMPARISONS:
+            raise KQLError(f"Unsupported comparison '{op}'.")
+        if op.lstrip("!").startswith("in"):
+            self._expect("(")
+            values = [self._literal()]
+            while self._accept(","):
+                values.append(self._literal())
+            self._expect(")")
+            return ("cmp", op, column, values)
+        return ("cmp", op, column, self._literal())
+
+    def _literal(self) -> Any:
+        kind, value = self._next()
+        if kind not in ("string", "number"):
+            raise KQLError(f"Expected a literal but found '{value}'.")
+        return value
+
+def parse(query: str) -> List[Operator]:
+    """
+    Parses a query into its list of tabular operators.
+
+    Raises:
+        KQLError: If the query is invalid or unsupported.
+    """
+    return _Parser(query).parse()
+
+# --- Compilation ------------------------------------------------------------
+
+BASE_COLUMNS = ["id", "name", "type", "location", "resourceGroup", "subscriptionId"]
+TYPE_COLUMNS = sorted({column for resource_type in RESOURCE_TYPES for column in resource_type.columns})
+FLAT_COLUMNS = BASE_COLUMNS + TYPE_COLUMNS
+DEFAULT_OUTPUT = BASE_COLUMNS + sorted({column.split(".")[0] for column in TYPE_COLUMNS})
+# Columns that are stored as a single value but are lists in the ARM shape.
+# Characters that separate the terms `has` matches: those occurring in
+# resource names, IDs and the properties queries can filter on. Kept short,
+# as each is one nested REPLACE in SQL.
+TERM_SEPARATORS = " /-_.:,;()"
+
+LIST_COLUMNS = {"properties.addressSpace.addressPrefixes"}
+# Columns whose values are lower-cased, so =~ can compare them directly.
+LOWERCASE_COLUMNS = {"type", "resourceGroup"}
+
+def _label(column: str) -> str:
+    return "c_" + column.replace(".", "__")
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _terms(value: str) -> str:
+    """
+    Returns `value` with each term separator replaced by a space.
+    """
+    return "".join(" " if char in TERM_SEPARATORS else char for char in value)
+
+def _terms_column(column: ColumnElement) -> ColumnElement:
+    """
+    The SQL counterpart of `_terms`, padded with a space at either end.
+    """
+    for char in TERM_SEPARATORS:
+        if char != " ":
+            column = func.replace(column, char, " ", type_=String)
+    return literal(" ") + column + literal(" ")
+
+def _has(text: str, value: str) -> bool:
+    """
+    Whether `text` has the terms of `value`, as the `has` operator.
+    """
+    phrase = _terms(value).strip()
+    return not phrase or f" {phrase} " in f" {_terms(text)} "
+
+def _has_pattern(value: str) -> str:
+    """
+    A LIKE pattern for the output of `_terms_column`, matching as `_has`.
+    """
+    phrase = _terms(value).strip()
+    return f"% {_like_escape(phrase)} %" if phrase else "%"
+
+class _Relation:
+    """
+    The columns of the current intermediate result, by KQL column name.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, ColumnElement],
+        outputs: List[str],
+        lowercase: Set[str],
+        lists: Set[str],
+        source=None,
+        keys: Optional[Dict[str, ColumnElement]] = None,
+    ):
+        self.columns = columns
+        self.outputs = outputs
+        self.lowercase = lowercase
+        self.lists = lists
+        # The subquery the columns are selected from, if any.
+        self.source = source
+        # Indexed, lower-cased equivalents of columns, which equality
+        # comparisons use to find rows; only known for table columns.
+        self.keys = keys or {}
+
+    def column(self, name: str) -> ColumnElement:
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KQLError(f"Unknown column '{name}'.") from None
+
+    def select(self) -> Select:
+        return select(*[expression.label(_label(name)) for name, expression in self.columns.items()])
+
+    def wrap(self, statement: Select) -> "_Relation":
+        subquery = statement.subquery()
+        columns = {name: subquery.c[_label(name)] for name in self.columns}
+        return _Relation(columns, self.outputs, self.lowercase, self.lists, subquery)
+
+def _compile_predicate(predicate: tuple, relation: _Relation) -> ColumnElement:
+    kind = predicate[0]
+    if kind == "and":
+        return and_(_compile_predicate(predicate[1], relation), _compile_predicate(predicate[2], relation))
+    if kind == "or":
+        return or_(_compile_predicate(predicate[1], relation), _compile_predicate(predicate[2], relation))
+    if kind == "not":
+        return not_(_compile_predicate(predicate[1], relation))
+    if kind == "empty":
+        column = relation.column(predicate[1])
+        empty = or_(column.is_(None), column == "")
+        return not_(empty) if predicate[2] else empty
+
+    _, op, name, value = predicate
+    column = relation.column(name)
+    negate = op.startswith("!") and op not in ("!=", "!~")
+    base_op = op.lstrip("!") if negate else op
+    case_insensitive = base_op in ("=~", "!~", "in~", "contains", "has", "startswith", "endswith")
+    if case_insensitive:
+        if name not in relation.lowercase:
+            column = func.lower(column)
+        value = [v.lower() if isinstance(v, str) else v for v in value] if isinstance(value, list) else (
+            value.lower() if isinstance(value, str) else value
+        )
+
+    key = relation.keys.get(name)
+    values = value if isinstance(value, list) else [value]
+    if key is not None and base_op in ("==", "=~", "in", "in~") and all(isinstance(v, str) for v in values):
+        lowered = [v.lower() for v in values]
+        if base_op in ("==", "=~"):
+            key_match = key == lowered[0]
+        else:
+            key_match = key.in_(lowered)
+        if case_insensitive:
+            expression = key_match
+        else:
+            # The key finds the rows; the column decides the exact case.
+            expression = and_(key_match, column == value if base_op == "==" else column.in_(value))
+    elif base_op in ("==", "=~"):
+        expression = column == value
+    elif base_op in ("!=", "!~"):
+        expression = column != value
+    elif base_op == "<":
+        expression = column < value
+    elif base_op == "<=":
+        expression = column <= value
+    elif base_op == ">":
+        expression = column > value
+    elif base_op == ">=":
+        expression = column >= value
+    elif base_op in ("in", "in~"):
+        expression = column.in_(value)
+    elif base_op == "contains":
+        expression = column.like(f"%{_like_escape(str(value))}%", escape="\\")
+    elif base_op == "has":
+        expression = _terms_column(column).like(_has_pattern(str(value)), escape="\\")
+    elif base_op == "startswith":
+        expression = column.like(f"{_like_escape(str(value))}%", escape="\\")
+    else:  # endswith
+        expression = column.like(f"%{_like_escape(str(value))}", escape="\\")
+    return not_(expression) if negate else expression
+
+def _matches_type(predicate: tuple, type_value: str) -> Optional[bool]:
+    """
+    Evaluates the parts of a predicate that test the `type` column against a
+    known type. Returns None when the outcome depends on other columns.
+    """
+    kind = predicate[0]
+    if kind in ("and", "or"):
+        left = _matches_type(predicate[1], type_value)
+        right = _matches_type(predicate[2], type_value)
+        if kind == "and":
+            if left is False or right is False:
+                return False
+            return True if left and right else None
+        if left is True or right is True:
+            return True
+        return False if left is False and right is False else None
+    if kind == "not":
+        inner = _matches_type(predicate[1], type_value)
+        return None if inner is None else not inner
+    if kind != "cmp" or predicate[2] != "type":
+        return None
+
+    _, op, _, value = predicate
+    negate = op.startswith("!") and op not in ("!=", "!~")
+    base_op = op.lstrip("!") if negate else op
+    values = value if isinstance(value, list) else [value]
+    if any(not isinstance(v, str) for v in values):
+        return None
+    if base_op not in ("==", "!="):
+        values = [v.lower() for v in values]
+
+    if base_op in ("==", "=~"):
+        result = type_value == values[0]
+    elif base_op in ("!=", "!~"):
+        result = type_value != values[0]
+    elif base_op in ("in", "in~"):
+        result = type_value in values
+    elif base_op == "contains":
+        result = values[0] in type_value
+    elif base_op == "has":
+        result = _has(type_value, values[0])
+    elif base_op == "startswith":
+        result = type_value.startswith(values[0])
+    elif base_op == "endswith":
+        result = type_value.endswith(values[0])
+    else:
+        return None
+    return not result if negate else result
+
+def _branch_columns(resource_type: ResourceType) -> Dict[str, ColumnElement]:
+    model = resource_type.model
+    columns: Dict[str, ColumnElement] = {
+        "id": (
+            literal("/subscriptions/") + model.subscription_id
+            + literal("/resourceGroups/") + model.resource_group
+            + literal(f"/providers/{resource_type.full_type}/") + model.name
+        ),
+        "name": model.name,
+        "type": literal(resource_type.full_type.lower()),
+        "location": model.location,
+        "resourceGroup": func.lower(model.resource_group),
+        "subscriptionId": model.subscription_id,
+    }
+    for column in TYPE_COLUMNS:
+        attribute = resource_type.columns.get(column)
+        columns[column] = getattr(model, attribute) if attribute else cast(null(), String)
+    return columns
+
+class CompiledQuery(NamedTuple):
+    statement: Optional[Select]  # None when no table can match
+    relation: Optional[_Relation]
+    order_by: List[ColumnElement]
+
+def compile_query(operators: List[Operator], subscriptions: Optional[List[str]] = None) -> CompiledQuery:
+    """
+    Compiles parsed operators into a SQL statement over all resource tables,
+    optionally restricted to a set of subscriptions.
+    """
+    leading: List[tuple] = []
+    remaining = list(operators)
+    while remaining and isinstance(remaining[0], Where):
+        leading.append(remaining.pop(0).predicate)
+
+    branches = []
+    for resource_type in RESOURCE_TYPES:
+        type_value = resource_type.full_type.lower()
+        if any(_matches_type(predicate, type_value) is False for predicate in leading):
+            continue
+        branch = _Relation(
+            _branch_columns(resource_type), DEFAULT_OUTPUT, LOWERCASE_COLUMNS, LIST_COLUMNS,
+            keys={"id": resource_type.model.resource_id_key},
+        )
+        statement = branch.select()
+        for predicate in leading:
+            statement = statement.where(_compile_predicate(predicate, branch))
+        if subscriptions:
+            statement = statement.where(resource_type.model.subscription_id.in_(subscriptions))
+        branches.append(statement)
+
+    if not branches:
+        return CompiledQuery(None, None, [])
+
+    combined = union_all(*branches) if len(branches) > 1 else branches[0]
+    template = _Relation({name: None for name in FLAT_COLUMNS}, DEFAULT_OUTPUT, LOWERCASE_COLUMNS, LIST_COLUMNS)
+    relation = template.wrap(combined)
+    order_keys: List[Tuple[str, bool]] = []
+
+    for operator in remaining:
+        if isinstance(operator, Where):
+            relation = relation.wrap(relation.select().where(_compile_predicate(operator.predicate, relation)))
+        elif isinstance(operator, OrderBy):
+            for name, _ in operator.keys:
+                relation.column(name)
+            order_keys = operator.keys
+        elif isinstance(operator, Take):
+            statement = relation.select().order_by(*_order_clauses(relation, order_keys)).limit(operator.count)
+            relation = relation.wrap(statement)
+        elif isinstance(operator, Project):
+            relation = _project(relation, operator)
+            order_keys = [key for key in order_keys if key[0] in relation.columns]
+        elif isinstance(operator, Summarize):
+            relation = _summarize(relation, operator)
+            order_keys = []
+
+    return CompiledQuery(relation.select(), relation, _order_clauses(relation, order_keys))
+
+def _order_clauses(relation: _Relation, order_keys: List[Tuple[str, bool]]) -> List[ColumnElement]:
+    if order_keys:
+        return [relation.column(name).desc() if descending else relation.column(name).asc() for name, descending in order_keys]
+    # Without an explicit order, sort by id (or all columns) so that paging
+    # with $skipToken is stable.
+    if "id" in relation.columns:
+        return [relation.columns["id"]]
+    return list(relation.columns.values())
+
+def _project(relation: _Relation, operator: Project) -> _Relation:
+    columns: Dict[str, ColumnElement] = {}
+    outputs: List[str] = []
+    lowercase: Set[str] = set()
+    lists: Set[str] = set()
+    for alias, source in operator.columns:
+        matched = [name for name in relation.columns if name == source or name.startswith(source + ".")]
+        if not matched:
+            raise KQLError(f"Unknown column '{source}'.")
+        for name in matched:
+            target = alias + name[len(source):]
+            columns[target] = relation.columns[name]
+            if name in relation.lowercase:
+                lowercase.add(target)
+            if name in relation.lists:
+                lists.add(target)
+        outputs.append(alias)
+    projected = _Relation(columns, outputs, lowercase, lists)
+    return projected.wrap(projected.select())
+
+def _summarize(relation: _Relation, operator: Summarize) -> _Relation:
+    group_columns = [relation.column(name) for name in operator.by]
+    columns: Dict[str, ColumnElement] = {}
+    lowercase: Set[str] = set()
+    for name, column in zip(operator.by, group_columns):
+        alias = name.replace(".", "_")
+        columns[alias] = column
+        if name in relation.lowercase:
+            lowercase.add(alias)
+    columns[operator.alias] = func.count()
+    summarized = _Relation(columns, list(columns), lowercase, set())
+    # Select from the input explicitly: a bare count() has no FROM clause.
+    return summarized.wrap(summarized.select().select_from(relation.source).group_by(*group_columns))
+
+def shape_row(row: Dict[str, Any], relation: _Relation) -> Dict[str, Any]:
+    """
+    Converts a result row into an object, nesting dotted columns
+    (e.g. 'sku.name') under their top-level output column.
+    """
+    result: Dict[str, Any] = {}
+    for output in relation.outputs:
+        if output in relation.columns:
+            value = row[_label(output)]
+            result[output] = [value] if output in relation.lists and value is not None else value
+            continue
+
+        nested: Optional[Dict[str, Any]] = None
+        prefix = output + "."
+        for name in relation.columns:
+            if not name.startswith(prefix):
+                continue
+            value = row[_label(name)]
+            if value is None:
+                continue
+            if name in relation.lists:
+                value = [value]
+            if nested is None:
+                nested = {}
+            target = nested
+            *parents, leaf = name[len(prefix):].split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = value
+        result[output] = nested
+    return result
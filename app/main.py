@@ -6,11 +6,19 @@ FastAPI application instance.
 """
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from sqlmodel import create_engine
+from sqlmodel import Session
 
-from app.services import compute, networking, storage
-from app.db import create_db_and_tables
+from app.services import blob, changes, compute, mock, networking, providers, queue, references, resourcegraph, storage
+from app.changefeed import BROKER, PollingChangeListener, PostgresChangeListener
+from app.db import create_db_and_tables, create_db_engine
 from app.config import get_settings
+from app.errors import AzureError, StorageError, azure_error_handler, storage_error_handler
+from app.metrics import MetricsMiddleware, metrics_endpoint
+from app.provider_catalog import ProviderCatalog
+from app.queuestore import QueueStore
+from app.references import REFERENCE_GRAPH, follow_changes
+from app.spec_index import SpecIndex, SpecWatcher
+from app.throttling import RateLimitHeadersMiddleware, create_buckets
 
 def create_app() -> FastAPI:
     """
@@ -23,17 +31,71 @@ def create_app() -> FastAPI:
         Handles application startup and shutdown events.
         On startup, it creates the settings, the database engine, and the tables.
         The engine is stored in the application state to be accessible by dependencies.
+
+        With several workers, each runs this in its own process after the
+        workers were started, so every worker gets its own engine and pool.
+        An engine already bound to the app, as by the benchmark harness, is
+        used instead of the configured database.
         """
         print("--- Application starting up ---")
         settings = get_settings()
-        engine = create_engine(settings.DATABASE_URL, echo=True)
-        app.state.engine = engine
+        engine = getattr(app.state, "engine", None)
+        if engine is None:
+            engine = create_db_engine(settings)
+            app.state.engine = engine
 
         print("Creating database and tables...")
         create_db_and_tables(engine)
         print("Database and tables created successfully.")
+        with Session(engine) as session:
+            REFERENCE_GRAPH.load(session)
+
+        print("Indexing API specifications...")
+        spec_index = SpecIndex(settings.SPEC_SERVICES, compile_validators=settings.VALIDATE_REQUEST_BODIES)
+        spec_index.refresh()
+        app.state.spec_index = spec_index
+        print(f"Indexed {spec_index.snapshot.file_count} API specification files.")
+        def use_provider_catalog(snapshot):
+            app.state.provider_catalog = ProviderCatalog.build(snapshot.endpoints)
+        use_provider_catalog(spec_index.snapshot)
+        spec_index.add_listener(use_provider_catalog)
+        if settings.VALIDATE_REQUEST_BODIES:
+            def use_validators(snapshot):
+                app.state.request_validators = snapshot.request_validators
+                app.state.request_validators_by_version = snapshot.request_validators_by_version
+            use_validators(spec_index.snapshot)
+            spec_index.add_listener(use_validators)
+        spec_watcher = None
+        if settings.SPEC_WATCH:
+            spec_watcher = SpecWatcher(spec_index, interval=settings.SPEC_WATCH_INTERVAL)
+            spec_watcher.start()
+
+        app.state.queue_store = QueueStore(settings.QUEUE_STORAGE_PATH, fsync=settings.QUEUE_FSYNC)
+        if settings.THROTTLING_ENABLED:
+            app.state.throttle_buckets = create_buckets(settings)
+
+        # With PostgreSQL, change events from every worker arrive by NOTIFY;
+        # other workers' changes to a SQLite database are polled for.
+        change_listener = None
+        if engine.dialect.name == "postgresql":
+            change_listener = PostgresChangeListener(engine)
+        elif settings.WEB_CONCURRENCY > 1:
+            change_listener = PollingChangeListener(engine)
+        if change_listener is not None:
+            # Keep the reference graph in step with the other workers.
+            reference_follower = follow_changes(engine)
+            BROKER.add_listener(reference_follower)
+            change_listener.start()
         yield
         print("--- Application shutting down ---")
+        if change_listener is not None:
+            change_listener.stop()
+            BROKER.remove_listener(reference_follower)
+        if spec_watcher is not None:
+            spec_watcher.stop()
+        app.state.queue_store.close()
+        if settings.THROTTLING_ENABLED:
+            app.state.throttle_buckets.close()
 
     app = FastAPI(
         title="Azure Emulator",
@@ -42,10 +104,27 @@ def create_app() -> FastAPI:
         lifespan=lifespan,
     )
 
+    app.add_exception_handler(AzureError, azure_error_handler)
+    app.add_exception_handler(StorageError, storage_error_handler)
+
+    settings = get_settings()
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware, tracing=settings.TRACING_ENABLED)
+        app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], tags=["Observability"], include_in_schema=False)
+    if settings.THROTTLING_ENABLED:
+        app.add_middleware(RateLimitHeadersMiddleware)
+
     # Include the routers from the service modules.
     app.include_router(compute.router)
     app.include_router(networking.router)
     app.include_router(storage.router)
+    app.include_router(blob.router)
+    app.include_router(queue.router)
+    app.include_router(providers.router)
+    app.include_router(providers.metadata_router)
+    app.include_router(resourcegraph.router)
+    app.include_router(changes.router)
+    app.include_router(references.router)
 
     @app.get("/", tags=["Root"])
     def read_root():
@@ -54,4 +133,8 @@ def create_app() -> FastAPI:
         """
         return {"message": "Welcome to the Azure Emulator"}
 
+    # Stored resources by ID, else mock responses from the API specs, for
+    # every other GET; must come last.
+    app.include_router(mock.router)
+
     return app
@@ -0,0 +1,285 @@
+"""
+Prometheus metrics and optional tracing for the emulator.
+
+Metrics live in a process-wide registry and are exported in the Prometheus
+text format on `/metrics`. Recording goes through label handles that are
+bound once and cached, so the hot path is a dict lookup and an increment
+instead of building label sets per request.
+
+If OpenTelemetry is installed and `TRACING_ENABLED` is set, every request is
+also wrapped in a server span named after its route template.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, List, Sequence, Tuple
+
+from fastapi import Response
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Tracing is optional.
+    trace = None
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    """
+    Base class for a metric family with a fixed set of label names.
+
+    Children are lock-free by default, which is safe for metrics that are
+    only recorded on the event loop thread. Metrics recorded from the
+    threadpool (sync dependencies and routes) must pass `threadsafe=True`.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), threadsafe: bool = False):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.threadsafe = threadsafe
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """
+        Returns the child for a set of label values, creating it on first use.
+        Callers on hot paths should keep the returned handle.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+class _LockedCounterChild(_CounterChild):
+    __slots__ = ("_lock",)
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+class _LockedGaugeChild(_LockedCounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # One slot per bucket plus the implicit +Inf bucket.
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+class _LockedHistogramChild(_HistogramChild):
+    __slots__ = ("_lock",)
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        super().__init__(upper_bounds)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _LockedCounterChild() if self.threadsafe else _CounterChild()
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _LockedGaugeChild() if self.threadsafe else _GaugeChild()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        threadsafe: bool = False,
+    ):
+        super().__init__(name, documentation, labelnames, threadsafe)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        if self.threadsafe:
+            return _LockedHistogramChild(self.upper_bounds)
+        return _HistogramChild(self.upper_bounds)
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramChild) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """
+    A collection of metrics rendered together on `/metrics`.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "emulator_http_requests_total", "Total HTTP requests by method, route and status code.",
+    ("method", "route", "status"),
+))
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "emulator_http_request_duration_seconds", "HTTP request latency by method and route.",
+    ("method", "route"),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "emulator_http_requests_in_flight", "HTTP requests currently being served.",
+))
+DB_SESSION_HOLD = REGISTRY.register(Histogram(
+    "emulator_db_session_hold_seconds", "Time a database session from get_session is held open.",
+    threadsafe=True,
+))
+AUTH_FAILURES = REGISTRY.register(Counter(
+    "emulator_auth_failures_total", "Requests rejected by verify_token, by reason.",
+    ("reason",),
+    threadsafe=True,
+))
+
+def metrics_endpoint() -> Response:
+    """
+    Exports all registered metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, latency and in-flight requests
+    per route template, optionally inside an OpenTelemetry span.
+    """
+
+    def __init__(self, app, tracing: bool = False):
+        self.app = app
+        self.tracer = trace.get_tracer("cloudmockery") if tracing and trace is not None else None
+        self._in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+        # (method, route, status) -> (counter child, histogram child)
+        self._handles: Dict[Tuple[str, str, int], Tuple[_CounterChild, _HistogramChild]] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        span = None
+        if self.tracer is not None:
+            span = self.tracer.start_span(scope["method"], kind=trace.SpanKind.SERVER)
+
+        self._in_flight.inc()
+        start = time.perf_counter()
+        try:
+            with trace.use_span(span, end_on_exit=False) if span is not None else nullcontext():
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._in_flight.dec()
+
+            route = scope.get("route")
+            route_path = route.path if route is not None else "<unmatched>"
+            key = (scope["method"], route_path, status_code)
+            handles = self._handles.get(key)
+            if handles is None:
+                handles = self._handles[key] = (
+                    HTTP_REQUESTS.labels(scope["method"], route_path, str(status_code)),
+                    HTTP_REQUEST_DURATION.labels(scope["method"], route_path),
+                )
+            handles[0].inc()
+            handles[1].observe(elapsed)
+
+            if span is not None:
+                span.update_name(f"{scope['method']} {route_path}")
+                span.set_attribute("http.request.method", scope["method"])
+                span.set_attribute("http.route", route_path)
+                span.set_attribute("http.response.status_code", status_code)
+                span.end()
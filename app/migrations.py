@@ -0,0 +1,143 @@
+"""
+Upgrades of databases created by earlier releases.
+
+`SQLModel.metadata.create_all` creates missing tables but never changes
+existing ones. Each function in `MIGRATIONS` upgrades a database by one
+schema version; `migrate` runs those a database has not had yet, each in
+its own transaction together with recording the new version in
+`SchemaVersion`. New databases are created at the latest version.
+
+Version 0 is the schema of the first release, which had no `SchemaVersion`
+table.
+"""
+from typing import Callable, List, Optional
+
+from sqlalchemy import Table, bindparam, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from app.models import SchemaVersion, StorageAccount, VirtualMachine, VirtualNetwork
+from app.resource_types import resource_type_of
+
+def _rebuild_sqlite_table(connection: Connection, table: Table) -> None:
+    """
+    Recreates a table as currently defined, keeping its rows, since SQLite
+    cannot change the constraints of an existing table. The table must
+    already have all of the defined columns. Follows SQLite's procedure for
+    other kinds of table schema changes, so foreign keys must be disabled.
+    """
+    new_name = f"{table.name}_new"
+    # Index names are database-wide; they are created again at the end.
+    index_names = connection.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"),
+        {"table": table.name},
+    ).scalars().all()
+    for index_name in index_names:
+        connection.exec_driver_sql(f'DROP INDEX "{index_name}"')
+    create = str(CreateTable(table).compile(dialect=connection.dialect)).strip()
+    connection.exec_driver_sql(create.replace(f"CREATE TABLE {table.name} ", f'CREATE TABLE "{new_name}" ', 1))
+    columns = ", ".join(f'"{column.name}"' for column in table.columns)
+    connection.exec_driver_sql(f'INSERT INTO "{new_name}" ({columns}) SELECT {columns} FROM "{table.name}"')
+    connection.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{new_name}" RENAME TO "{table.name}"')
+    for index in table.indexes:
+        index.create(connection)
+
+def _add_subscription_and_keys(connection: Connection) -> None:
+    """
+    Version 1: resources are identified by subscription, resource group and
+    name, and store the hash of their last PUT and their lower-cased ID.
+    Existing resources were created without a subscription and keep an
+    empty one.
+    """
+    for model, constraint in [
+        (VirtualMachine, "unique_vm_in_rg"),
+        (VirtualNetwork, "unique_vnet_in_rg"),
+        (StorageAccount, "unique_sa_in_rg"),
+    ]:
+        table: Table = model.__table__
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for column, definition in [
+            ("subscription_id", "VARCHAR NOT NULL DEFAULT ''"),
+            ("content_hash", "VARCHAR"),
+            ("resource_id_key", "VARCHAR"),
+        ]:
+            if column not in existing:
+                connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {column} {definition}')
+
+        if connection.dialect.name == "sqlite":
+            _rebuild_sqlite_table(connection, table)
+        else:
+            connection.exec_driver_sql(f'ALTER TABLE "{table.name}" DROP CONSTRAINT IF EXISTS {constraint}')
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD CONSTRAINT {constraint} UNIQUE (subscription_id, resource_group, name)'
+            )
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+        resource_type = resource_type_of(model)
+        rows = connection.execute(select(table.c.id, table.c.subscription_id, table.c.resource_group, table.c.name)).all()
+        if rows:
+            connection.execute(
+                update(table).where(table.c.id == bindparam("row_id")).values(resource_id_key=bindparam("key")),
+                [
+                    {"row_id": row.id, "key": resource_type.resource_id_key(row.subscription_id, row.resource_group, row.name)}
+                    for row in rows
+                ],
+            )
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _add_subscription_and_keys,
+]
+
+def _stored_version(connection: Connection) -> Optional[int]:
+    """
+    Returns the schema version of the database, or None if it is new.
+    """
+    inspector = inspect(connection)
+    if inspector.has_table(SchemaVersion.__tablename__):
+        return connection.execute(select(SchemaVersion.version)).scalar()
+    if inspector.has_table(VirtualMachine.__tablename__):
+        return 0
+    return None
+
+def _record_version(connection: Connection, version: int) -> None:
+    connection.execute(SchemaVersion.__table__.delete())
+    connection.execute(SchemaVersion.__table__.insert().values(version=version))
+
+def migrate(engine: Engine) -> int:
+    """
+    Upgrades the database to the latest schema version, or records that
+    version for a new database. Must be run holding `app.db.schema_lock`,
+    before the missing tables are created.
+
+    Returns:
+        The number of migrations run.
+    """
+    with engine.begin() as connection:
+        version = _stored_version(connection)
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+        if version is None:
+            _record_version(connection, len(MIGRATIONS))
+            return 0
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.connect() as connection:
+            if engine.dialect.name != "sqlite":
+                with connection.begin():
+                    migration(connection)
+                    _record_version(connection, number)
+                continue
+            # Foreign keys can only be switched off outside a transaction, so
+            # this is done on the driver's connection before SQLAlchemy begins.
+            driver_connection = connection.connection.driver_connection
+            foreign_keys = driver_connection.execute("PRAGMA foreign_keys").fetchone()[0]
+            driver_connection.execute("PRAGMA foreign_keys = OFF")
+            try:
+                with connection.begin():
+                    migration(connection)
+                    if connection.exec_driver_sql("PRAGMA foreign_key_check").first() is not None:
+                        raise RuntimeError(f"Schema migration {number} left foreign keys without their rows")
+                    _record_version(connection, number)
+            finally:
+                driver_connection.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    return len(MIGRATIONS) - version
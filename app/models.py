@@ -4,12 +4,20 @@ SQLModel definitions for database tables.
 This module contains the class definitions for all database models, which
 SQLModel uses to interact with the database tables.
 """
+from datetime import datetime, timezone
 from typing import Optional, List
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint, func, text
 from sqlmodel import Field, SQLModel, Relationship
 
 class VirtualMachine(SQLModel, table=True):
-    __table_args__ = (UniqueConstraint("name", "resource_group", name="unique_vm_in_rg"),)
+    __table_args__ = (
+        UniqueConstraint("subscription_id", "resource_group", "name", name="unique_vm_in_rg"),
+        # Case-insensitive lookups, as used by Resource Graph queries.
+        Index("ix_virtualmachine_lower_name", func.lower(text("name"))),
+        Index("ix_virtualmachine_lower_resource_group", func.lower(text("resource_group"))),
+        # Lookups by resource ID; see app.resource_types.
+        Index("ix_virtualmachine_resource_id_key", "resource_id_key", postgresql_using="hash"),
+    )
     """
     Represents a virtual machine resource in the database.
     """
@@ -22,6 +30,9 @@ class VirtualMachine(SQLModel, table=True):
     # The name of the resource group the VM belongs to. Also indexed.
     resource_group: str = Field(index=True)
 
+    # The subscription the VM was created in. Indexed for cross-group queries.
+    subscription_id: str = Field(default="", index=True)
+
     # The Azure region where the VM is located.
     location: str
 
@@ -31,6 +42,12 @@ class VirtualMachine(SQLModel, table=True):
     # The provisioning state of the resource (e.g., "Succeeded", "Failed").
     provisioning_state: str = "Succeeded"
 
+    # Hash of the last PUT body; see app.content_hash. Not part of responses.
+    content_hash: Optional[str] = Field(default=None, exclude=True)
+
+    # The lower-cased resource ID, set on every write. Not part of responses.
+    resource_id_key: Optional[str] = Field(default=None, exclude=True)
+
 
 class Subnet(SQLModel, table=True):
     """Represents a subnet within a virtual network."""
@@ -45,24 +62,115 @@ class Subnet(SQLModel, table=True):
 
 
 class VirtualNetwork(SQLModel, table=True):
-    __table_args__ = (UniqueConstraint("name", "resource_group", name="unique_vnet_in_rg"),)
+    __table_args__ = (
+        UniqueConstraint("subscription_id", "resource_group", "name", name="unique_vnet_in_rg"),
+        Index("ix_virtualnetwork_lower_name", func.lower(text("name"))),
+        Index("ix_virtualnetwork_lower_resource_group", func.lower(text("resource_group"))),
+        # Lookups by resource ID; see app.resource_types.
+        Index("ix_virtualnetwork_resource_id_key", "resource_id_key", postgresql_using="hash"),
+    )
     """Represents a virtual network resource in the database."""
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     resource_group: str = Field(index=True)
+    subscription_id: str = Field(default="", index=True)
     location: str
     address_space: str
+    content_hash: Optional[str] = Field(default=None, exclude=True)
+    resource_id_key: Optional[str] = Field(default=None, exclude=True)
 
     # The one-to-many relationship to subnets
     subnets: List["Subnet"] = Relationship(back_populates="virtual_network")
 
 
 class StorageAccount(SQLModel, table=True):
-    __table_args__ = (UniqueConstraint("name", "resource_group", name="unique_sa_in_rg"),)
+    __table_args__ = (
+        UniqueConstraint("subscription_id", "resource_group", "name", name="unique_sa_in_rg"),
+        Index("ix_storageaccount_lower_name", func.lower(text("name"))),
+        Index("ix_storageaccount_lower_resource_group", func.lower(text("resource_group"))),
+        # Lookups by resource ID; see app.resource_types.
+        Index("ix_storageaccount_resource_id_key", "resource_id_key", postgresql_using="hash"),
+    )
     """Represents a storage account resource in the database."""
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     resource_group: str = Field(index=True)
+    subscription_id: str = Field(default="", index=True)
     location: str
     sku: str  # e.g., "Standard_LRS", "Premium_LRS"
     kind: str  # e.g., "StorageV2", "BlobStorage"
+    content_hash: Optional[str] = Field(default=None, exclude=True)
+    resource_id_key: Optional[str] = Field(default=None, exclude=True)
+
+
+class ResourceChange(SQLModel, table=True):
+    """
+    Records a create, update or delete of a resource for the change feed.
+
+    The auto-incrementing id doubles as the event sequence number that
+    change feed clients resume from.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_time: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    change_type: str  # "Create", "Update" or "Delete"
+    subscription_id: str = Field(index=True)
+    resource_group: str
+    resource_type: str
+    name: str
+    resource_id: str
+
+
+class ResourceReference(SQLModel, table=True):
+    """
+    A reference from a resource to another resource's ID, found in the
+    properties of the referencing resource's last PUT. The keys are the
+    lower-cased IDs; see app.references.
+    """
+    __table_args__ = (
+        Index("ix_resourcereference_source_key", "source_key", postgresql_using="hash"),
+        Index("ix_resourcereference_target_key", "target_key", postgresql_using="hash"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    source_key: str
+    source_id: str
+    target_key: str
+    target_id: str
+
+
+class BlobContainer(SQLModel, table=True):
+    """
+    A container in a storage account's blob service.
+    """
+    __table_args__ = (
+        UniqueConstraint("account_name", "name", name="unique_container_in_account"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    account_name: str = Field(index=True)
+    name: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Blob(SQLModel, table=True):
+    """
+    Metadata of a block blob. The content is stored as a file under
+    `BLOB_STORAGE_PATH`; see `app.services.blob`.
+    """
+    __table_args__ = (
+        UniqueConstraint("account_name", "container_name", "name", name="unique_blob_in_container"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    account_name: str
+    container_name: str
+    name: str
+    content_type: str
+    size: int
+    etag: str
+    last_modified: datetime
+
+
+class SchemaVersion(SQLModel, table=True):
+    """
+    The version of the database schema, as upgraded by app.migrations. Holds
+    a single row.
+    """
+    version: int = Field(primary_key=True)
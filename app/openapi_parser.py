@@ -3,14 +3,103 @@ Parses Azure REST API OpenAPI specifications.
 
 This module provides a class to parse OpenAPI specification files from the
 'azure-rest-api-specs' repository. It extracts information about API endpoints,
-focusing on GET requests, and can generate mock data from response schemas.
+focusing on GET requests and PUT request bodies, and can generate mock data
+from response schemas.
 """
 import os
 import json
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 
 from app.config import get_settings
 
+class SchemaInterner:
+    """
+    Hash-conses JSON values so that structurally equal objects are shared.
+
+    Each API version of a service ships its own copy of largely identical
+    definitions. Loading every version through one interner stores each
+    distinct object, list and string once, with all specifications referring
+    to the shared copy. Values are interned bottom-up, so an object's
+    children are already canonical and an object's identity key only needs
+    the identities of its children.
+
+    Interned values are shared and must never be modified.
+    """
+
+    def __init__(self):
+        self._objects: Dict[Tuple[Any, ...], Any] = {}
+        self._scalars: Dict[Any, Any] = {}
+        self._canonical_ids: Set[int] = set()
+
+    def intern(self, value: Any) -> Any:
+        """
+        Returns the canonical copy of a JSON value.
+        """
+        if isinstance(value, (dict, list)):
+            if id(value) in self._canonical_ids:
+                return value
+            if isinstance(value, dict):
+                return self._intern_object([(self.intern(key), self.intern(item)) for key, item in value.items()])
+            items = [self.intern(item) for item in value]
+            return self._canonical((list,) + tuple(_identity(item) for item in items), lambda: items)
+        if isinstance(value, (str, bytes)):
+            return self._scalars.setdefault(value, value)
+        return value
+
+    def retain(self, roots: Iterable[Any]) -> None:
+        """
+        Forgets every interned value that is not reachable from `roots`, so
+        the values of unloaded specifications can be freed. Values reachable
+        from the roots stay canonical.
+        """
+        live_ids: Set[int] = set()
+        live_scalars: Set[Any] = set()
+        pending = list(roots)
+        while pending:
+            value = pending.pop()
+            if isinstance(value, (dict, list)):
+                if id(value) not in live_ids:
+                    live_ids.add(id(value))
+                    if isinstance(value, dict):
+                        pending.extend(value.keys())
+                        pending.extend(value.values())
+                    else:
+                        pending.extend(value)
+            elif isinstance(value, (str, bytes)):
+                live_scalars.add(value)
+        # A live object's children are live, so the identities in the keys
+        # of the kept objects cannot be reused by new objects.
+        self._objects = {key: value for key, value in self._objects.items() if id(value) in live_ids}
+        self._canonical_ids &= live_ids
+        self._scalars = {key: value for key, value in self._scalars.items() if key in live_scalars}
+
+    def object_pairs_hook(self, pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        """
+        Hook for `json.load`, which builds objects bottom-up: nested objects
+        are already interned, nested lists and strings are not yet.
+        """
+        return self._intern_object([(self.intern(key), self.intern(item)) for key, item in pairs])
+
+    def _intern_object(self, pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        return self._canonical((dict,) + tuple((key, _identity(item)) for key, item in pairs), lambda: dict(pairs))
+
+    def _canonical(self, key: Tuple[Any, ...], build) -> Any:
+        canonical = self._objects.get(key)
+        if canonical is None:
+            canonical = self._objects[key] = build()
+            self._canonical_ids.add(id(canonical))
+        return canonical
+
+def _identity(value: Any) -> Any:
+    """
+    The part of an interning key contributed by one already canonical value:
+    containers by identity, scalars by type and value, so that True, 1 and
+    1.0 stay distinct.
+    """
+    if isinstance(value, (dict, list)):
+        return id(value)
+    return (type(value), value)
+
 class OpenAPIParser:
     """
     Parses Azure REST API OpenAPI specifications for a given service.
@@ -33,9 +122,10 @@ class OpenAPIParser:
             service_name = 'network'
 
         self.service_name = service_name
-        self.service_spec_path = os.path.join(settings.API_SPECS_PATH, self.service_name)
+        self.service_spec_path = os.path.abspath(os.path.join(settings.API_SPECS_PATH, self.service_name))
+        self.resource_manager_path = os.path.join(self.service_spec_path, 'resource-manager')
 
-    def _find_openapi_files(self) -> List[str]:
+    def find_openapi_files(self) -> List[str]:
         """
         Finds all stable OpenAPI specification files for the service.
 
@@ -46,11 +136,10 @@ class OpenAPIParser:
             A list of absolute paths to the found OpenAPI JSON files.
         """
         openapi_files: Set[str] = set()
-        resource_manager_path = os.path.join(self.service_spec_path, 'resource-manager')
-        if not os.path.isdir(resource_manager_path):
+        if not os.path.isdir(self.resource_manager_path):
             return []
 
-        for root, _, files in os.walk(resource_manager_path):
+        for root, _, files in os.walk(self.resource_manager_path):
             if 'stable' in root.split(os.sep):
                 for filename in files:
                     if filename.endswith('.json'):
@@ -58,6 +147,54 @@ class OpenAPIParser:
                         openapi_files.add(file_path)
         return list(openapi_files)
 
+    def owns_file(self, file_path: str) -> bool:
+        """
+        Returns whether a path is one `find_openapi_files` would collect,
+        whether or not it currently exists.
+        """
+        root, filename = os.path.split(file_path)
+        return (
+            filename.endswith('.json')
+            and root.startswith(self.resource_manager_path + os.sep)
+            and 'stable' in root.split(os.sep)
+        )
+
+    def load_spec(self, file_path: str, interner: Optional[SchemaInterner] = None) -> Optional[Dict[str, Any]]:
+        """
+        Loads a single OpenAPI file.
+
+        Args:
+            file_path: The file to load.
+            interner: If given, the specification is built from the values
+                shared through this interner.
+
+        Returns:
+            The parsed specification, or None if the file cannot be read or
+            is not an OpenAPI specification.
+        """
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                spec = json.load(f, object_pairs_hook=interner.object_pairs_hook if interner else None)
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            return None
+
+        if not isinstance(spec, dict) or 'paths' not in spec or ('openapi' not in spec and 'swagger' not in spec):
+            return None
+        return spec
+
+    def _load_specs(self) -> Iterator[Dict[str, Any]]:
+        """
+        Loads every OpenAPI file for the service, skipping unreadable files
+        and documents that are not OpenAPI specifications.
+
+        Yields:
+            The parsed specification of each valid file.
+        """
+        for file_path in self.find_openapi_files():
+            spec = self.load_spec(file_path)
+            if spec is not None:
+                yield spec
+
     def parse(self) -> List[Dict[str, Any]]:
         """
         Parses all found OpenAPI files and extracts GET endpoints.
@@ -67,41 +204,97 @@ class OpenAPIParser:
             path, operationId, and response schema.
         """
         endpoints: List[Dict[str, Any]] = []
-        openapi_files = self._find_openapi_files()
+        for spec in self._load_specs():
+            endpoints.extend(self.get_endpoints(spec))
+        return endpoints
 
-        for file_path in openapi_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    spec = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                continue
+    def get_endpoints(self, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Extracts the GET endpoints of a single specification.
 
-            if 'paths' not in spec or ('openapi' not in spec and 'swagger' not in spec):
-                continue
+        Returns:
+            A list of dictionaries, each representing a GET endpoint with its
+            path, operationId, response schema, and the specification.
+        """
+        endpoints: List[Dict[str, Any]] = []
+
+        for path, path_item in spec.get('paths', {}).items():
+            if 'get' in path_item:
+                get_op = path_item['get']
+                if get_op.get('deprecated'):
+                    continue
+
+                response_200 = get_op.get('responses', {}).get('200', {})
+                if response_200:
+                    schema = None
+                    if 'openapi' in spec:  # OpenAPI 3
+                        schema = response_200.get('content', {}).get('application/json', {}).get('schema')
+                    elif 'swagger' in spec:  # OpenAPI 2
+                        schema = response_200.get('schema')
 
-            for path, path_item in spec.get('paths', {}).items():
-                if 'get' in path_item:
-                    get_op = path_item['get']
-                    if get_op.get('deprecated'):
-                        continue
-
-                    response_200 = get_op.get('responses', {}).get('200', {})
-                    if response_200:
-                        schema = None
-                        if 'openapi' in spec:  # OpenAPI 3
-                            schema = response_200.get('content', {}).get('application/json', {}).get('schema')
-                        elif 'swagger' in spec:  # OpenAPI 2
-                            schema = response_200.get('schema')
-
-                        if schema:
-                            endpoints.append({
-                                'path': path,
-                                'operationId': get_op.get('operationId', f"get_{path.replace('/', '_')}"),
-                                'response_schema': schema,
-                                'spec': spec,
-                            })
+                    if schema:
+                        endpoints.append({
+                            'path': path,
+                            'operationId': get_op.get('operationId', f"get_{path.replace('/', '_')}"),
+                            'response_schema': schema,
+                            'spec': spec,
+                        })
         return endpoints
 
+    def parse_request_schemas(self) -> List[Dict[str, Any]]:
+        """
+        Parses all found OpenAPI files and extracts the request body schema of
+        every PUT operation.
+
+        Returns:
+            A list of dictionaries, each with the path, operationId, request
+            body schema, and the specification the schema belongs to.
+        """
+        operations: List[Dict[str, Any]] = []
+        for spec in self._load_specs():
+            operations.extend(self.get_request_schemas(spec))
+        return operations
+
+    def get_request_schemas(self, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Extracts the request body schema of every PUT operation of a single
+        specification, in the format of `parse_request_schemas`.
+        """
+        operations: List[Dict[str, Any]] = []
+
+        for path, path_item in spec.get('paths', {}).items():
+            put_op = path_item.get('put')
+            if not put_op or put_op.get('deprecated') or 'operationId' not in put_op:
+                continue
+
+            schema = self._request_body_schema(put_op, spec)
+            if schema:
+                operations.append({
+                    'path': path,
+                    'operationId': put_op['operationId'],
+                    'request_schema': schema,
+                    'spec': spec,
+                })
+        return operations
+
+    @staticmethod
+    def _request_body_schema(operation: Dict[str, Any], spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the JSON request body schema of an operation, if it has one.
+        """
+        if 'openapi' in spec:  # OpenAPI 3
+            return operation.get('requestBody', {}).get('content', {}).get('application/json', {}).get('schema')
+
+        # OpenAPI 2 declares the body as an 'in: body' parameter, which may
+        # itself be a reference to a shared parameter definition.
+        for parameter in operation.get('parameters', []):
+            ref_path = parameter.get('$ref', '')
+            if ref_path.startswith('#/parameters/'):
+                parameter = spec.get('parameters', {}).get(ref_path.split('/')[-1], {})
+            if parameter.get('in') == 'body':
+                return parameter.get('schema')
+        return None
+
     def generate_mock_data(self, schema: Dict[str, Any], spec: Dict[str, Any], visited_refs: Set[str] = None) -> Any:
         """
         Generates simple mock data from a JSON schema.
@@ -0,0 +1,195 @@
+"""
+Resource provider and location metadata, precomputed as response bodies.
+
+Clients such as the azurerm Terraform provider list the registered resource
+providers and the subscription's locations every time they start. The
+`ProviderCatalog` derives the namespaces, resource types and API versions
+from the GET endpoints of the spec index (plus the types the emulator
+persists), and serializes every response once when it is built. Requests
+then only substitute the subscription ID into the prepared bytes.
+
+The catalog is rebuilt whenever the spec index reloads.
+"""
+import json
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+from app.resource_types import RESOURCE_TYPES
+from app.spec_index import SpecEndpoint
+
+# Replaced by the JSON-escaped subscription ID when a response is served.
+SUBSCRIPTION_PLACEHOLDER = b"{subscriptionId}"
+
+class Region(NamedTuple):
+    name: str
+    display_name: str
+    geography_group: str
+    latitude: str
+    longitude: str
+
+REGIONS = [
+    Region("eastus", "East US", "US", "37.3719", "-79.8164"),
+    Region("eastus2", "East US 2", "US", "36.6681", "-78.3889"),
+    Region("centralus", "Central US", "US", "41.5908", "-93.6208"),
+    Region("northcentralus", "North Central US", "US", "41.8819", "-87.6278"),
+    Region("southcentralus", "South Central US", "US", "29.4167", "-98.5"),
+    Region("westcentralus", "West Central US", "US", "40.890", "-110.234"),
+    Region("westus", "West US", "US", "37.783", "-122.417"),
+    Region("westus2", "West US 2", "US", "47.233", "-119.852"),
+    Region("westus3", "West US 3", "US", "33.448376", "-112.074036"),
+    Region("canadacentral", "Canada Central", "Canada", "43.653", "-79.383"),
+    Region("brazilsouth", "Brazil South", "South America", "-23.55", "-46.633"),
+    Region("northeurope", "North Europe", "Europe", "53.3478", "-6.2597"),
+    Region("westeurope", "West Europe", "Europe", "52.3667", "4.9"),
+    Region("uksouth", "UK South", "Europe", "50.941", "-0.799"),
+    Region("ukwest", "UK West", "Europe", "53.427", "-3.084"),
+    Region("francecentral", "France Central", "Europe", "46.3772", "2.3730"),
+    Region("germanywestcentral", "Germany West Central", "Europe", "50.110924", "8.682127"),
+    Region("swedencentral", "Sweden Central", "Europe", "60.67488", "17.14127"),
+    Region("switzerlandnorth", "Switzerland North", "Europe", "47.451542", "8.564572"),
+    Region("norwayeast", "Norway East", "Europe", "59.913868", "10.752245"),
+    Region("eastasia", "East Asia", "Asia Pacific", "22.267", "114.188"),
+    Region("southeastasia", "Southeast Asia", "Asia Pacific", "1.283", "103.833"),
+    Region("japaneast", "Japan East", "Asia Pacific", "35.68", "139.77"),
+    Region("japanwest", "Japan West", "Asia Pacific", "34.6939", "135.5022"),
+    Region("koreacentral", "Korea Central", "Asia Pacific", "37.5665", "126.9780"),
+    Region("australiaeast", "Australia East", "Asia Pacific", "-33.86", "151.2094"),
+    Region("australiasoutheast", "Australia Southeast", "Asia Pacific", "-37.8136", "144.9631"),
+    Region("centralindia", "Central India", "Asia Pacific", "18.5822", "73.9197"),
+    Region("southindia", "South India", "Asia Pacific", "12.9822", "80.1636"),
+    Region("uaenorth", "UAE North", "Middle East", "25.266666", "55.316666"),
+    Region("southafricanorth", "South Africa North", "Africa", "-25.731340", "28.218370"),
+]
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+def _resource_type_of(path: str) -> Optional[tuple]:
+    """
+    Returns the namespace and resource type an ARM path template belongs
+    to, e.g. ('Microsoft.Compute', 'virtualMachines/extensions'), or None
+    if the path names no provider.
+    """
+    segments = [segment for segment in path.split("?", 1)[0].split("/") if segment]
+    lowered = [segment.lower() for segment in segments]
+    if "providers" not in lowered:
+        return None
+    start = len(lowered) - 1 - lowered[::-1].index("providers")
+    namespace, *rest = segments[start + 1:] or [""]
+    # Types and names alternate after the namespace.
+    type_names = rest[::2]
+    if not type_names or "{" in namespace or any("{" in type_name for type_name in type_names):
+        return None
+    return namespace, "/".join(type_names)
+
+def _location(region: Region) -> dict:
+    return {
+        "id": f"/subscriptions/{SUBSCRIPTION_PLACEHOLDER.decode()}/locations/{region.name}",
+        "name": region.name,
+        "type": "Region",
+        "displayName": region.display_name,
+        "regionalDisplayName": f"({region.geography_group}) {region.display_name}",
+        "metadata": {
+            "regionType": "Physical",
+            "regionCategory": "Recommended",
+            "geographyGroup": region.geography_group,
+            "latitude": region.latitude,
+            "longitude": region.longitude,
+        },
+    }
+
+class ProviderCatalog:
+    """
+    Prepared responses of the provider and location endpoints.
+
+    Provider bodies are stored twice: as served at tenant scope
+    (`/providers/...`) and, with a placeholder for the subscription ID, as
+    served at subscription scope.
+    """
+
+    def __init__(self, providers: Dict[str, dict]):
+        self.namespaces = {namespace.lower(): namespace for namespace in providers}
+        self._tenant: Dict[str, bytes] = {}
+        self._subscription: Dict[str, bytes] = {}
+        for namespace, provider in sorted(providers.items(), key=lambda item: item[0].lower()):
+            self._tenant[namespace.lower()] = _dumps({"id": f"/providers/{namespace}", **provider})
+            self._subscription[namespace.lower()] = _dumps(
+                {"id": f"/subscriptions/{SUBSCRIPTION_PLACEHOLDER.decode()}/providers/{namespace}", **provider}
+            )
+        self._tenant_list = b'{"value":[' + b",".join(self._tenant.values()) + b"]}"
+        self._subscription_list = b'{"value":[' + b",".join(self._subscription.values()) + b"]}"
+        self._locations = _dumps({"value": [_location(region) for region in REGIONS]})
+
+    @classmethod
+    def build(cls, endpoints: Iterable[SpecEndpoint]) -> "ProviderCatalog":
+        """
+        Collects the namespaces, resource types and API versions of the
+        spec endpoints and the persisted resource types.
+        """
+        versions: Dict[str, Dict[str, Set[str]]] = {}
+        casing: Dict[str, str] = {}
+        for resource_type in RESOURCE_TYPES:
+            namespace = casing.setdefault(resource_type.namespace.lower(), resource_type.namespace)
+            versions.setdefault(namespace, {}).setdefault(resource_type.type_name, set())
+        for endpoint in endpoints:
+            found = _resource_type_of(endpoint.path)
+            if found is None:
+                continue
+            namespace = casing.setdefault(found[0].lower(), found[0])
+            types = versions.setdefault(namespace, {})
+            # Keep the first casing seen for each type.
+            type_name = next((name for name in types if name.lower() == found[1].lower()), found[1])
+            types.setdefault(type_name, set()).add(endpoint.api_version)
+
+        locations = [region.display_name for region in REGIONS]
+        providers = {}
+        for namespace, types in versions.items():
+            providers[namespace] = {
+                "namespace": namespace,
+                "registrationState": "Registered",
+                "registrationPolicy": "RegistrationRequired",
+                "resourceTypes": [
+                    {
+                        "resourceType": type_name,
+                        "locations": locations,
+                        "apiVersions": sorted(filter(None, api_versions), reverse=True),
+                    }
+                    for type_name, api_versions in sorted(types.items(), key=lambda item: item[0].lower())
+                ],
+            }
+        return cls(providers)
+
+    @staticmethod
+    def _subscribed(payload: bytes, subscription_id: str) -> bytes:
+        return payload.replace(SUBSCRIPTION_PLACEHOLDER, json.dumps(subscription_id)[1:-1].encode())
+
+    def list_providers(self, subscription_id: Optional[str] = None) -> bytes:
+        if subscription_id is None:
+            return self._tenant_list
+        return self._subscribed(self._subscription_list, subscription_id)
+
+    def get_provider(self, namespace: str, subscription_id: Optional[str] = None) -> Optional[bytes]:
+        """
+        Returns the body of a provider, or None for unknown namespaces.
+        """
+        if subscription_id is None:
+            return self._tenant.get(namespace.lower())
+        payload = self._subscription.get(namespace.lower())
+        return None if payload is None else self._subscribed(payload, subscription_id)
+
+    def list_locations(self, subscription_id: str) -> bytes:
+        return self._subscribed(self._locations, subscription_id)
+
+def unknown_provider(namespace: str, subscription_id: Optional[str] = None) -> bytes:
+    """
+    The body served for a namespace without known resource types. Every
+    namespace is reported as registered, so clients never need to register
+    providers before using the emulator.
+    """
+    scope = f"/subscriptions/{subscription_id}" if subscription_id is not None else ""
+    return _dumps({
+        "id": f"{scope}/providers/{namespace}",
+        "namespace": namespace,
+        "registrationState": "Registered",
+        "registrationPolicy": "RegistrationRequired",
+        "resourceTypes": [],
+    })
@@ -0,0 +1,122 @@
+"""
+Pytest plugin running the emulator in-process for tests.
+
+Enable it in a project's top-level `conftest.py`:
+
+    pytest_plugins = ["app.pytest_plugin"]
+
+The application and its schema (an in-memory SQLite database) are created
+once per test session. Each test runs inside a transaction on a single
+connection that is rolled back afterwards. Every request gets its own
+session joined to that transaction through a SAVEPOINT, so commits made by
+the emulator's handlers stay visible within the test and vanish after it.
+The application state, dependency overrides and the graph of references
+between resources are restored after each test as well. Blob content and
+the queue log are kept in the test's `tmp_path`.
+
+Each pytest-xdist worker is a separate process with its own in-memory
+database, so the plugin is safe to use with `pytest -n`.
+"""
+import os
+from contextlib import contextmanager
+
+# The emulator under test uses the test settings: no .env file and the
+# token "test-token".
+os.environ.setdefault("APP_ENV", "test")
+
+from typing import Dict, Iterator
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+
+from app.config import get_settings
+from app.db import configure_sqlite, create_db_and_tables, get_session, get_session_factory
+from app.main import create_app
+from app.queuestore import QueueStore
+from app.references import REFERENCE_GRAPH
+
+@pytest.fixture(scope="session")
+def emulator_engine() -> Iterator[Engine]:
+    """
+    An in-memory SQLite database holding the emulator's schema.
+    """
+    # An in-memory database only exists on its one connection.
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    configure_sqlite(engine)
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope="session")
+def emulator_app(emulator_engine: Engine) -> FastAPI:
+    """
+    The emulator application, shared by all tests. Its lifespan is not
+    run; use `emulator_client` for isolated access to its database.
+    """
+    app = create_app()
+    app.state.engine = emulator_engine
+    return app
+
+@pytest.fixture
+def emulator_session(emulator_app: FastAPI, emulator_engine: Engine, tmp_path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Session]:
+    """
+    A session on the test's transaction, as used by the emulator's request
+    handlers. Everything written during the test is rolled back after it,
+    and the blob and queue data planes store their data in `tmp_path`.
+    """
+    monkeypatch.setattr(get_settings(), "BLOB_STORAGE_PATH", str(tmp_path / "blobs"))
+    monkeypatch.setattr(get_settings(), "QUEUE_STORAGE_PATH", str(tmp_path / "queues"))
+    connection = emulator_engine.connect()
+    transaction = connection.begin()
+
+    @contextmanager
+    def open_test_session():
+        with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+
+    def get_test_session():
+        with open_test_session() as session:
+            yield session
+
+    saved_state = dict(emulator_app.state._state)
+    saved_overrides = dict(emulator_app.dependency_overrides)
+    emulator_app.dependency_overrides[get_session] = get_test_session
+    emulator_app.dependency_overrides[get_session_factory] = lambda: open_test_session
+    queue_store = QueueStore(get_settings().QUEUE_STORAGE_PATH, fsync=False)
+    emulator_app.state.queue_store = queue_store
+    try:
+        with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+    finally:
+        emulator_app.dependency_overrides.clear()
+        emulator_app.dependency_overrides.update(saved_overrides)
+        emulator_app.state._state.clear()
+        emulator_app.state._state.update(saved_state)
+        queue_store.close()
+        transaction.rollback()
+        connection.close()
+        # Rebuilt from the rolled back database, as on startup.
+        with Session(emulator_engine) as session:
+            REFERENCE_GRAPH.load(session)
+
+@pytest.fixture
+def emulator_client(emulator_app: FastAPI, emulator_session: Session) -> TestClient:
+    """
+    A client of the emulator whose changes are rolled back after the test.
+    """
+    return TestClient(emulator_app)
+
+@pytest.fixture
+def emulator_auth_headers() -> Dict[str, str]:
+    """
+    Headers authorizing requests to the emulator.
+    """
+    return {"Authorization": f"Bearer {get_settings().MOCK_AUTH_TOKEN}"}
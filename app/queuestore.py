@@ -0,0 +1,509 @@
+"""
+Storage for the queue data plane: an append-only log with group commit.
+
+Every change to a queue (created, deleted, cleared) or message (put,
+received, updated, deleted) is applied to in-memory indexes and appended
+to a log file as one record. Appending is a plain write; a single sync
+thread then fsyncs once for all records appended since its previous sync,
+so concurrent requests share one fsync instead of paying for one each.
+Requests are answered once their records are durable.
+
+Several worker processes can share one log. Each change is made holding an
+exclusive `flock` on a lock file next to the log, after first applying the
+records other processes appended since this one last looked, so every
+process sees the changes of all of them, in log order. Without `fcntl`
+(on Windows) the log must only be used by one process.
+
+On start the log is replayed to rebuild the indexes; a torn record at the
+end from a crash is cut off. Once the log holds mostly records of deleted
+or superseded messages it is compacted: the live state is written to a new
+log, which atomically replaces the old one. Other processes notice the new
+file and replay it.
+
+Each queue keeps its messages by ID and a heap ordered by the time each
+message next becomes visible (then by insertion order), so receiving
+messages only touches the messages it returns. Heap entries are not
+removed when a message is deleted or hidden again; stale entries are
+recognised and skipped when they reach the top.
+"""
+import heapq
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import status
+
+from app.errors import StorageError
+
+try:
+    import fcntl
+except ImportError:  # Single-process use only.
+    fcntl = None
+
+# Each record is a little-endian length and CRC-32 followed by a JSON payload.
+_HEADER = struct.Struct("<II")
+
+MAX_MESSAGES_PER_REQUEST = 32
+# Compact when the log holds this many more records than there are live
+# messages and queues.
+COMPACTION_SLACK = 100_000
+
+class QueueMessage:
+    """
+    A message and its visibility state.
+    """
+    __slots__ = ("message_id", "text", "inserted", "expires", "visible_at", "pop_receipt", "dequeue_count", "seq")
+
+    def __init__(self, message_id: str, text: str, inserted: float, expires: float, visible_at: float, seq: int):
+        self.message_id = message_id
+        self.text = text
+        self.inserted = inserted
+        self.expires = expires
+        self.visible_at = visible_at
+        self.pop_receipt = ""
+        self.dequeue_count = 0
+        self.seq = seq
+
+    def to_record(self, account_name: str, queue_name: str) -> Dict[str, Any]:
+        return {
+            "op": "put", "account": account_name, "queue": queue_name, "id": self.message_id,
+            "text": self.text, "inserted": self.inserted, "expires": self.expires,
+            "visible": self.visible_at, "pop": self.pop_receipt, "dequeues": self.dequeue_count,
+        }
+
+class _Queue:
+    __slots__ = ("messages", "heap")
+
+    def __init__(self):
+        self.messages: Dict[str, QueueMessage] = {}
+        # (visible_at, seq, message_id); may hold stale entries.
+        self.heap: List[Tuple[float, int, str]] = []
+
+    def schedule(self, message: QueueMessage) -> None:
+        heapq.heappush(self.heap, (message.visible_at, message.seq, message.message_id))
+
+    def pop_visible(self, now: float, limit: int) -> List[QueueMessage]:
+        """
+        Removes and returns up to `limit` visible messages from the heap,
+        dropping stale entries and expired messages on the way. Callers
+        reschedule the messages they keep.
+        """
+        found: List[QueueMessage] = []
+        while self.heap and len(found) < limit and self.heap[0][0] <= now:
+            visible_at, _, message_id = heapq.heappop(self.heap)
+            message = self.messages.get(message_id)
+            if message is None or message.visible_at != visible_at:
+                continue  # Deleted or hidden again since this entry was pushed.
+            if message.expires <= now:
+                del self.messages[message_id]
+                continue
+            found.append(message)
+        return found
+
+class _GroupCommitSyncer:
+    """
+    Background thread that fsyncs the log once for all records appended
+    since its previous fsync, then completes their futures.
+    """
+
+    def __init__(self, store: "QueueStore", fsync: bool):
+        self.store = store
+        self.fsync = fsync
+        self._pending: List[Future] = []
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="queue-log-sync", daemon=True)
+        self._thread.start()
+
+    def submit(self) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._closing:
+                raise RuntimeError("The queue store is closed")
+            self._pending.append(future)
+            self._condition.notify()
+        return future
+
+    def close(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending and self._closing:
+                    return
+                batch, self._pending = self._pending, []
+            try:
+                if self.fsync:
+                    self.store._sync_log()
+            except BaseException as exc:
+                for future in batch:
+                    future.set_exception(exc)
+                continue
+            finally:
+                self.store._close_retired()
+            for future in batch:
+                future.set_result(None)
+            try:
+                self.store._compact_if_needed()
+            except Exception as exc:
+                # Appended records are synced regardless; keep syncing and
+                # try again after the next batch.
+                print(f"Compacting the queue log failed: {exc!r}")
+
+class QueueStore:
+    """
+    The queues and messages of all storage accounts.
+
+    Args:
+        path: Directory holding the log file.
+        fsync: Whether to fsync the log before completing changes. Without
+            it, records survive a crash of the emulator but not of the machine.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        os.makedirs(path, exist_ok=True)
+        self.log_path = os.path.join(path, "queues.log")
+        self._lock_fd = os.open(os.path.join(path, "queues.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._retired: List[int] = []
+        self._open_log()
+        with self._locked():  # Replays the log.
+            pass
+        self._syncer = _GroupCommitSyncer(self, fsync)
+
+    def close(self) -> None:
+        """
+        Syncs all appended records and closes the log.
+        """
+        if self._fd is None:
+            return
+        self._syncer.close()
+        with self._lock:
+            self._retire_log()
+        self._close_retired()
+        os.close(self._lock_fd)
+
+    # Log handling
+
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> bytes:
+        payload = json.dumps(record, separators=(",", ":")).encode()
+        return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _open_log(self) -> None:
+        """
+        Opens the current log file, starting from an empty state that
+        `_catch_up` then fills by replaying it.
+        """
+        self._fd = os.open(self.log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        self._offset = 0
+        self._records = 0
+        self._seq = 0
+        self._queues: Dict[Tuple[str, str], _Queue] = {}
+
+    def _retire_log(self) -> None:
+        # The sync thread may still be syncing the old file, so it closes it.
+        self._retired.append(self._fd)
+        self._fd = None
+
+    def _sync_log(self) -> None:
+        with self._lock:
+            fd = self._fd
+        # Records in retired files were copied into the file replacing them,
+        # which was synced before replacing.
+        if fd is not None:
+            os.fsync(fd)
+
+    def _close_retired(self) -> None:
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for fd in retired:
+            os.close(fd)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Holds the log exclusively, with the in-memory state brought up to
+        date with the records other processes appended.
+        """
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _catch_up(self) -> None:
+        stat = os.stat(self.log_path)
+        if stat.st_ino != self._inode:
+            # Another process compacted the log; replay the new one.
+            self._retire_log()
+            self._open_log()
+            stat = os.fstat(self._fd)
+        if stat.st_size == self._offset:
+            return
+        data = os.pread(self._fd, stat.st_size - self._offset, self._offset)
+        position = 0
+        while position + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, position)
+            payload = data[position + _HEADER.size:position + _HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            self._apply(json.loads(payload))
+            self._records += 1
+            position += _HEADER.size + length
+        self._offset += position
+        if position != len(data):
+            # Nobody else is writing, so this is a record torn by a crash;
+            # cut it off so new records follow valid ones.
+            os.ftruncate(self._fd, self._offset)
+
+    def _append(self, *records: Dict[str, Any]) -> Future:
+        # Called while holding the log, right after applying the records.
+        data = b"".join(self._encode(record) for record in records)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        self._offset += len(data)
+        self._records += len(records)
+        return self._syncer.submit()
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """
+        Applies a replayed record to the in-memory state.
+        """
+        key = (record["account"], record["queue"])
+        op = record["op"]
+        if op == "create":
+            self._queues.setdefault(key, _Queue())
+            return
+        if op == "delete_queue":
+            self._queues.pop(key, None)
+            return
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        if op == "clear":
+            queue.messages.clear()
+            queue.heap.clear()
+        elif op == "delete":
+            queue.messages.pop(record["id"], None)
+        elif op == "put":
+            self._seq += 1
+            message = QueueMessage(record["id"], record["text"], record["inserted"], record["expires"], record["visible"], self._seq)
+            message.pop_receipt = record["pop"]
+            message.dequeue_count = record["dequeues"]
+            queue.messages[message.message_id] = message
+            queue.schedule(message)
+        elif op == "update":
+            message = queue.messages.get(record["id"])
+            if message is not None:
+                message.visible_at = record["visible"]
+                message.pop_receipt = record["pop"]
+                message.dequeue_count = record["dequeues"]
+                if "text" in record:
+                    message.text = record["text"]
+                queue.schedule(message)
+
+    def _needs_compaction(self) -> bool:
+        # Called holding the log: the indexes change under concurrent requests.
+        live = len(self._queues) + sum(len(queue.messages) for queue in self._queues.values())
+        return self._records > live + COMPACTION_SLACK
+
+    def _compact_if_needed(self) -> None:
+        """
+        Rewrites the log as the records of the live state, if it is mostly
+        dead records. Runs on the sync thread.
+        """
+        if self._records <= COMPACTION_SLACK:
+            return  # Cheap check without the lock; live records only raise the limit.
+        with self._locked():
+            if not self._needs_compaction():
+                return  # Not enough dead records, or another process compacted it.
+            now = time.time()
+            temp_path = self.log_path + ".compact"
+            records = 0
+            with open(temp_path, "wb") as log:
+                for (account_name, queue_name), queue in self._queues.items():
+                    log.write(self._encode({"op": "create", "account": account_name, "queue": queue_name}))
+                    records += 1
+                    for message in sorted(queue.messages.values(), key=lambda message: message.seq):
+                        if message.expires > now:
+                            log.write(self._encode(message.to_record(account_name, queue_name)))
+                            records += 1
+                log.flush()
+                os.fsync(log.fileno())
+            os.replace(temp_path, self.log_path)
+            # The state stays as it is; only the file changes.
+            fd = os.open(self.log_path, os.O_RDWR | os.O_APPEND)
+            self._retire_log()
+            self._fd = fd
+            stat = os.fstat(self._fd)
+            self._inode = stat.st_ino
+            self._offset = stat.st_size
+            self._records = records
+
+    # Queue operations. Each returns its result together with a future that
+    # completes once the change is durable.
+
+    def _queue(self, account_name: str, queue_name: str) -> _Queue:
+        queue = self._queues.get((account_name, queue_name))
+        if queue is None:
+            raise StorageError(status.HTTP_404_NOT_FOUND, "QueueNotFound", "The specified queue does not exist.")
+        return queue
+
+    def create_queue(self, account_name: str, queue_name: str) -> Tuple[bool, Optional[Future]]:
+        """
+        Creates a queue. Returns whether it was created, rather than existing.
+        """
+        with self._locked():
+            if (account_name, queue_name) in self._queues:
+                return False, None
+            self._queues[(account_name, queue_name)] = _Queue()
+            return True, self._append({"op": "create", "account": account_name, "queue": queue_name})
+
+    def delete_queue(self, account_name: str, queue_name: str) -> Future:
+        with self._locked():
+            self._queue(account_name, queue_name)
+            del self._queues[(account_name, queue_name)]
+            return self._append({"op": "delete_queue", "account": account_name, "queue": queue_name})
+
+    def delete_account(self, account_name: str) -> Optional[Future]:
+        """
+        Deletes all queues of a storage account, if it has any.
+        """
+        with self._locked():
+            keys = [key for key in self._queues if key[0] == account_name]
+            if not keys:
+                return None
+            for key in keys:
+                del self._queues[key]
+            return self._append(*({"op": "delete_queue", "account": account, "queue": queue} for account, queue in keys))
+
+    def list_queues(self, account_name: str, prefix: str = "") -> List[str]:
+        with self._locked():
+            return sorted(
+                queue_name for account, queue_name in self._queues
+                if account == account_name and queue_name.startswith(prefix)
+            )
+
+    def approximate_message_count(self, account_name: str, queue_name: str) -> int:
+        with self._locked():
+            return len(self._queue(account_name, queue_name).messages)
+
+    def put_message(
+        self, account_name: str, queue_name: str, text: str, visibility_timeout: int, ttl: int,
+    ) -> Tuple[QueueMessage, Future]:
+        """
+        Adds a message, invisible for `visibility_timeout` seconds and
+        expiring after `ttl` seconds (-1 for never).
+        """
+        now = time.time()
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            self._seq += 1
+            expires = float("inf") if ttl == -1 else now + ttl
+            message = QueueMessage(uuid.uuid4().hex, text, now, expires, now + visibility_timeout, self._seq)
+            message.pop_receipt = secrets.token_urlsafe(12)
+            queue.messages[message.message_id] = message
+            queue.schedule(message)
+            return message, self._append(message.to_record(account_name, queue_name))
+
+    def get_messages(
+        self, account_name: str, queue_name: str, count: int, visibility_timeout: int,
+    ) -> Tuple[List[QueueMessage], Optional[Future]]:
+        """
+        Receives up to `count` visible messages, hiding them for
+        `visibility_timeout` seconds and giving each a new pop receipt.
+        """
+        now = time.time()
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            messages = queue.pop_visible(now, count)
+            records = []
+            for message in messages:
+                message.visible_at = now + visibility_timeout
+                message.pop_receipt = secrets.token_urlsafe(12)
+                message.dequeue_count += 1
+                queue.schedule(message)
+                records.append(self._update_record(account_name, queue_name, message))
+            return messages, self._append(*records) if records else None
+
+    def peek_messages(self, account_name: str, queue_name: str, count: int) -> List[QueueMessage]:
+        """
+        Returns up to `count` visible messages without changing them.
+        """
+        now = time.time()
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            messages = queue.pop_visible(now, count)
+            for message in messages:
+                queue.schedule(message)
+            return messages
+
+    def update_message(
+        self, account_name: str, queue_name: str, message_id: str, pop_receipt: str,
+        visibility_timeout: int, text: Optional[str] = None,
+    ) -> Tuple[QueueMessage, Future]:
+        now = time.time()
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            message = self._message(queue, message_id, pop_receipt, now)
+            message.visible_at = now + visibility_timeout
+            message.pop_receipt = secrets.token_urlsafe(12)
+            if text is not None:
+                message.text = text
+            queue.schedule(message)
+            record = self._update_record(account_name, queue_name, message)
+            if text is not None:
+                record["text"] = text
+            return message, self._append(record)
+
+    def delete_message(self, account_name: str, queue_name: str, message_id: str, pop_receipt: str) -> Future:
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            self._message(queue, message_id, pop_receipt, time.time())
+            del queue.messages[message_id]
+            return self._append({"op": "delete", "account": account_name, "queue": queue_name, "id": message_id})
+
+    def clear_messages(self, account_name: str, queue_name: str) -> Future:
+        with self._locked():
+            queue = self._queue(account_name, queue_name)
+            queue.messages.clear()
+            queue.heap.clear()
+            return self._append({"op": "clear", "account": account_name, "queue": queue_name})
+
+    @staticmethod
+    def _message(queue: _Queue, message_id: str, pop_receipt: str, now: float) -> QueueMessage:
+        message = queue.messages.get(message_id)
+        if message is None or message.expires <= now:
+            raise StorageError(status.HTTP_404_NOT_FOUND, "MessageNotFound", "The specified message does not exist.")
+        if message.pop_receipt != pop_receipt:
+            raise StorageError(status.HTTP_400_BAD_REQUEST, "PopReceiptMismatch", "The specified pop receipt did not match the pop receipt for a dequeued message.")
+        return message
+
+    @staticmethod
+    def _update_record(account_name: str, queue_name: str, message: QueueMessage) -> Dict[str, Any]:
+        return {
+            "op": "update", "account": account_name, "queue": queue_name, "id": message.message_id,
+            "visible": message.visible_at, "pop": message.pop_receipt, "dequeues": message.dequeue_count,
+        }
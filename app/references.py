@@ -0,0 +1,162 @@
+"""
+Index of the references between resources.
+
+A resource references another when a property of its last PUT body holds
+the other's resource ID, as a VM's network interfaces or a subnet's route
+table do. Routers call `record_references` with the IDs found in the body;
+the references are stored as `ResourceReference` rows in the same
+transaction, and applied to the in-process `ReferenceGraph` once it
+commits. The graph answers both "what does this reference" and "what
+references this" from dictionaries keyed by lower-cased resource ID.
+
+Each worker loads the graph from the database on startup. With several
+workers, the graph also follows the change feed: for every change made
+through any worker, the references of the changed resource are read again.
+"""
+import threading
+from typing import Any, Callable, Dict, Iterable, List
+
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from sqlmodel import SQLModel
+
+from app.models import ResourceReference
+from app.resource_types import resource_type_of
+
+_PENDING_KEY = "pending_resource_references"
+
+def find_references(value: Any) -> List[str]:
+    """
+    Returns the resource IDs found in a request body, in order and without
+    duplicates.
+    """
+    found: Dict[str, str] = {}
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, list):
+            stack.extend(reversed(item))
+        elif isinstance(item, str) and item[:15].lower() == "/subscriptions/" and "/providers/" in item.lower():
+            found.setdefault(item.lower(), item)
+    return list(found.values())
+
+def record_references(session: Session, resource: SQLModel, target_ids: Iterable[str]) -> None:
+    """
+    Replaces the references of a resource in the session's transaction.
+
+    Args:
+        session: The session the resource is written in. The graph is
+            updated once this session commits.
+        resource: The created, updated or deleted resource.
+        target_ids: The resource IDs it now references; none once deleted.
+    """
+    source_id = resource_type_of(type(resource)).resource_id(resource.subscription_id, resource.resource_group, resource.name)
+    source_key = source_id.lower()
+    targets = {target_id.lower(): target_id for target_id in target_ids if target_id.lower() != source_key}
+    session.execute(delete(ResourceReference).where(ResourceReference.source_key == source_key))
+    session.add_all(
+        ResourceReference(source_key=source_key, source_id=source_id, target_key=target_key, target_id=target_id)
+        for target_key, target_id in targets.items()
+    )
+    session.info.setdefault(_PENDING_KEY, {})[source_id] = list(targets.values())
+
+@event.listens_for(Session, "after_commit")
+def _apply_references(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        for source_id, target_ids in pending.items():
+            REFERENCE_GRAPH.set_references(source_id, target_ids)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_references(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+class ReferenceGraph:
+    """
+    The references between resources, in both directions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Source key -> {target key: target ID}
+        self._references: Dict[str, Dict[str, str]] = {}
+        # Target key -> {source key: source ID}
+        self._referenced_by: Dict[str, Dict[str, str]] = {}
+
+    def set_references(self, source_id: str, target_ids: Iterable[str]) -> None:
+        """
+        Replaces the references of a resource.
+        """
+        source_key = source_id.lower()
+        targets = {target_id.lower(): target_id for target_id in target_ids}
+        with self._lock:
+            for target_key in self._references.pop(source_key, {}):
+                sources = self._referenced_by[target_key]
+                del sources[source_key]
+                if not sources:
+                    del self._referenced_by[target_key]
+            if targets:
+                self._references[source_key] = targets
+            for target_key in targets:
+                self._referenced_by.setdefault(target_key, {})[source_key] = source_id
+
+    def references(self, resource_id: str) -> List[str]:
+        """
+        Returns the IDs of the resources a resource references.
+        """
+        with self._lock:
+            return list(self._references.get(resource_id.lower(), {}).values())
+
+    def referenced_by(self, resource_id: str) -> List[str]:
+        """
+        Returns the IDs of the resources referencing a resource.
+        """
+        with self._lock:
+            return list(self._referenced_by.get(resource_id.lower(), {}).values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._references.clear()
+            self._referenced_by.clear()
+
+    def load(self, session: Session) -> None:
+        """
+        Replaces the graph with the references stored in the database.
+        """
+        targets: Dict[str, List[str]] = {}
+        source_ids: Dict[str, str] = {}
+        for reference in session.execute(select(ResourceReference)).scalars():
+            source_ids[reference.source_key] = reference.source_id
+            targets.setdefault(reference.source_key, []).append(reference.target_id)
+        self.clear()
+        for source_key, target_ids in targets.items():
+            self.set_references(source_ids[source_key], target_ids)
+
+    def refresh(self, session: Session, source_ids: Iterable[str]) -> None:
+        """
+        Reads the references of some resources again from the database.
+        """
+        source_ids = {source_id.lower(): source_id for source_id in source_ids}
+        targets: Dict[str, List[str]] = {source_key: [] for source_key in source_ids}
+        statement = select(ResourceReference).where(ResourceReference.source_key.in_(list(source_ids)))
+        for reference in session.execute(statement).scalars():
+            targets[reference.source_key].append(reference.target_id)
+        for source_key, target_ids in targets.items():
+            self.set_references(source_ids[source_key], target_ids)
+
+REFERENCE_GRAPH = ReferenceGraph()
+
+def follow_changes(engine, graph: ReferenceGraph = REFERENCE_GRAPH) -> Callable[[List[Dict[str, Any]]], None]:
+    """
+    Returns a change feed listener that refreshes the references of the
+    resources changed by any worker.
+    """
+    def refresh(events: List[Dict[str, Any]]) -> None:
+        try:
+            with Session(engine) as session:
+                graph.refresh(session, [change_event["resourceId"] for change_event in events])
+        except Exception as exc:  # Keep the change feed running.
+            print(f"Could not refresh resource references: {exc}")
+    return refresh
@@ -0,0 +1,119 @@
+"""
+Registry of the resource types persisted by the emulator.
+
+Cross-cutting features (Resource Graph queries, change events, lookups by
+resource ID) need to know, for every resource table, which ARM type it holds
+and how its columns map onto the ARM resource shape. That knowledge lives
+here rather than being repeated in each of them.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+from sqlalchemy import event
+from sqlmodel import SQLModel
+
+from app.models import StorageAccount, VirtualMachine, VirtualNetwork
+
+class ResourceType(NamedTuple):
+    """
+    Describes an ARM resource type backed by a database table.
+
+    Attributes:
+        model: The SQLModel table class.
+        namespace: The resource provider namespace, e.g. 'Microsoft.Compute'.
+        type_name: The resource type within the namespace, e.g. 'virtualMachines'.
+        columns: Maps dotted ARM property paths (e.g. 'sku.name') to model
+            attribute names for the type-specific columns.
+    """
+    model: Type[SQLModel]
+    namespace: str
+    type_name: str
+    columns: Dict[str, str]
+
+    @property
+    def full_type(self) -> str:
+        """The ARM type, e.g. 'Microsoft.Compute/virtualMachines'."""
+        return f"{self.namespace}/{self.type_name}"
+
+    def resource_id(self, subscription_id: str, resource_group: str, name: str) -> str:
+        """Builds the ARM resource ID of a resource of this type."""
+        return (
+            f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+            f"/providers/{self.full_type}/{name}"
+        )
+
+    def resource_id_key(self, subscription_id: str, resource_group: str, name: str) -> str:
+        """Builds the canonical, lower-cased resource ID that rows are looked up by."""
+        return self.resource_id(subscription_id, resource_group, name).lower()
+
+RESOURCE_TYPES: List[ResourceType] = [
+    ResourceType(
+        model=VirtualMachine,
+        namespace="Microsoft.Compute",
+        type_name="virtualMachines",
+        columns={
+            "properties.hardwareProfile.vmSize": "vm_size",
+            "properties.provisioningState": "provisioning_state",
+        },
+    ),
+    ResourceType(
+        model=VirtualNetwork,
+        namespace="Microsoft.Network",
+        type_name="virtualNetworks",
+        columns={
+            "properties.addressSpace.addressPrefixes": "address_space",
+        },
+    ),
+    ResourceType(
+        model=StorageAccount,
+        namespace="Microsoft.Storage",
+        type_name="storageAccounts",
+        columns={
+            "kind": "kind",
+            "sku.name": "sku",
+        },
+    ),
+]
+
+# A top-level resource: subscription, group, provider namespace, type and name.
+_RESOURCE_ID = re.compile(
+    r"^/subscriptions/([^/]+)/resourceGroups/([^/]+)/providers/([^/]+)/([^/]+)/([^/]+)/?$",
+    re.IGNORECASE,
+)
+
+_BY_FULL_TYPE = {resource_type.full_type.lower(): resource_type for resource_type in RESOURCE_TYPES}
+_BY_MODEL = {resource_type.model: resource_type for resource_type in RESOURCE_TYPES}
+
+def get_resource_type(full_type: str) -> Optional[ResourceType]:
+    """
+    Returns the registered resource type for an ARM type, case-insensitively.
+    """
+    return _BY_FULL_TYPE.get(full_type.lower())
+
+def resource_type_of(model: Type[SQLModel]) -> ResourceType:
+    """
+    Returns the registered resource type stored in a model's table.
+    """
+    return _BY_MODEL[model]
+
+def parse_resource_id(resource_id: str) -> Optional[Tuple[ResourceType, str]]:
+    """
+    Returns the registered resource type of a top-level resource ID and the
+    ID's key, or None if the ID is not one of a registered type.
+    """
+    match = _RESOURCE_ID.match(resource_id)
+    if match is None:
+        return None
+    subscription_id, resource_group, namespace, type_name, name = match.groups()
+    resource_type = get_resource_type(f"{namespace}/{type_name}")
+    if resource_type is None:
+        return None
+    return resource_type, resource_type.resource_id_key(subscription_id, resource_group, name)
+
+def _set_resource_id_key(mapper, connection, target) -> None:
+    resource_type = _BY_MODEL[type(target)]
+    target.resource_id_key = resource_type.resource_id_key(target.subscription_id, target.resource_group, target.name)
+
+for _resource_type in RESOURCE_TYPES:
+    event.listen(_resource_type.model, "before_insert", _set_resource_id_key)
+    event.listen(_resource_type.model, "before_update", _set_resource_id_key)
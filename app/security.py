@@ -5,6 +5,10 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.config import get_settings
+from app.metrics import AUTH_FAILURES
+
+_missing_token_failures = AUTH_FAILURES.labels("missing_token")
+_invalid_token_failures = AUTH_FAILURES.labels("invalid_token")
 
 # The auto_error=False means the dependency won't raise an error itself
 # if the Authorization header is missing. This allows us to provide a
@@ -25,6 +29,10 @@ def verify_token(
     """
     settings = get_settings()
     if token is None or token.credentials != settings.MOCK_AUTH_TOKEN:
+        if token is None:
+            _missing_token_failures.inc()
+        else:
+            _invalid_token_failures.inc()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing authentication token",
@@ -0,0 +1,528 @@
+"""
+API routes for a local Azure Blob Storage data plane.
+
+Blobs are addressed path-style, like other local storage emulators do:
+`/blob/{accountName}/{containerName}/{blobName}`, where the account must
+exist as a `StorageAccount`. Operations are selected by the `restype` and
+`comp` query parameters of the Blob service REST API.
+
+Blob content is stored as files under `BLOB_STORAGE_PATH`, named by a hash
+of the blob name, with the metadata in the database. Uploads are streamed
+to a temporary file and moved into place with `os.replace`, so memory use
+does not depend on blob size and readers never see a partial blob. Blocks
+from Put Block are staged as files and joined with `copy_file_range` on
+Put Block List. Downloads are served by `FileResponse`, which hands the
+file to the server (`http.response.pathsend`) where supported and otherwise
+reads it in large chunks; `Range` and `x-ms-range` requests are honoured.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from email.utils import formatdate
+from typing import Dict, List, Optional
+from xml.etree import ElementTree
+
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.config import get_settings
+from app.db import begin_write, get_session
+from app.errors import StorageError
+from app.models import Blob, BlobContainer, StorageAccount
+from app.security import verify_token
+
+API_VERSION = "2023-11-03"
+WRITE_BUFFER_SIZE = 1024 * 1024
+DEFAULT_MAX_RESULTS = 5000
+
+_ACCOUNT_NAME = re.compile(r"^[a-z0-9]{3,24}$")
+_CONTAINER_NAME = re.compile(r"^(?!.*--)[a-z0-9][a-z0-9-]{1,61}[a-z0-9]$")
+
+router = APIRouter(
+    prefix="/blob",
+    tags=["blob"],
+    dependencies=[Depends(verify_token)],
+)
+
+class BlobFileResponse(FileResponse):
+    """
+    A `FileResponse` reading in larger chunks when the server cannot send
+    the file itself, as for range requests.
+    """
+    chunk_size = WRITE_BUFFER_SIZE
+
+# Paths and headers
+
+def account_dir(account_name: str) -> str:
+    """
+    The directory holding the blob content of a storage account.
+
+    Raises:
+        ValueError: If the name would resolve to a path other than a
+            directory directly under `BLOB_STORAGE_PATH`.
+    """
+    root = os.path.realpath(get_settings().BLOB_STORAGE_PATH)
+    path = os.path.realpath(os.path.join(root, account_name))
+    if os.path.dirname(path) != root:
+        raise ValueError(f"Invalid storage account name: {account_name!r}")
+    return path
+
+def _container_dir(account_name: str, container_name: str) -> str:
+    return os.path.join(account_dir(account_name), container_name)
+
+def _blob_key(blob_name: str) -> str:
+    # Blob names may be longer than file names and contain '/', so files are
+    # named by a hash of the blob name.
+    return hashlib.sha256(blob_name.encode()).hexdigest()
+
+def _blob_path(account_name: str, container_name: str, blob_name: str) -> str:
+    return os.path.join(_container_dir(account_name, container_name), _blob_key(blob_name))
+
+def _blocks_dir(account_name: str, container_name: str, blob_name: str) -> str:
+    return os.path.join(_container_dir(account_name, container_name), ".blocks", _blob_key(blob_name))
+
+def _etag(stat: os.stat_result) -> str:
+    return f'"0x{stat.st_mtime_ns:X}"'
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:  # SQLite returns naive datetimes, stored in UTC.
+        value = value.replace(tzinfo=timezone.utc)
+    return formatdate(value.timestamp(), usegmt=True)
+
+def _headers(**extra: str) -> Dict[str, str]:
+    return {"x-ms-version": API_VERSION, **extra}
+
+def _created(stat: os.stat_result) -> Response:
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        headers=_headers(**{"ETag": _etag(stat), "Last-Modified": formatdate(stat.st_mtime, usegmt=True)}),
+    )
+
+def _xml_response(root: ElementTree.Element) -> Response:
+    return Response(
+        ElementTree.tostring(root, encoding="utf-8", xml_declaration=True),
+        media_type="application/xml",
+        headers=_headers(),
+    )
+
+def _element(parent: ElementTree.Element, tag: str, text: Optional[str] = None) -> ElementTree.Element:
+    element = ElementTree.SubElement(parent, tag)
+    if text is not None:
+        element.text = text
+    return element
+
+def _unsupported(parameter: str, value: Optional[str]) -> StorageError:
+    return StorageError(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        code="InvalidQueryParameterValue",
+        message=f"Value for one of the query parameters specified in the request URI is invalid: {parameter}={value}.",
+    )
+
+# Database lookups, run in the threadpool
+
+def _require_account(session: Session, account_name: str) -> None:
+    if not _ACCOUNT_NAME.match(account_name):
+        raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidResourceName", "The specified resource name contains invalid characters.")
+    if session.exec(select(StorageAccount.id).where(StorageAccount.name == account_name)).first() is None:
+        raise StorageError(status.HTTP_404_NOT_FOUND, "ResourceNotFound", "The specified storage account does not exist.")
+
+def _find_container(session: Session, account_name: str, container_name: str) -> Optional[BlobContainer]:
+    return session.exec(select(BlobContainer).where(
+        BlobContainer.account_name == account_name,
+        BlobContainer.name == container_name,
+    )).first()
+
+def _require_container(session: Session, account_name: str, container_name: str) -> BlobContainer:
+    _require_account(session, account_name)
+    container = _find_container(session, account_name, container_name)
+    if container is None:
+        raise StorageError(status.HTTP_404_NOT_FOUND, "ContainerNotFound", "The specified container does not exist.")
+    return container
+
+def _find_blob(session: Session, account_name: str, container_name: str, blob_name: str) -> Optional[Blob]:
+    return session.exec(select(Blob).where(
+        Blob.account_name == account_name,
+        Blob.container_name == container_name,
+        Blob.name == blob_name,
+    )).first()
+
+def _require_blob(session: Session, account_name: str, container_name: str, blob_name: str) -> Blob:
+    _require_container(session, account_name, container_name)
+    blob = _find_blob(session, account_name, container_name, blob_name)
+    if blob is None:
+        raise StorageError(status.HTTP_404_NOT_FOUND, "BlobNotFound", "The specified blob does not exist.")
+    return blob
+
+def _commit_blob(
+    session: Session,
+    account_name: str,
+    container_name: str,
+    blob_name: str,
+    temp_path: str,
+    content_type: str,
+) -> os.stat_result:
+    """
+    Moves an uploaded file into place and records the blob's metadata.
+    """
+    path = _blob_path(account_name, container_name, blob_name)
+    os.replace(temp_path, path)
+    stat = os.stat(path)
+    for attempt in range(2):
+        begin_write(session)
+        blob = _find_blob(session, account_name, container_name, blob_name)
+        if blob is None:
+            blob = Blob(account_name=account_name, container_name=container_name, name=blob_name)
+        blob.content_type = content_type
+        blob.size = stat.st_size
+        blob.etag = _etag(stat)
+        blob.last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        session.add(blob)
+        try:
+            session.commit()
+            break
+        except IntegrityError:
+            # A concurrent upload created the blob first; update its row.
+            session.rollback()
+            if attempt:
+                raise
+    # Committing a blob discards its uncommitted blocks.
+    shutil.rmtree(_blocks_dir(account_name, container_name, blob_name), ignore_errors=True)
+    return stat
+
+# File operations
+
+async def _receive_to_file(request: Request, directory: str) -> str:
+    """
+    Streams the request body into a new temporary file in `directory`,
+    buffering at most `WRITE_BUFFER_SIZE` bytes in memory.
+    """
+    await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            buffer = bytearray()
+            async for chunk in request.stream():
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await run_in_threadpool(temp_file.write, buffer)
+                    buffer = bytearray()
+            if buffer:
+                await run_in_threadpool(temp_file.write, buffer)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path
+
+def _append_file(source_path: str, target_fd: int) -> None:
+    with open(source_path, "rb") as source:
+        remaining = os.fstat(source.fileno()).st_size
+        try:
+            # Copies inside the kernel, or shares extents on reflink file systems.
+            while remaining:
+                copied = os.copy_file_range(source.fileno(), target_fd, remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        except (AttributeError, OSError):
+            with os.fdopen(os.dup(target_fd), "wb") as target:
+                shutil.copyfileobj(source, target, WRITE_BUFFER_SIZE)
+
+def _concatenate(paths: List[str], directory: str) -> str:
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        for path in paths:
+            _append_file(path, fd)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    finally:
+        os.close(fd)
+    return temp_path
+
+def _block_file_name(block_id: Optional[str]) -> str:
+    try:
+        if not block_id or not base64.b64decode(block_id, validate=True):
+            raise ValueError(block_id)
+    except (binascii.Error, ValueError):
+        raise _unsupported("blockid", block_id) from None
+    return block_id.encode().hex()
+
+# Service and container operations
+
+@router.get("/{account_name}")
+async def list_containers(
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    comp: Optional[str] = None,
+    prefix: str = "",
+):
+    """
+    List Containers (`comp=list`).
+    """
+    if comp != "list":
+        raise _unsupported("comp", comp)
+    await run_in_threadpool(_require_account, session, account_name)
+    statement = select(BlobContainer).where(BlobContainer.account_name == account_name)
+    if prefix:
+        statement = statement.where(BlobContainer.name.startswith(prefix))
+    containers = await run_in_threadpool(lambda: session.exec(statement.order_by(BlobContainer.name)).all())
+
+    root = ElementTree.Element("EnumerationResults", ServiceEndpoint=f"/blob/{account_name}/")
+    _element(root, "Prefix", prefix)
+    items = _element(root, "Containers")
+    for container in containers:
+        item = _element(items, "Container")
+        _element(item, "Name", container.name)
+        properties = _element(item, "Properties")
+        _element(properties, "Last-Modified", _http_date(container.created_at))
+    return _xml_response(root)
+
+@router.put("/{account_name}/{container_name}")
+async def create_container(
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    restype: Optional[str] = None,
+):
+    """
+    Create Container (`restype=container`).
+    """
+    if restype != "container":
+        raise _unsupported("restype", restype)
+    if not _CONTAINER_NAME.match(container_name):
+        raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidResourceName", "The specified resource name contains invalid characters.")
+
+    def create():
+        begin_write(session)
+        _require_account(session, account_name)
+        if _find_container(session, account_name, container_name) is not None:
+            raise StorageError(status.HTTP_409_CONFLICT, "ContainerAlreadyExists", "The specified container already exists.")
+        container = BlobContainer(account_name=account_name, name=container_name)
+        session.add(container)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise StorageError(status.HTTP_409_CONFLICT, "ContainerAlreadyExists", "The specified container already exists.") from None
+        os.makedirs(_container_dir(account_name, container_name), exist_ok=True)
+        return container.created_at
+
+    created_at = await run_in_threadpool(create)
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        headers=_headers(**{"Last-Modified": _http_date(created_at)}),
+    )
+
+@router.get("/{account_name}/{container_name}")
+async def get_container(
+    request: Request,
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    restype: Optional[str] = None,
+    comp: Optional[str] = None,
+    prefix: str = "",
+    marker: Optional[str] = None,
+    maxresults: int = Query(default=DEFAULT_MAX_RESULTS, ge=1, le=DEFAULT_MAX_RESULTS),
+):
+    """
+    Get Container Properties (`restype=container`) or List Blobs
+    (`restype=container&comp=list`), paged with `marker` and `maxresults`.
+    """
+    if restype != "container":
+        raise _unsupported("restype", restype)
+    container = await run_in_threadpool(_require_container, session, account_name, container_name)
+    if comp is None:
+        return Response(headers=_headers(**{"Last-Modified": _http_date(container.created_at)}))
+    if comp != "list":
+        raise _unsupported("comp", comp)
+
+    statement = select(Blob).where(Blob.account_name == account_name, Blob.container_name == container_name)
+    if prefix:
+        statement = statement.where(Blob.name.startswith(prefix))
+    if marker:
+        statement = statement.where(Blob.name > marker)
+    statement = statement.order_by(Blob.name).limit(maxresults + 1)
+    blobs = await run_in_threadpool(lambda: session.exec(statement).all())
+
+    root = ElementTree.Element(
+        "EnumerationResults",
+        ServiceEndpoint=f"/blob/{account_name}/",
+        ContainerName=container_name,
+    )
+    _element(root, "Prefix", prefix)
+    _element(root, "Marker", marker or "")
+    _element(root, "MaxResults", str(maxresults))
+    items = _element(root, "Blobs")
+    for blob in blobs[:maxresults]:
+        item = _element(items, "Blob")
+        _element(item, "Name", blob.name)
+        properties = _element(item, "Properties")
+        _element(properties, "Last-Modified", _http_date(blob.last_modified))
+        _element(properties, "Etag", blob.etag.strip('"'))
+        _element(properties, "Content-Length", str(blob.size))
+        _element(properties, "Content-Type", blob.content_type)
+        _element(properties, "BlobType", "BlockBlob")
+    # The marker is the last name returned; the next page starts after it.
+    _element(root, "NextMarker", blobs[maxresults - 1].name if len(blobs) > maxresults else "")
+    return _xml_response(root)
+
+@router.delete("/{account_name}/{container_name}")
+async def delete_container(
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    restype: Optional[str] = None,
+):
+    """
+    Delete Container (`restype=container`) and all of its blobs.
+    """
+    if restype != "container":
+        raise _unsupported("restype", restype)
+
+    def remove():
+        begin_write(session)
+        container = _require_container(session, account_name, container_name)
+        session.execute(delete(Blob).where(Blob.account_name == account_name, Blob.container_name == container_name))
+        session.delete(container)
+        session.commit()
+        shutil.rmtree(_container_dir(account_name, container_name), ignore_errors=True)
+
+    await run_in_threadpool(remove)
+    return Response(status_code=status.HTTP_202_ACCEPTED, headers=_headers())
+
+# Blob operations
+
+@router.put("/{account_name}/{container_name}/{blob_name:path}")
+async def put_blob(
+    request: Request,
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    blob_name: str,
+    comp: Optional[str] = None,
+    blockid: Optional[str] = None,
+):
+    """
+    Put Blob, Put Block (`comp=block&blockid=...`) or Put Block List
+    (`comp=blocklist`).
+
+    Put Block List looks every listed block ID up among the staged blocks,
+    whether it is listed as `Latest`, `Uncommitted` or `Committed`; the
+    blocks of an already committed blob cannot be reused.
+    """
+    await run_in_threadpool(_require_container, session, account_name, container_name)
+    # End the read transaction, so none is held open during the upload.
+    await run_in_threadpool(session.rollback)
+    container_dir = _container_dir(account_name, container_name)
+    content_type = request.headers.get("x-ms-blob-content-type") or request.headers.get("content-type") or "application/octet-stream"
+
+    if comp is None:
+        blob_type = request.headers.get("x-ms-blob-type", "BlockBlob")
+        if blob_type != "BlockBlob":
+            raise StorageError(status.HTTP_400_BAD_REQUEST, "UnsupportedHeader", f"Blob type '{blob_type}' is not supported.")
+        temp_path = await _receive_to_file(request, container_dir)
+        stat = await run_in_threadpool(_commit_blob, session, account_name, container_name, blob_name, temp_path, content_type)
+        return _created(stat)
+
+    if comp == "block":
+        block_path = os.path.join(_blocks_dir(account_name, container_name, blob_name), _block_file_name(blockid))
+        temp_path = await _receive_to_file(request, os.path.dirname(block_path))
+        await run_in_threadpool(os.replace, temp_path, block_path)
+        return Response(status_code=status.HTTP_201_CREATED, headers=_headers())
+
+    if comp == "blocklist":
+        try:
+            block_list = ElementTree.fromstring(await request.body())
+        except ElementTree.ParseError:
+            raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidXmlDocument", "XML specified is not syntactically valid.") from None
+        blocks_dir = _blocks_dir(account_name, container_name, blob_name)
+        paths = []
+        for entry in block_list:
+            if entry.tag not in ("Latest", "Uncommitted", "Committed"):
+                raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidXmlNodeValue", f"Unexpected element '{entry.tag}'.")
+            paths.append(os.path.join(blocks_dir, _block_file_name((entry.text or "").strip())))
+        if not all(map(os.path.isfile, paths)):
+            raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidBlockList", "The specified block list is invalid.")
+        temp_path = await run_in_threadpool(_concatenate, paths, container_dir)
+        stat = await run_in_threadpool(_commit_blob, session, account_name, container_name, blob_name, temp_path, content_type)
+        return _created(stat)
+
+    raise _unsupported("comp", comp)
+
+@router.get("/{account_name}/{container_name}/{blob_name:path}")
+@router.head("/{account_name}/{container_name}/{blob_name:path}", include_in_schema=False)
+async def get_blob(
+    request: Request,
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    blob_name: str,
+):
+    """
+    Get Blob, or Get Blob Properties for HEAD requests. Supports a single
+    byte range from the `x-ms-range` or `Range` header.
+    """
+    blob = await run_in_threadpool(_require_blob, session, account_name, container_name, blob_name)
+    path = _blob_path(account_name, container_name, blob_name)
+    try:
+        stat = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        raise StorageError(status.HTTP_404_NOT_FOUND, "BlobNotFound", "The specified blob does not exist.") from None
+
+    x_ms_range = request.headers.get("x-ms-range")
+    if x_ms_range:
+        # FileResponse reads the standard header; x-ms-range takes precedence.
+        request.scope["headers"] = [
+            (name, value) for name, value in request.scope["headers"] if name != b"range"
+        ] + [(b"range", x_ms_range.encode("latin-1"))]
+
+    return BlobFileResponse(
+        path,
+        stat_result=stat,
+        media_type=blob.content_type,
+        headers=_headers(**{
+            "ETag": _etag(stat),
+            "x-ms-blob-type": "BlockBlob",
+        }),
+    )
+
+@router.delete("/{account_name}/{container_name}/{blob_name:path}")
+async def delete_blob(
+    *,
+    session: Session = Depends(get_session),
+    account_name: str,
+    container_name: str,
+    blob_name: str,
+):
+    """
+    Delete Blob, including its uncommitted blocks.
+    """
+    def remove():
+        begin_write(session)
+        blob = _require_blob(session, account_name, container_name, blob_name)
+        session.delete(blob)
+        session.commit()
+        try:
+            os.unlink(_blob_path(account_name, container_name, blob_name))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(_blocks_dir(account_name, container_name, blob_name), ignore_errors=True)
+
+    await run_in_threadpool(remove)
+    return Response(status_code=status.HTTP_202_ACCEPTED, headers=_headers())
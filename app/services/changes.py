@@ -0,0 +1,128 @@
+"""
+API route for the resource change feed.
+
+Streams create, update and delete events for compute, networking and storage
+resources as server-sent events, so controllers and test harnesses can watch
+for state changes instead of polling the list and get endpoints.
+"""
+import asyncio
+import json
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.changefeed import BROKER, OVERFLOW, ChangeFilter, to_event
+from app.db import get_session_factory
+from app.models import ResourceChange
+from app.security import verify_token
+from app.throttling import throttle
+
+BACKLOG_PAGE_SIZE = 500
+HEARTBEAT_INTERVAL = 15.0
+
+router = APIRouter(
+    prefix="/providers/Microsoft.Emulator",
+    tags=["changes"],
+    dependencies=[Depends(verify_token), Depends(throttle)],
+)
+
+def _load_changes(open_session: Callable[[], ContextManager[Session]], change_filter: ChangeFilter, after: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Reads a page of stored events with a sequence number above `after`, in
+    a session of its own, so no connection is held while the stream waits.
+    While a listener publishes the events, only those it has published are
+    read (see `ChangeBroker.horizon`); later ones arrive live, in order.
+    """
+    statement = select(ResourceChange).where(ResourceChange.id > after)
+    horizon = BROKER.horizon
+    if horizon is not None:
+        statement = statement.where(ResourceChange.id <= horizon)
+    if change_filter.subscription_id:
+        statement = statement.where(ResourceChange.subscription_id == change_filter.subscription_id)
+    if change_filter.resource_group:
+        statement = statement.where(func.lower(ResourceChange.resource_group) == change_filter.resource_group)
+    if change_filter.resource_type:
+        statement = statement.where(func.lower(ResourceChange.resource_type) == change_filter.resource_type)
+    with open_session() as session:
+        return [to_event(change) for change in session.exec(statement.order_by(ResourceChange.id).limit(limit))]
+
+def _format_event(change_event: Dict[str, Any]) -> str:
+    return (
+        f"id: {change_event['sequenceNumber']}\n"
+        f"event: {change_event['changeType']}\n"
+        f"data: {json.dumps(change_event)}\n\n"
+    )
+
+@router.get("/changes")
+async def stream_changes(
+    *,
+    open_session: Callable[[], ContextManager[Session]] = Depends(get_session_factory),
+    subscriptionId: Optional[str] = None,
+    resourceGroup: Optional[str] = None,
+    resourceType: Optional[str] = None,
+    since: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1),
+    last_event_id: Optional[int] = Header(default=None),
+):
+    """
+    Stream resource change events as server-sent events.
+
+    Only changes committed after the request are sent, unless `since` (or
+    the `Last-Event-ID` header sent by reconnecting EventSource clients)
+    gives a sequence number to resume after; `since=0` replays all stored
+    events first. The stream ends after `limit` events, if given.
+    """
+    change_filter = ChangeFilter(subscriptionId, resourceGroup, resourceType)
+    resume_after = last_event_id if last_event_id is not None else since
+    # Subscribe before reading the backlog, so no event committed in between
+    # is missed; events already sent from the backlog are skipped below.
+    subscription = BROKER.subscribe(change_filter)
+
+    async def events():
+        last_sent = resume_after
+        sent = 0
+        try:
+            if resume_after is not None:
+                while True:
+                    page = await run_in_threadpool(_load_changes, open_session, change_filter, last_sent, BACKLOG_PAGE_SIZE)
+                    for change_event in page:
+                        yield _format_event(change_event)
+                        last_sent = change_event["sequenceNumber"]
+                        sent += 1
+                        if sent == limit:
+                            return
+                    if len(page) < BACKLOG_PAGE_SIZE:
+                        break
+
+            while True:
+                try:
+                    change_event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if change_event is OVERFLOW:
+                    # The client fell behind; it reconnects with Last-Event-ID
+                    # and catches up from the database.
+                    return
+                # Events are published in sequence order, and the backlog
+                # stops at the last one published (see `app.changefeed`), so
+                # anything at or below the last one sent was already sent.
+                if last_sent is not None and change_event["sequenceNumber"] <= last_sent:
+                    continue
+                yield _format_event(change_event)
+                last_sent = change_event["sequenceNumber"]
+                sent += 1
+                if sent == limit:
+                    return
+        finally:
+            BROKER.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -6,9 +6,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
 from typing import List
 
-from app.db import get_session
+from app.changefeed import record_change
+from app.content_hash import content_hash
+from app.db import begin_write, get_session
 from app.models import VirtualMachine
+from app.references import find_references, record_references
 from app.security import verify_token
+from app.throttling import throttle
+from app.validation import validate_request_body
 
 # Pydantic models for request bodies, separating them from the DB model
 from pydantic import BaseModel
@@ -19,13 +24,18 @@ class VirtualMachineCreate(BaseModel):
 router = APIRouter(
     prefix="/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Compute",
     tags=["compute"],
-    dependencies=[Depends(verify_token)],
+    dependencies=[Depends(verify_token), Depends(throttle)],
 )
 
-@router.put("/virtualMachines/{vm_name}", response_model=VirtualMachine)
+@router.put(
+    "/virtualMachines/{vm_name}",
+    response_model=VirtualMachine,
+    dependencies=[Depends(validate_request_body("VirtualMachines_CreateOrUpdate"))],
+)
 def create_or_update_vm(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vm_name: str,
     vm_body: VirtualMachineCreate,
@@ -37,8 +47,19 @@ def create_or_update_vm(
     statement = select(VirtualMachine).where(
         VirtualMachine.name == vm_name,
         VirtualMachine.resource_group == resourceGroupName,
+        VirtualMachine.subscription_id == subscriptionId,
     )
+    desired_hash = content_hash(vm_body)
     db_vm = session.exec(statement).first()
+    if db_vm is None or db_vm.content_hash != desired_hash:
+        # Unchanged PUTs are answered from this deferred transaction; a
+        # write needs the write lock, and the row as read under it.
+        session.rollback()
+        begin_write(session)
+        db_vm = session.exec(statement).first()
+    if db_vm and db_vm.content_hash == desired_hash:
+        # Unchanged since the last PUT; nothing to write.
+        return db_vm
 
     if db_vm:
         # Update existing VM
@@ -50,12 +71,16 @@ def create_or_update_vm(
         db_vm = VirtualMachine(
             name=vm_name,
             resource_group=resourceGroupName,
+            subscription_id=subscriptionId,
             location=vm_body.location,
             vm_size=vm_body.properties.get("hardwareProfile", {}).get("vmSize", "Unknown"),
             provisioning_state="Succeeded",
         )
 
+    db_vm.content_hash = desired_hash
     session.add(db_vm)
+    record_change(session, "Update" if db_vm.id else "Create", db_vm)
+    record_references(session, db_vm, find_references(vm_body.model_dump()))
     session.commit()
     session.refresh(db_vm)
     return db_vm
@@ -64,6 +89,7 @@ def create_or_update_vm(
 def get_vm(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vm_name: str,
 ):
@@ -73,6 +99,7 @@ def get_vm(
     statement = select(VirtualMachine).where(
         VirtualMachine.name == vm_name,
         VirtualMachine.resource_group == resourceGroupName,
+        VirtualMachine.subscription_id == subscriptionId,
     )
     vm = session.exec(statement).first()
     if not vm:
@@ -83,12 +110,16 @@ def get_vm(
 def list_vms_in_rg(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
 ):
     """
     List all virtual machines within a specific resource group.
     """
-    statement = select(VirtualMachine).where(VirtualMachine.resource_group == resourceGroupName)
+    statement = select(VirtualMachine).where(
+        VirtualMachine.resource_group == resourceGroupName,
+        VirtualMachine.subscription_id == subscriptionId,
+    )
     vms = session.exec(statement).all()
     return vms
 
@@ -96,15 +127,18 @@ def list_vms_in_rg(
 def delete_vm(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vm_name: str,
 ):
     """
     Delete a specific virtual machine.
     """
+    begin_write(session)
     statement = select(VirtualMachine).where(
         VirtualMachine.name == vm_name,
         VirtualMachine.resource_group == resourceGroupName,
+        VirtualMachine.subscription_id == subscriptionId,
     )
     vm_to_delete = session.exec(statement).first()
 
@@ -112,5 +146,7 @@ def delete_vm(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Virtual machine not found")
 
     session.delete(vm_to_delete)
+    record_change(session, "Delete", vm_to_delete)
+    record_references(session, vm_to_delete, [])
     session.commit()
     return None
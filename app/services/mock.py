@@ -0,0 +1,70 @@
+"""
+Catch-all API route serving stored resources by ID, and otherwise mock
+responses generated from the API specs.
+
+Any GET request not handled by a service router whose path is the ID of a
+resource the emulator stores, in any letter case, returns that resource.
+The lookup uses the index on the lower-cased resource ID of the resource
+type's table. Other paths are matched against the path templates of the
+indexed specifications (see `app.spec_index`) and answered with the mock
+response precomputed from the operation's schema. This router must be
+included after all others.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, SQLModel, select
+
+from app.db import get_session
+from app.errors import AzureError
+from app.resource_types import parse_resource_id
+from app.security import verify_token
+from app.throttling import throttle
+
+router = APIRouter(
+    tags=["mock"],
+    dependencies=[Depends(verify_token), Depends(throttle)],
+)
+
+def _find_resource(session: Session, resource_id: str) -> Optional[SQLModel]:
+    """
+    Returns the stored resource with an ID, compared case-insensitively.
+    """
+    parsed = parse_resource_id(resource_id)
+    if parsed is None:
+        return None
+    resource_type, key = parsed
+    model = resource_type.model
+    return session.exec(select(model).where(model.resource_id_key == key)).first()
+
+@router.get("/{resource_path:path}", include_in_schema=False)
+async def get_mock_response(
+    request: Request,
+    resource_path: str,
+    api_version: Optional[str] = Query(default=None, alias="api-version"),
+    session: Session = Depends(get_session),
+):
+    """
+    Return the stored resource with the path as its ID, or else the mock
+    response of the spec operation matching the path, from the spec of the
+    requested `api-version` (the latest if none is given).
+    """
+    resource = await run_in_threadpool(_find_resource, session, request.url.path)
+    if resource is not None:
+        return resource
+
+    spec_index = getattr(request.app.state, "spec_index", None)
+    route = spec_index.snapshot.routes.match(request.url.path) if spec_index is not None else None
+    if route is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No API specification matches this path")
+
+    endpoint = route.select(api_version)
+    if endpoint is None:
+        supported = ", ".join(sorted(route.versions, reverse=True))
+        raise AzureError(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="InvalidApiVersionParameter",
+            message=f"The api-version '{api_version}' is invalid. The supported versions are '{supported}'.",
+        )
+    return Response(endpoint.render(request.url.path), media_type="application/json")
@@ -6,9 +6,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
 from typing import List
 
-from app.db import get_session
+from app.changefeed import record_change
+from app.content_hash import content_hash
+from app.db import begin_write, get_session
 from app.models import VirtualNetwork
+from app.references import find_references, record_references
 from app.security import verify_token
+from app.throttling import throttle
+from app.validation import validate_request_body
 
 # Pydantic models for request bodies
 from pydantic import BaseModel
@@ -19,13 +24,18 @@ class VirtualNetworkCreate(BaseModel):
 router = APIRouter(
     prefix="/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Network",
     tags=["networking"],
-    dependencies=[Depends(verify_token)],
+    dependencies=[Depends(verify_token), Depends(throttle)],
 )
 
-@router.put("/virtualNetworks/{vnet_name}", response_model=VirtualNetwork)
+@router.put(
+    "/virtualNetworks/{vnet_name}",
+    response_model=VirtualNetwork,
+    dependencies=[Depends(validate_request_body("VirtualNetworks_CreateOrUpdate"))],
+)
 def create_or_update_vnet(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vnet_name: str,
     vnet_body: VirtualNetworkCreate,
@@ -36,8 +46,19 @@ def create_or_update_vnet(
     statement = select(VirtualNetwork).where(
         VirtualNetwork.name == vnet_name,
         VirtualNetwork.resource_group == resourceGroupName,
+        VirtualNetwork.subscription_id == subscriptionId,
     )
+    desired_hash = content_hash(vnet_body)
     db_vnet = session.exec(statement).first()
+    if db_vnet is None or db_vnet.content_hash != desired_hash:
+        # Unchanged PUTs are answered from this deferred transaction; a
+        # write needs the write lock, and the row as read under it.
+        session.rollback()
+        begin_write(session)
+        db_vnet = session.exec(statement).first()
+    if db_vnet and db_vnet.content_hash == desired_hash:
+        # Unchanged since the last PUT; nothing to write.
+        return db_vnet
 
     address_space = vnet_body.properties.get("addressSpace", {}).get("addressPrefixes", [""])[0]
 
@@ -50,11 +71,15 @@ def create_or_update_vnet(
         db_vnet = VirtualNetwork(
             name=vnet_name,
             resource_group=resourceGroupName,
+            subscription_id=subscriptionId,
             location=vnet_body.location,
             address_space=address_space,
         )
 
+    db_vnet.content_hash = desired_hash
     session.add(db_vnet)
+    record_change(session, "Update" if db_vnet.id else "Create", db_vnet)
+    record_references(session, db_vnet, find_references(vnet_body.model_dump()))
     session.commit()
     session.refresh(db_vnet)
     return db_vnet
@@ -63,6 +88,7 @@ def create_or_update_vnet(
 def get_vnet(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vnet_name: str,
 ):
@@ -72,6 +98,7 @@ def get_vnet(
     statement = select(VirtualNetwork).where(
         VirtualNetwork.name == vnet_name,
         VirtualNetwork.resource_group == resourceGroupName,
+        VirtualNetwork.subscription_id == subscriptionId,
     )
     vnet = session.exec(statement).first()
     if not vnet:
@@ -82,12 +109,16 @@ def get_vnet(
 def list_vnets_in_rg(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
 ):
     """
     List all virtual networks within a specific resource group.
     """
-    statement = select(VirtualNetwork).where(VirtualNetwork.resource_group == resourceGroupName)
+    statement = select(VirtualNetwork).where(
+        VirtualNetwork.resource_group == resourceGroupName,
+        VirtualNetwork.subscription_id == subscriptionId,
+    )
     vnets = session.exec(statement).all()
     return vnets
 
@@ -95,15 +126,18 @@ def list_vnets_in_rg(
 def delete_vnet(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     vnet_name: str,
 ):
     """
     Delete a specific virtual network.
     """
+    begin_write(session)
     statement = select(VirtualNetwork).where(
         VirtualNetwork.name == vnet_name,
         VirtualNetwork.resource_group == resourceGroupName,
+        VirtualNetwork.subscription_id == subscriptionId,
     )
     vnet_to_delete = session.exec(statement).first()
 
@@ -111,5 +145,7 @@ def delete_vnet(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Virtual network not found")
 
     session.delete(vnet_to_delete)
+    record_change(session, "Delete", vnet_to_delete)
+    record_references(session, vnet_to_delete, [])
     session.commit()
     return None
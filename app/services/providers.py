@@ -0,0 +1,139 @@
+"""
+API routes for resource provider registration, locations and cloud metadata.
+
+These are the endpoints clients query when they start, before touching any
+resource. The bodies are prepared by the `ProviderCatalog` (see
+`app.provider_catalog`), so serving them costs no parsing or serialization.
+"""
+import json
+import re
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+
+from app.errors import AzureError
+from app.provider_catalog import ProviderCatalog, unknown_provider
+from app.security import verify_token
+from app.throttling import throttle
+
+_NAMESPACE = re.compile(r"^[A-Za-z][A-Za-z0-9]*(\.[A-Za-z][A-Za-z0-9]*)+$")
+
+# Replaced by the emulator's base URL when the metadata is served.
+_BASE_URL_PLACEHOLDER = b"{baseUrl}"
+
+_CLOUD_METADATA = {
+    "name": "AzureCloud",
+    "portal": "{baseUrl}",
+    "resourceManager": "{baseUrl}/",
+    "authentication": {
+        "loginEndpoint": "{baseUrl}/",
+        "audiences": ["https://management.core.windows.net/", "https://management.azure.com/"],
+        "tenant": "common",
+        "identityProvider": "AAD",
+    },
+    "media": "{baseUrl}/",
+    "graphAudience": "https://graph.windows.net/",
+    "graph": "{baseUrl}/",
+    "microsoftGraphResourceId": "https://graph.microsoft.com/",
+    "suffixes": {
+        "azureDataLakeStoreFileSystem": "azuredatalakestore.net",
+        "acrLoginServer": "azurecr.io",
+        "sqlServerHostname": "database.windows.net",
+        "keyVaultDns": "vault.azure.net",
+        "storage": "core.windows.net",
+    },
+}
+_METADATA_OBJECT = json.dumps(_CLOUD_METADATA, separators=(",", ":")).encode()
+# Since 2022-09-01 the endpoint lists every cloud instead of returning one.
+_METADATA_LIST = b"[" + _METADATA_OBJECT + b"]"
+
+router = APIRouter(
+    tags=["providers"],
+    dependencies=[Depends(verify_token), Depends(throttle)],
+)
+
+# Cloud metadata is fetched before clients have a token.
+metadata_router = APIRouter(tags=["providers"])
+
+def get_provider_catalog(request: Request) -> ProviderCatalog:
+    """
+    Dependency returning the provider catalog, building it from the spec
+    index on first use if the application has not built one.
+    """
+    catalog = getattr(request.app.state, "provider_catalog", None)
+    if catalog is None:
+        spec_index = getattr(request.app.state, "spec_index", None)
+        catalog = ProviderCatalog.build(spec_index.snapshot.endpoints if spec_index is not None else [])
+        request.app.state.provider_catalog = catalog
+    return catalog
+
+def _json(body: bytes) -> Response:
+    return Response(body, media_type="application/json")
+
+def _provider(catalog: ProviderCatalog, namespace: str, subscription_id: Optional[str] = None) -> Response:
+    body = catalog.get_provider(namespace, subscription_id)
+    if body is None:
+        if not _NAMESPACE.match(namespace):
+            raise AzureError(
+                status_code=status.HTTP_404_NOT_FOUND,
+                code="InvalidResourceNamespace",
+                message=f"The resource namespace '{namespace}' is invalid.",
+            )
+        body = unknown_provider(namespace, subscription_id)
+    return _json(body)
+
+@router.get("/providers")
+def list_tenant_providers(catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    List the resource providers at tenant scope.
+    """
+    return _json(catalog.list_providers())
+
+@router.get("/providers/{namespace}")
+def get_tenant_provider(namespace: str, catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    Get a resource provider at tenant scope.
+    """
+    return _provider(catalog, namespace)
+
+@router.get("/subscriptions/{subscriptionId}/providers")
+def list_providers(subscriptionId: str, catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    List the resource providers of a subscription, all registered.
+    """
+    return _json(catalog.list_providers(subscriptionId))
+
+@router.get("/subscriptions/{subscriptionId}/providers/{namespace}")
+def get_provider(subscriptionId: str, namespace: str, catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    Get a resource provider of a subscription.
+    """
+    return _provider(catalog, namespace, subscriptionId)
+
+@router.post("/subscriptions/{subscriptionId}/providers/{namespace}/register")
+def register_provider(subscriptionId: str, namespace: str, catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    Register a resource provider. Providers are always registered, so this
+    only returns the provider.
+    """
+    return _provider(catalog, namespace, subscriptionId)
+
+@router.get("/subscriptions/{subscriptionId}/locations")
+def list_locations(subscriptionId: str, catalog: ProviderCatalog = Depends(get_provider_catalog)):
+    """
+    List the locations available to a subscription.
+    """
+    return _json(catalog.list_locations(subscriptionId))
+
+@metadata_router.get("/metadata/endpoints")
+def get_metadata_endpoints(
+    request: Request,
+    api_version: Optional[str] = Query(default=None, alias="api-version"),
+):
+    """
+    Cloud metadata pointing clients at this emulator for Resource Manager
+    (e.g. for `ARM_METADATA_HOSTNAME`).
+    """
+    body = _METADATA_LIST if api_version and api_version >= "2022-09-01" else _METADATA_OBJECT
+    base_url = str(request.base_url).rstrip("/")
+    return _json(body.replace(_BASE_URL_PLACEHOLDER, json.dumps(base_url)[1:-1].encode()))
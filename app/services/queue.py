@@ -0,0 +1,307 @@
+"""
+API routes for a local Azure Queue Storage data plane.
+
+Queues are addressed path-style like blobs: `/queue/{accountName}/{queueName}`,
+with messages under `/messages`. Queues belong to existing `StorageAccount`s:
+every operation checks that the account exists, and deleting the account
+deletes its queues. Queues and messages are kept by the `QueueStore` in
+memory and in its append-only log under `QUEUE_STORAGE_PATH`; changes are
+acknowledged once the log has been synced, so they survive a restart.
+
+Store operations run in the threadpool: they may wait for the log lock,
+which other workers or a compaction can hold, and replay the records other
+workers appended. Waiting for the log to be synced is done on the event
+loop without blocking it.
+"""
+import asyncio
+import re
+from concurrent.futures import Future
+from email.utils import formatdate
+from typing import Dict, List, Optional
+from xml.etree import ElementTree
+
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+
+from app.db import get_session
+from app.errors import StorageError
+from app.models import StorageAccount
+from app.queuestore import MAX_MESSAGES_PER_REQUEST, QueueMessage, QueueStore
+from app.security import verify_token
+
+API_VERSION = "2023-11-03"
+MAX_VISIBILITY_TIMEOUT = 7 * 24 * 3600
+DEFAULT_MESSAGE_TTL = 7 * 24 * 3600
+# Expiration time reported for messages that never expire.
+NEVER_EXPIRES = "Fri, 31 Dec 9999 23:59:59 GMT"
+
+_ACCOUNT_NAME = re.compile(r"^[a-z0-9]{3,24}$")
+_QUEUE_NAME = re.compile(r"^(?!.*--)[a-z0-9][a-z0-9-]{1,61}[a-z0-9]$")
+
+router = APIRouter(
+    prefix="/queue",
+    tags=["queue"],
+    dependencies=[Depends(verify_token)],
+)
+
+def get_queue_store(request: Request) -> QueueStore:
+    """
+    Dependency returning the application's queue store.
+    """
+    return request.app.state.queue_store
+
+async def _durable(future: Optional[Future]) -> None:
+    if future is not None:
+        await asyncio.wrap_future(future)
+
+# Responses
+
+def _headers(**extra: str) -> Dict[str, str]:
+    return {"x-ms-version": API_VERSION, **extra}
+
+def _http_date(timestamp: float) -> str:
+    if timestamp == float("inf"):
+        return NEVER_EXPIRES
+    return formatdate(timestamp, usegmt=True)
+
+def _element(parent: ElementTree.Element, tag: str, text: Optional[str] = None) -> ElementTree.Element:
+    element = ElementTree.SubElement(parent, tag)
+    if text is not None:
+        element.text = text
+    return element
+
+def _xml_response(root: ElementTree.Element, status_code: int = status.HTTP_200_OK) -> Response:
+    return Response(
+        ElementTree.tostring(root, encoding="utf-8", xml_declaration=True),
+        status_code=status_code,
+        media_type="application/xml",
+        headers=_headers(),
+    )
+
+def _messages_response(messages: List[QueueMessage], *, receipts: bool, content: bool, status_code: int = status.HTTP_200_OK) -> Response:
+    root = ElementTree.Element("QueueMessagesList")
+    for message in messages:
+        item = _element(root, "QueueMessage")
+        _element(item, "MessageId", message.message_id)
+        _element(item, "InsertionTime", _http_date(message.inserted))
+        _element(item, "ExpirationTime", _http_date(message.expires))
+        if receipts:
+            _element(item, "PopReceipt", message.pop_receipt)
+            _element(item, "TimeNextVisible", _http_date(message.visible_at))
+        if content:
+            _element(item, "DequeueCount", str(message.dequeue_count))
+            _element(item, "MessageText", message.text)
+    return _xml_response(root, status_code)
+
+def _unsupported(parameter: str, value: Optional[str]) -> StorageError:
+    return StorageError(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        code="InvalidQueryParameterValue",
+        message=f"Value for one of the query parameters specified in the request URI is invalid: {parameter}={value}.",
+    )
+
+async def _message_text(request: Request) -> str:
+    try:
+        root = ElementTree.fromstring(await request.body())
+    except ElementTree.ParseError:
+        root = None
+    text = root.find("MessageText") if root is not None and root.tag == "QueueMessage" else None
+    if text is None:
+        raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidXmlDocument", "XML specified is not syntactically valid.")
+    return text.text or ""
+
+def _require_account(session: Session, account_name: str) -> None:
+    if not _ACCOUNT_NAME.match(account_name):
+        raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidResourceName", "The specified resource name contains invalid characters.")
+    if session.exec(select(StorageAccount.id).where(StorageAccount.name == account_name)).first() is None:
+        raise StorageError(status.HTTP_404_NOT_FOUND, "ResourceNotFound", "The specified storage account does not exist.")
+
+# Service and queue operations
+
+@router.get("/{account_name}")
+async def list_queues(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    comp: Optional[str] = None,
+    prefix: str = "",
+):
+    """
+    List Queues (`comp=list`).
+    """
+    if comp != "list":
+        raise _unsupported("comp", comp)
+    await run_in_threadpool(_require_account, session, account_name)
+
+    root = ElementTree.Element("EnumerationResults", ServiceEndpoint=f"/queue/{account_name}/")
+    _element(root, "Prefix", prefix)
+    items = _element(root, "Queues")
+    for queue_name in await run_in_threadpool(store.list_queues, account_name, prefix):
+        _element(_element(items, "Queue"), "Name", queue_name)
+    return _xml_response(root)
+
+@router.put("/{account_name}/{queue_name}")
+async def create_queue(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+):
+    """
+    Create Queue. Answers 204 if the queue already exists.
+    """
+    if not _QUEUE_NAME.match(queue_name):
+        raise StorageError(status.HTTP_400_BAD_REQUEST, "InvalidResourceName", "The specified resource name contains invalid characters.")
+    await run_in_threadpool(_require_account, session, account_name)
+    created, future = await run_in_threadpool(store.create_queue, account_name, queue_name)
+    await _durable(future)
+    return Response(
+        status_code=status.HTTP_201_CREATED if created else status.HTTP_204_NO_CONTENT,
+        headers=_headers(),
+    )
+
+@router.get("/{account_name}/{queue_name}")
+async def get_queue_metadata(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+    comp: Optional[str] = None,
+):
+    """
+    Get Queue Metadata (`comp=metadata`), with the approximate number of
+    messages in the queue.
+    """
+    if comp != "metadata":
+        raise _unsupported("comp", comp)
+    await run_in_threadpool(_require_account, session, account_name)
+    count = await run_in_threadpool(store.approximate_message_count, account_name, queue_name)
+    return Response(headers=_headers(**{"x-ms-approximate-messages-count": str(count)}))
+
+@router.delete("/{account_name}/{queue_name}")
+async def delete_queue(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+):
+    """
+    Delete Queue and all of its messages.
+    """
+    await run_in_threadpool(_require_account, session, account_name)
+    await _durable(await run_in_threadpool(store.delete_queue, account_name, queue_name))
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_headers())
+
+# Message operations
+
+@router.post("/{account_name}/{queue_name}/messages")
+async def put_message(
+    request: Request,
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+    visibilitytimeout: int = Query(default=0, ge=0, le=MAX_VISIBILITY_TIMEOUT),
+    messagettl: int = Query(default=DEFAULT_MESSAGE_TTL, ge=-1),
+):
+    """
+    Put Message. The message becomes visible after `visibilitytimeout`
+    seconds and expires after `messagettl` seconds, or never for -1.
+    """
+    if messagettl == 0:
+        raise _unsupported("messagettl", str(messagettl))
+    text = await _message_text(request)
+    await run_in_threadpool(_require_account, session, account_name)
+    message, future = await run_in_threadpool(store.put_message, account_name, queue_name, text, visibilitytimeout, messagettl)
+    await _durable(future)
+    return _messages_response([message], receipts=True, content=False, status_code=status.HTTP_201_CREATED)
+
+@router.get("/{account_name}/{queue_name}/messages")
+async def get_messages(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+    numofmessages: int = Query(default=1, ge=1, le=MAX_MESSAGES_PER_REQUEST),
+    visibilitytimeout: int = Query(default=30, ge=1, le=MAX_VISIBILITY_TIMEOUT),
+    peekonly: bool = False,
+):
+    """
+    Get Messages, hiding the returned messages for `visibilitytimeout`
+    seconds, or Peek Messages (`peekonly=true`) without changing them.
+    """
+    await run_in_threadpool(_require_account, session, account_name)
+    if peekonly:
+        messages = await run_in_threadpool(store.peek_messages, account_name, queue_name, numofmessages)
+        return _messages_response(messages, receipts=False, content=True)
+    messages, future = await run_in_threadpool(store.get_messages, account_name, queue_name, numofmessages, visibilitytimeout)
+    await _durable(future)
+    return _messages_response(messages, receipts=True, content=True)
+
+@router.delete("/{account_name}/{queue_name}/messages")
+async def clear_messages(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+):
+    """
+    Clear Messages.
+    """
+    await run_in_threadpool(_require_account, session, account_name)
+    await _durable(await run_in_threadpool(store.clear_messages, account_name, queue_name))
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_headers())
+
+@router.put("/{account_name}/{queue_name}/messages/{message_id}")
+async def update_message(
+    request: Request,
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+    message_id: str,
+    popreceipt: str,
+    visibilitytimeout: int = Query(ge=0, le=MAX_VISIBILITY_TIMEOUT),
+):
+    """
+    Update Message: changes its visibility timeout and, if a body is
+    given, its text. The message gets a new pop receipt.
+    """
+    text = await _message_text(request) if await request.body() else None
+    await run_in_threadpool(_require_account, session, account_name)
+    message, future = await run_in_threadpool(store.update_message, account_name, queue_name, message_id, popreceipt, visibilitytimeout, text)
+    await _durable(future)
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers=_headers(**{
+            "x-ms-popreceipt": message.pop_receipt,
+            "x-ms-time-next-visible": _http_date(message.visible_at),
+        }),
+    )
+
+@router.delete("/{account_name}/{queue_name}/messages/{message_id}")
+async def delete_message(
+    *,
+    session: Session = Depends(get_session),
+    store: QueueStore = Depends(get_queue_store),
+    account_name: str,
+    queue_name: str,
+    message_id: str,
+    popreceipt: str,
+):
+    """
+    Delete Message, given the pop receipt from its last Get Messages or
+    Update Message.
+    """
+    await run_in_threadpool(_require_account, session, account_name)
+    await _durable(await run_in_threadpool(store.delete_message, account_name, queue_name, message_id, popreceipt))
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_headers())
@@ -0,0 +1,33 @@
+"""
+API route for the references between resources.
+
+Answers which resources a resource references and which resources
+reference it, from the in-process reference graph (see `app.references`)
+instead of a scan of every resource table.
+"""
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, Query
+
+from app.references import REFERENCE_GRAPH
+from app.security import verify_token
+from app.throttling import throttle
+
+router = APIRouter(
+    prefix="/providers/Microsoft.Emulator",
+    tags=["references"],
+    dependencies=[Depends(verify_token), Depends(throttle)],
+)
+
+@router.get("/references")
+def get_references(resource_id: str = Query(alias="resourceId")) -> Dict[str, Any]:
+    """
+    List the resource IDs a resource references and the resources that
+    reference it. Both directions work for any ID, including IDs of
+    resources the emulator does not store.
+    """
+    return {
+        "resourceId": resource_id,
+        "references": REFERENCE_GRAPH.references(resource_id),
+        "referencedBy": REFERENCE_GRAPH.referenced_by(resource_id),
+    }
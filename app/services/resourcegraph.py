@@ -0,0 +1,112 @@
+"""
+API routes for an Azure Resource Graph compatible query endpoint.
+
+A single query covers every resource table, replacing one list call per
+resource type and resource group. Queries use the KQL subset implemented in
+`app.kql` and are executed as one SQL statement.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, status
+from pydantic import BaseModel, Field
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+from app.db import get_session
+from app.errors import AzureError
+from app.kql import KQLError, compile_query, parse, shape_row
+from app.security import verify_token
+from app.throttling import throttle
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Pydantic models for request bodies
+class QueryRequestOptions(BaseModel):
+    top: Optional[int] = Field(default=None, alias="$top")
+    skip: Optional[int] = Field(default=None, alias="$skip")
+    skip_token: Optional[str] = Field(default=None, alias="$skipToken")
+    result_format: str = Field(default="objectArray", alias="resultFormat")
+
+class QueryRequest(BaseModel):
+    subscriptions: List[str] = []
+    query: str
+    options: QueryRequestOptions = QueryRequestOptions()
+
+router = APIRouter(
+    prefix="/providers/Microsoft.ResourceGraph",
+    tags=["resourcegraph"],
+    dependencies=[Depends(verify_token), Depends(throttle)],
+)
+
+def _bad_request(message: str) -> AzureError:
+    return AzureError(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        code="BadRequest",
+        message="Please provide below info when asking for support: query is invalid.",
+        details=[{"code": "InvalidQuery", "message": message}],
+    )
+
+def _encode_skip_token(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"skip": offset}).encode()).decode()
+
+def _decode_skip_token(token: str) -> int:
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(token.encode()))["skip"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise _bad_request("The $skipToken is invalid.") from None
+    if not isinstance(offset, int) or offset < 0:
+        raise _bad_request("The $skipToken is invalid.")
+    return offset
+
+def _to_table(rows: List[Dict[str, Any]], column_names: List[str]) -> Dict[str, Any]:
+    """
+    Converts rows to the 'table' result format.
+    """
+    return {
+        "columns": [{"name": name, "type": "object"} for name in column_names],
+        "rows": [[row[name] for name in column_names] for row in rows],
+    }
+
+@router.post("/resources")
+def query_resources(
+    *,
+    session: Session = Depends(get_session),
+    request: QueryRequest,
+):
+    """
+    Run a Resource Graph query over all resources.
+    """
+    options = request.options
+    top = DEFAULT_PAGE_SIZE if options.top is None else options.top
+    if not 1 <= top <= MAX_PAGE_SIZE:
+        raise _bad_request(f"$top must be between 1 and {MAX_PAGE_SIZE}.")
+    offset = _decode_skip_token(options.skip_token) if options.skip_token else (options.skip or 0)
+
+    try:
+        compiled = compile_query(parse(request.query), request.subscriptions)
+    except KQLError as exc:
+        raise _bad_request(str(exc)) from None
+
+    if compiled.statement is None:
+        total, rows = 0, []
+        column_names: List[str] = []
+    else:
+        total = session.exec(select(func.count()).select_from(compiled.statement.subquery())).one()[0]
+        page = compiled.statement.order_by(*compiled.order_by).offset(offset).limit(top)
+        rows = [shape_row(row._mapping, compiled.relation) for row in session.exec(page)]
+        column_names = compiled.relation.outputs
+
+    response: Dict[str, Any] = {
+        "totalRecords": total,
+        "count": len(rows),
+        "data": _to_table(rows, column_names) if options.result_format == "table" else rows,
+        "facets": [],
+        "resultTruncated": "false",
+    }
+    if offset + len(rows) < total:
+        response["$skipToken"] = _encode_skip_token(offset + len(rows))
+    return response
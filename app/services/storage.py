@@ -2,13 +2,23 @@
 API routes for the Azure Storage service, using a database for persistence
 and realistic, structured API paths.
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+import re
+import shutil
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import delete
 from sqlmodel import Session, select
 from typing import List
 
-from app.db import get_session
-from app.models import StorageAccount
+from app.changefeed import record_change
+from app.content_hash import content_hash
+from app.db import begin_write, get_session
+from app.errors import AzureError
+from app.models import Blob, BlobContainer, StorageAccount
+from app.references import find_references, record_references
 from app.security import verify_token
+from app.services.blob import account_dir
+from app.throttling import throttle
+from app.validation import validate_request_body
 
 # Pydantic models for request bodies
 from pydantic import BaseModel
@@ -20,16 +30,24 @@ class StorageAccountCreate(BaseModel):
     sku: Sku
     kind: str
 
+# Storage account names are also directory names of the blob data plane.
+_ACCOUNT_NAME = re.compile(r"[a-z0-9]{3,24}")
+
 router = APIRouter(
     prefix="/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Storage",
     tags=["storage"],
-    dependencies=[Depends(verify_token)],
+    dependencies=[Depends(verify_token), Depends(throttle)],
 )
 
-@router.put("/storageAccounts/{account_name}", response_model=StorageAccount)
+@router.put(
+    "/storageAccounts/{account_name}",
+    response_model=StorageAccount,
+    dependencies=[Depends(validate_request_body("StorageAccounts_Create"))],
+)
 def create_or_update_storage_account(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     account_name: str,
     account_body: StorageAccountCreate,
@@ -37,11 +55,41 @@ def create_or_update_storage_account(
     """
     Create or update a storage account (upsert).
     """
+    if not _ACCOUNT_NAME.fullmatch(account_name):
+        raise AzureError(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="AccountNameInvalid",
+            message=(
+                f"{account_name} is not a valid storage account name. Storage account name must be "
+                "between 3 and 24 characters in length and use numbers and lower-case letters only."
+            ),
+        )
     statement = select(StorageAccount).where(
         StorageAccount.name == account_name,
         StorageAccount.resource_group == resourceGroupName,
+        StorageAccount.subscription_id == subscriptionId,
     )
+    desired_hash = content_hash(account_body)
     db_account = session.exec(statement).first()
+    if db_account is None or db_account.content_hash != desired_hash:
+        # Unchanged PUTs are answered from this deferred transaction; a
+        # write needs the write lock, and the row as read under it.
+        session.rollback()
+        begin_write(session)
+        db_account = session.exec(statement).first()
+    if db_account is None:
+        # Account names are global: the blob and queue data planes address
+        # accounts by name alone.
+        taken = session.exec(select(StorageAccount.id).where(StorageAccount.name == account_name)).first()
+        if taken is not None:
+            raise AzureError(
+                status_code=status.HTTP_409_CONFLICT,
+                code="StorageAccountAlreadyTaken",
+                message=f"The storage account named {account_name} is already taken.",
+            )
+    if db_account and db_account.content_hash == desired_hash:
+        # Unchanged since the last PUT; nothing to write.
+        return db_account
 
     if db_account:
         # Update existing account
@@ -53,12 +101,16 @@ def create_or_update_storage_account(
         db_account = StorageAccount(
             name=account_name,
             resource_group=resourceGroupName,
+            subscription_id=subscriptionId,
             location=account_body.location,
             sku=account_body.sku.name,
             kind=account_body.kind,
         )
 
+    db_account.content_hash = desired_hash
     session.add(db_account)
+    record_change(session, "Update" if db_account.id else "Create", db_account)
+    record_references(session, db_account, find_references(account_body.model_dump()))
     session.commit()
     session.refresh(db_account)
     return db_account
@@ -67,6 +119,7 @@ def create_or_update_storage_account(
 def get_storage_account(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     account_name: str,
 ):
@@ -76,6 +129,7 @@ def get_storage_account(
     statement = select(StorageAccount).where(
         StorageAccount.name == account_name,
         StorageAccount.resource_group == resourceGroupName,
+        StorageAccount.subscription_id == subscriptionId,
     )
     account = session.exec(statement).first()
     if not account:
@@ -86,34 +140,61 @@ def get_storage_account(
 def list_storage_accounts_in_rg(
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
 ):
     """
     List all storage accounts within a specific resource group.
     """
-    statement = select(StorageAccount).where(StorageAccount.resource_group == resourceGroupName)
+    statement = select(StorageAccount).where(
+        StorageAccount.resource_group == resourceGroupName,
+        StorageAccount.subscription_id == subscriptionId,
+    )
     accounts = session.exec(statement).all()
     return accounts
 
 @router.delete("/storageAccounts/{account_name}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_storage_account(
+    request: Request,
     *,
     session: Session = Depends(get_session),
+    subscriptionId: str,
     resourceGroupName: str,
     account_name: str,
 ):
     """
-    Delete a specific storage account.
+    Delete a specific storage account, with its blob containers, blobs and
+    queues.
     """
+    begin_write(session)
     statement = select(StorageAccount).where(
         StorageAccount.name == account_name,
         StorageAccount.resource_group == resourceGroupName,
+        StorageAccount.subscription_id == subscriptionId,
     )
     account_to_delete = session.exec(statement).first()
 
     if not account_to_delete:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Storage account not found")
 
+    try:
+        blob_dir = account_dir(account_name)
+    except ValueError:
+        # Accounts stored before names were validated; the blob data plane
+        # never accepted their names, so they have no blobs.
+        blob_dir = None
+    session.execute(delete(Blob).where(Blob.account_name == account_name))
+    session.execute(delete(BlobContainer).where(BlobContainer.account_name == account_name))
     session.delete(account_to_delete)
+    record_change(session, "Delete", account_to_delete)
+    record_references(session, account_to_delete, [])
     session.commit()
+    if blob_dir is not None:
+        # Account names are global, so the directory is this account's alone.
+        shutil.rmtree(blob_dir, ignore_errors=True)
+    queue_store = getattr(request.app.state, "queue_store", None)
+    if queue_store is not None:
+        future = queue_store.delete_account(account_name)
+        if future is not None:
+            future.result()
     return None
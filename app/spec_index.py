@@ -0,0 +1,369 @@
+"""
+Live index of the API specifications, with incremental reloading.
+
+The index keeps the parse results of every spec file, together with the
+file's modification time and size. A refresh re-parses only the files that
+were added, changed or removed, then builds a new immutable `SpecSnapshot`
+(route table, mock responses and request validators) and swaps it in with a
+single assignment. Requests read `index.snapshot` once, so they always see
+either the old or the new set of endpoints, never a mix.
+
+`SpecWatcher` refreshes the index in the background when files change,
+using `watchfiles` (inotify and friends) if installed and polling
+otherwise, so updating the azure-rest-api-specs checkout needs no restart.
+"""
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from app.openapi_parser import OpenAPIParser, SchemaInterner
+from app.validation import RequestValidator, SchemaCompiler, compile_request_validators, definitions_key
+
+try:
+    import watchfiles
+except ImportError:  # Fall back to polling.
+    watchfiles = None
+
+class SpecEndpoint(NamedTuple):
+    """
+    A GET operation from a spec file, with its precomputed mock response.
+
+    Attributes:
+        path: The ARM path template, e.g. '/subscriptions/{subscriptionId}/...'.
+        operation_id: The operationId of the GET operation.
+        api_version: The API version of the spec file it was parsed from.
+        file_path: The spec file it was parsed from.
+        mock: The mock response generated from the response schema.
+        body: `mock` serialized as JSON.
+        multi_segment_params: Path parameters marked `x-ms-skip-url-encoding`,
+            which may span several path segments (e.g. '{resourceUri}').
+    """
+    path: str
+    operation_id: str
+    api_version: str
+    file_path: str
+    mock: Any
+    body: bytes
+    multi_segment_params: frozenset
+
+    def render(self, request_path: str) -> bytes:
+        """
+        Returns the mock response for a request, with the resource's `id` and
+        `name` filled in from the request path where the response has them.
+        """
+        if isinstance(self.mock, dict) and ("id" in self.mock or "name" in self.mock):
+            mock = dict(self.mock)
+            if "id" in mock:
+                mock["id"] = request_path
+            if "name" in mock:
+                mock["name"] = request_path.rstrip("/").rsplit("/", 1)[-1]
+            return json.dumps(mock).encode()
+        return self.body
+
+class SpecRoute:
+    """
+    A path template with the endpoints the spec versions declare for it.
+    """
+    __slots__ = ("versions", "latest")
+
+    def __init__(self):
+        self.versions: Dict[str, SpecEndpoint] = {}
+        self.latest: Optional[SpecEndpoint] = None
+
+    def add(self, endpoint: SpecEndpoint) -> None:
+        self.versions.setdefault(endpoint.api_version, endpoint)
+        if self.latest is None or endpoint.api_version > self.latest.api_version:
+            self.latest = endpoint
+
+    def select(self, api_version: Optional[str]) -> Optional[SpecEndpoint]:
+        """
+        Returns the endpoint of the requested API version, or of the latest
+        version if none was requested. Returns None for unknown versions.
+        """
+        if not api_version:
+            return self.latest
+        return self.versions.get(api_version)
+
+class _Node:
+    __slots__ = ("literals", "param", "multi_segment", "route")
+
+    def __init__(self):
+        self.literals: Dict[str, "_Node"] = {}
+        self.param: Optional["_Node"] = None
+        self.multi_segment: Optional["_Node"] = None
+        self.route: Optional[SpecRoute] = None
+
+class RouteTable:
+    """
+    Matches request paths against the path templates of the spec endpoints.
+
+    Templates are stored in a tree keyed by path segment, so a lookup costs
+    one dictionary access per segment regardless of how many endpoints are
+    indexed. Literal segments match case-insensitively, like ARM does. All
+    API versions of a path share one `SpecRoute`, which picks the version.
+    """
+
+    def __init__(self, endpoints: Iterable[SpecEndpoint]):
+        self._root = _Node()
+        for endpoint in endpoints:
+            node = self._root
+            for segment in _segments(endpoint.path.split("?", 1)[0]):
+                if "{" not in segment:
+                    node = node.literals.setdefault(segment.lower(), _Node())
+                elif segment.strip("{}") in endpoint.multi_segment_params:
+                    node.multi_segment = node = node.multi_segment or _Node()
+                else:
+                    node.param = node = node.param or _Node()
+            if node.route is None:
+                node.route = SpecRoute()
+            node.route.add(endpoint)
+
+    def match(self, path: str) -> Optional[SpecRoute]:
+        """
+        Returns the route serving a request path, or None.
+        """
+        return _match(self._root, _segments(path), 0)
+
+def _segments(path: str) -> List[str]:
+    return [segment for segment in path.split("/") if segment]
+
+def _match(node: _Node, segments: List[str], index: int) -> Optional[SpecRoute]:
+    if index == len(segments):
+        return node.route
+    # Literal segments take precedence over parameters.
+    child = node.literals.get(segments[index].lower())
+    if child is not None:
+        route = _match(child, segments, index + 1)
+        if route is not None:
+            return route
+    if node.param is not None:
+        route = _match(node.param, segments, index + 1)
+        if route is not None:
+            return route
+    if node.multi_segment is not None:
+        for end in range(len(segments), index, -1):
+            route = _match(node.multi_segment, segments, end)
+            if route is not None:
+                return route
+    return None
+
+class _SpecFile(NamedTuple):
+    mtime_ns: int
+    size: int
+    api_version: str
+    endpoints: List[SpecEndpoint]
+    validators: Dict[str, RequestValidator]
+    # The definitions_key of the compiler of the validators, if any.
+    definitions_key: Optional[str] = None
+
+class SpecSnapshot(NamedTuple):
+    """
+    Everything derived from one state of the spec files.
+
+    Attributes:
+        routes: The route table of the GET endpoints.
+        request_validators: The validator of the latest API version of each
+            PUT operation, by operationId.
+        request_validators_by_version: Every validator, by operationId and
+            API version.
+        file_count: The number of indexed spec files.
+        endpoints: Every GET endpoint, of all API versions.
+    """
+    routes: RouteTable
+    request_validators: Dict[str, RequestValidator]
+    request_validators_by_version: Dict[Tuple[str, str], RequestValidator]
+    file_count: int
+    endpoints: Tuple[SpecEndpoint, ...]
+
+    @classmethod
+    def build(cls, files: Dict[str, _SpecFile]) -> "SpecSnapshot":
+        validators: Dict[str, RequestValidator] = {}
+        validators_by_version: Dict[Tuple[str, str], RequestValidator] = {}
+        endpoints: List[SpecEndpoint] = []
+        # Later API versions replace the validators of earlier ones.
+        for spec_file in sorted(files.values(), key=lambda spec_file: spec_file.api_version):
+            validators.update(spec_file.validators)
+            for operation_id, validator in spec_file.validators.items():
+                validators_by_version[(operation_id, spec_file.api_version)] = validator
+            endpoints.extend(spec_file.endpoints)
+        return cls(RouteTable(endpoints), validators, validators_by_version, len(files), tuple(endpoints))
+
+def _multi_segment_params(spec: Dict[str, Any], path: str) -> frozenset:
+    path_item = spec["paths"][path]
+    parameters = path_item.get("parameters", []) + path_item.get("get", {}).get("parameters", [])
+    names = set()
+    for parameter in parameters:
+        ref_path = parameter.get("$ref", "")
+        if ref_path.startswith("#/parameters/"):
+            parameter = spec.get("parameters", {}).get(ref_path.split("/")[-1], {})
+        if parameter.get("in") == "path" and parameter.get("x-ms-skip-url-encoding"):
+            names.add(parameter.get("name"))
+    return frozenset(names)
+
+class SpecIndex:
+    """
+    The parsed API specifications of a set of services.
+
+    Args:
+        service_names: The services to index (e.g. 'compute', 'networking').
+        compile_validators: Whether to compile request body validators for
+            the PUT operations as well.
+    """
+
+    def __init__(self, service_names: Iterable[str], compile_validators: bool = True):
+        self.parsers = [OpenAPIParser(service_name) for service_name in service_names]
+        self.compile_validators = compile_validators
+        self.snapshot = SpecSnapshot.build({})
+        # Shared by all indexed files, so the many API versions of a service
+        # share their identical schemas, mocks and compiled checks. After each
+        # reload, whatever only removed or replaced files used is dropped.
+        self._interner = SchemaInterner()
+        self._compilers: Dict[str, SchemaCompiler] = {}
+        self._files: Dict[str, _SpecFile] = {}
+        self._listeners: List[Callable[[SpecSnapshot], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[SpecSnapshot], None]) -> None:
+        """
+        Registers a callback run with the new snapshot after every reload.
+        """
+        self._listeners.append(listener)
+
+    def refresh(self, paths: Optional[Iterable[str]] = None) -> int:
+        """
+        Re-parses spec files that were added, changed or removed and swaps in
+        a new snapshot if any were.
+
+        Args:
+            paths: The files to check, e.g. as reported by a file watcher.
+                By default the spec directories are scanned for changes.
+
+        Returns:
+            The number of files that were reloaded or removed.
+        """
+        with self._lock:
+            if paths is None:
+                candidates = {
+                    file_path: parser for parser in self.parsers for file_path in parser.find_openapi_files()
+                }
+                # Files no longer found are checked too, so they get removed.
+                candidates.update({file_path: None for file_path in self._files if file_path not in candidates})
+            else:
+                candidates = {}
+                for file_path in paths:
+                    file_path = os.path.abspath(file_path)
+                    candidates[file_path] = next(
+                        (parser for parser in self.parsers if parser.owns_file(file_path)), None
+                    )
+
+            files = dict(self._files)
+            changed = 0
+            for file_path, parser in candidates.items():
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    stat = None
+                if stat is None or parser is None:
+                    if files.pop(file_path, None) is not None:
+                        changed += 1
+                    continue
+                current = files.get(file_path)
+                if current is not None and current.mtime_ns == stat.st_mtime_ns and current.size == stat.st_size:
+                    continue
+                files[file_path] = self._parse_file(parser, file_path, stat)
+                changed += 1
+
+            if changed:
+                self._files = files
+                self._sweep()
+                self.snapshot = snapshot = SpecSnapshot.build(files)
+                for listener in self._listeners:
+                    listener(snapshot)
+            return changed
+
+    def _sweep(self) -> None:
+        """
+        Drops the interned values and compilers no indexed file uses.
+        """
+        keys = {spec_file.definitions_key for spec_file in self._files.values()}
+        self._compilers = {key: compiler for key, compiler in self._compilers.items() if key in keys}
+        roots: List[Any] = []
+        for spec_file in self._files.values():
+            for endpoint in spec_file.endpoints:
+                roots.extend((endpoint.mock, endpoint.body))
+        for compiler in self._compilers.values():
+            roots.extend((compiler.definitions, compiler.component_schemas))
+        self._interner.retain(roots)
+
+    def _parse_file(self, parser: OpenAPIParser, file_path: str, stat: os.stat_result) -> _SpecFile:
+        spec = parser.load_spec(file_path, self._interner)
+        if spec is None:
+            return _SpecFile(stat.st_mtime_ns, stat.st_size, "", [], {})
+
+        api_version = str(spec.get("info", {}).get("version", ""))
+        endpoints = []
+        for endpoint in parser.get_endpoints(spec):
+            mock = self._interner.intern(parser.generate_mock_data(endpoint["response_schema"], spec))
+            endpoints.append(SpecEndpoint(
+                path=endpoint["path"],
+                operation_id=endpoint["operationId"],
+                api_version=api_version,
+                file_path=file_path,
+                mock=mock,
+                body=self._interner.intern(json.dumps(mock).encode()),
+                multi_segment_params=_multi_segment_params(spec, endpoint["path"]),
+            ))
+        validators, key = {}, None
+        if self.compile_validators:
+            key = definitions_key(spec)
+            validators = compile_request_validators(parser.get_request_schemas(spec), self._compilers, key)
+        return _SpecFile(stat.st_mtime_ns, stat.st_size, api_version, endpoints, validators, key)
+
+class SpecWatcher:
+    """
+    Background thread that refreshes a `SpecIndex` when spec files change.
+
+    Args:
+        index: The index to refresh.
+        interval: Seconds between scans when polling.
+        use_watchfiles: Use file system notifications when `watchfiles` is
+            installed and the spec directories exist.
+    """
+
+    def __init__(self, index: SpecIndex, interval: float = 2.0, use_watchfiles: bool = True):
+        self.index = index
+        self.interval = interval
+        self.use_watchfiles = use_watchfiles
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="spec-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        roots = [parser.resource_manager_path for parser in self.index.parsers]
+        if self.use_watchfiles and watchfiles is not None and roots and all(map(os.path.isdir, roots)):
+            for changes in watchfiles.watch(*roots, stop_event=self._stop):
+                paths = {file_path for _, file_path in changes}
+                # Added or removed directories are reported without their
+                # files, so those need a full scan.
+                self._reload(paths if all(path.endswith(".json") for path in paths) else None)
+        else:
+            while not self._stop.wait(self.interval):
+                self._reload(None)
+
+    def _reload(self, paths: Optional[Set[str]]) -> None:
+        try:
+            changed = self.index.refresh(paths)
+        except Exception as exc:  # Keep watching; the previous snapshot stays live.
+            print(f"Reloading API specifications failed: {exc!r}")
+            return
+        if changed:
+            print(f"Reloaded {changed} API specification files.")
@@ -0,0 +1,311 @@
+"""
+Emulation of Azure Resource Manager request throttling.
+
+ARM limits the requests of each subscription with token buckets, one for
+reads and one for writes: every request takes a token, and tokens are
+added back at a fixed rate up to the bucket's size. Responses report the
+tokens left in `x-ms-ratelimit-remaining-subscription-reads` (or
+`-writes`); once a bucket is empty, requests fail with 429 and a
+`Retry-After` of the seconds until the next token. Requests outside any
+subscription are limited per tenant instead.
+
+The `throttle` dependency applies this to the ARM routers, after
+`verify_token`. It is disabled unless `THROTTLING_ENABLED` is set.
+
+A bucket is two numbers, the tokens left and the time they were counted,
+and taking a token updates both in constant time. With one worker the
+buckets are kept in a dictionary; with several they live in a memory-mapped
+file shared by all workers, where each bucket is locked on its own with a
+byte-range lock, and which is reset when the emulator starts. Either way, only requests of the same subscription ever
+wait for each other.
+"""
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from fastapi import Request, status
+
+from app.config import Settings, get_settings
+from app.errors import AzureError
+
+try:
+    import fcntl
+except ImportError:  # Windows; buckets cannot be shared between workers.
+    fcntl = None
+
+_SUBSCRIPTION_PATH = re.compile(r"^/subscriptions/([^/]+)", re.IGNORECASE)
+_READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+_TENANT = "tenant"
+
+# Request state attribute holding the headers added to the response.
+_HEADERS_STATE = "rate_limit_headers"
+
+class BucketLimits(NamedTuple):
+    """
+    The size of a token bucket and the tokens added to it per second.
+    """
+    size: float
+    refill_rate: float
+
+def _take_token(tokens: float, updated: float, now: float, limits: BucketLimits) -> Tuple[bool, float, float]:
+    """
+    Refills a bucket up to `now` and takes a token if there is one.
+
+    Returns whether a token was taken, the tokens left, and the seconds
+    until the next token when none was.
+    """
+    tokens = min(limits.size, tokens + max(0.0, now - updated) * limits.refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / limits.refill_rate
+
+class MemoryBuckets:
+    """
+    Token buckets of a single worker process.
+    """
+
+    def __init__(self, reads: BucketLimits, writes: BucketLimits, stripes: int = 64):
+        self.limits = (reads, writes)
+        # key -> [read tokens, read time, write tokens, write time]
+        self._buckets: Dict[str, List[float]] = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def close(self) -> None:
+        pass
+
+    def take(self, key: str, write: bool) -> Tuple[bool, float, float]:
+        limits = self.limits[write]
+        now = time.time()
+        with self._locks[hash(key) % len(self._locks)]:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.limits[0].size, now, self.limits[1].size, now]
+            index = 2 if write else 0
+            taken, tokens, retry_after = _take_token(bucket[index], bucket[index + 1], now, limits)
+            bucket[index], bucket[index + 1] = tokens, now
+        return taken, tokens, retry_after
+
+class SharedBuckets:
+    """
+    Token buckets in a file mapped into every worker process.
+
+    The file starts with a header naming the run of the emulator it belongs
+    to, followed by a hash table of fixed-size slots with linear probing. A
+    slot holds a 64-bit hash of its key and the two buckets. While a slot is
+    read or changed, it is locked against the other threads of this process
+    and, with a byte-range lock on its bytes, against the other processes.
+
+    The first worker of a run resets the file, under a lock on the header,
+    so buckets do not outlive a restart. Slots are claimed on first use and
+    not freed, which would break the probe sequences running through them.
+    Instead, a new key takes over the first idle slot in its sequence: one
+    whose buckets have refilled completely, and so hold no state. When every
+    slot is in use, new keys are throttled until one becomes idle.
+
+    Args:
+        path: The shared file, created if missing.
+        slots: Keys the file can hold at once.
+        run_id: Identifies the run of the emulator whose workers share the
+            file. Defaults to the parent process, which started the workers.
+    """
+    _HEADER = struct.Struct("<8sQQ")
+    _MAGIC = b"cmkthrt1"
+    _SLOT = struct.Struct("<Qdddd")
+    SLOT_SIZE = 64  # One cache line; the header takes the first one too.
+
+    def __init__(
+        self,
+        path: str,
+        reads: BucketLimits,
+        writes: BucketLimits,
+        slots: int = 4096,
+        stripes: int = 64,
+        run_id: Optional[int] = None,
+    ):
+        self.limits = (reads, writes)
+        self.slots = slots
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = (slots + 1) * self.SLOT_SIZE
+        header = self._HEADER.pack(self._MAGIC, os.getppid() if run_id is None else run_id, slots)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT_SIZE, 0)
+        try:
+            if os.pread(self._fd, self._HEADER.size, 0) != header:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)  # Zeroed: every slot free
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT_SIZE, 0)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Never 0, which marks a free slot.
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") | 1
+
+    @contextmanager
+    def _locked(self, slot: int) -> Iterator[int]:
+        """
+        Locks a slot and yields its offset in the file.
+        """
+        offset = (slot + 1) * self.SLOT_SIZE
+        with self._locks[slot % len(self._locks)]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT_SIZE, offset)
+            try:
+                yield offset
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT_SIZE, offset)
+
+    def _idle_in(self, read_tokens: float, read_time: float, write_tokens: float, write_time: float, now: float) -> float:
+        """
+        Returns the seconds until both buckets of a slot are full again.
+        """
+        reads, writes = self.limits
+        return max(
+            (reads.size - read_tokens) / reads.refill_rate - (now - read_time),
+            (writes.size - write_tokens) / writes.refill_rate - (now - write_time),
+        )
+
+    def _take_from(self, offset: int, key_hash: int, write: bool, now: float, claim: bool) -> Tuple[bool, float, float]:
+        """
+        Takes a token from the slot at `offset`, after filling its buckets
+        for `key_hash` if `claim` is set.
+        """
+        if claim:
+            read_tokens, read_time = self.limits[0].size, now
+            write_tokens, write_time = self.limits[1].size, now
+        else:
+            _, read_tokens, read_time, write_tokens, write_time = self._SLOT.unpack_from(self._map, offset)
+        if write:
+            taken, write_tokens, retry_after = _take_token(write_tokens, write_time, now, self.limits[1])
+            write_time, tokens = now, write_tokens
+        else:
+            taken, read_tokens, retry_after = _take_token(read_tokens, read_time, now, self.limits[0])
+            read_time, tokens = now, read_tokens
+        self._SLOT.pack_into(self._map, offset, key_hash, read_tokens, read_time, write_tokens, write_time)
+        return taken, tokens, retry_after
+
+    def take(self, key: str, write: bool) -> Tuple[bool, float, float]:
+        key_hash = self._hash(key)
+        while True:
+            now = time.time()
+            idle_slot = None
+            idle_in = math.inf
+            for probe in range(self.slots):
+                slot = (key_hash + probe) % self.slots
+                with self._locked(slot) as offset:
+                    slot_hash, *buckets = self._SLOT.unpack_from(self._map, offset)
+                    if slot_hash == key_hash:
+                        return self._take_from(offset, key_hash, write, now, claim=False)
+                    if slot_hash == 0:
+                        if idle_slot is None:
+                            return self._take_from(offset, key_hash, write, now, claim=True)
+                        break
+                    if idle_slot is None:
+                        slot_idle_in = self._idle_in(*buckets, now)
+                        if slot_idle_in <= 0:
+                            idle_slot = slot
+                        idle_in = min(idle_in, slot_idle_in)
+            if idle_slot is None:
+                # Every slot is in use: throttled until one becomes idle.
+                return False, 0.0, idle_in
+            # The key is not in the table; take over the idle slot, unless
+            # another worker did so in the meantime.
+            with self._locked(idle_slot) as offset:
+                slot_hash, *buckets = self._SLOT.unpack_from(self._map, offset)
+                if slot_hash == key_hash:
+                    return self._take_from(offset, key_hash, write, now, claim=False)
+                if self._idle_in(*buckets, now) <= 0:
+                    return self._take_from(offset, key_hash, write, now, claim=True)
+
+def create_buckets(settings: Settings):
+    """
+    Creates the token buckets configured in the settings, shared between
+    the workers if there are several.
+    """
+    reads = BucketLimits(settings.THROTTLE_READS_BUCKET_SIZE, settings.THROTTLE_READS_PER_SECOND)
+    writes = BucketLimits(settings.THROTTLE_WRITES_BUCKET_SIZE, settings.THROTTLE_WRITES_PER_SECOND)
+    if settings.WEB_CONCURRENCY > 1 and fcntl is not None:
+        return SharedBuckets(settings.THROTTLE_STATE_PATH, reads, writes)
+    return MemoryBuckets(reads, writes)
+
+def get_buckets(request: Request):
+    """
+    Returns the application's token buckets, creating them on first use
+    when the lifespan did not.
+    """
+    buckets = getattr(request.app.state, "throttle_buckets", None)
+    if buckets is None:
+        buckets = request.app.state.throttle_buckets = create_buckets(get_settings())
+    return buckets
+
+async def throttle(request: Request) -> None:
+    """
+    FastAPI dependency taking a token from the bucket of the request's
+    subscription (or tenant) for reads or writes. Runs on the event loop:
+    the bucket locks are only held for a few arithmetic operations.
+
+    Raises:
+        AzureError(429): If the bucket is empty.
+    """
+    if not get_settings().THROTTLING_ENABLED:
+        return
+    match = _SUBSCRIPTION_PATH.match(request.url.path)
+    scope = "subscription" if match else _TENANT
+    key = match.group(1).lower() if match else _TENANT
+    write = request.method not in _READ_METHODS
+    kind = "writes" if write else "reads"
+    header = f"x-ms-ratelimit-remaining-{scope}-{kind}"
+
+    taken, tokens, retry_after = get_buckets(request).take(key, write)
+    if not taken:
+        seconds = max(1, math.ceil(retry_after))
+        target = f"subscription '{match.group(1)}'" if match else "tenant"
+        raise AzureError(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            code="SubscriptionRequestsThrottled" if match else "TenantRequestsThrottled",
+            message=(
+                f"Number of '{kind[:-1]}' requests for {target} exceeded. "
+                f"Please try again after '{seconds}' seconds after additional tokens are available."
+            ),
+            headers={"Retry-After": str(seconds), header: "0"},
+        )
+    setattr(request.state, _HEADERS_STATE, [(header.encode(), str(int(tokens)).encode())])
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds the rate limit headers set by `throttle` to the response. Unlike
+    headers set on a dependency's `Response`, these also reach responses
+    that routes build themselves, such as streams and mock responses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers: Optional[list] = scope.get("state", {}).get(_HEADERS_STATE)
+                if headers:
+                    message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,336 @@
+"""
+Request body validation against OpenAPI schemas.
+
+Interpreting a JSON schema on every request is slow, so each operation's
+request schema is compiled once into a tree of small closures. References are
+resolved and keyword lookups are done at compile time, leaving only the type
+and constraint checks for the request path.
+"""
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import Request, status
+
+from app.errors import AzureError
+
+# A compiled check takes the value, its location in the document, and a list
+# that any validation errors are appended to.
+Check = Callable[[Any, str, List[Dict[str, str]]], None]
+
+def _noop(value: Any, path: str, errors: List[Dict[str, str]]) -> None:
+    return None
+
+def _type_check(schema_type: str) -> Optional[Callable[[Any], bool]]:
+    """
+    Returns a predicate for a JSON schema primitive type.
+    """
+    if schema_type == 'object':
+        return lambda value: isinstance(value, dict)
+    if schema_type == 'array':
+        return lambda value: isinstance(value, list)
+    if schema_type == 'string':
+        return lambda value: isinstance(value, str)
+    if schema_type == 'boolean':
+        return lambda value: isinstance(value, bool)
+    if schema_type == 'integer':
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+    if schema_type == 'number':
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    return None
+
+def _child_path(path: str, name: str) -> str:
+    return f"{path}.{name}" if path else name
+
+class SchemaCompiler:
+    """
+    Compiles the JSON schemas of a single OpenAPI specification into checks.
+
+    Compiled `$ref` targets are cached, so definitions shared by several
+    operations of the same specification are only compiled once.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        # Only the schemas references resolve against are kept, not the spec.
+        self.definitions = spec.get('definitions', {})
+        self.component_schemas = spec.get('components', {}).get('schemas', {})
+        self._refs: Dict[str, List[Optional[Check]]] = {}
+
+    def compile(self, schema: Dict[str, Any]) -> Check:
+        """
+        Compiles a JSON schema into a single check function.
+        """
+        if '$ref' in schema:
+            return self._compile_ref(schema['$ref'])
+
+        checks: List[Check] = []
+        schema_type = schema.get('type')
+        is_type = _type_check(schema_type) if schema_type else None
+        if is_type is not None:
+            def check_type(value, path, errors, is_type=is_type, schema_type=schema_type):
+                if not is_type(value):
+                    errors.append({"target": path, "message": f"Expected type '{schema_type}'."})
+            checks.append(check_type)
+
+        for sub_schema in schema.get('allOf', []):
+            checks.append(self.compile(sub_schema))
+
+        if schema_type == 'object' or 'properties' in schema or 'required' in schema:
+            checks.append(self._compile_object(schema))
+        elif schema_type == 'array':
+            checks.append(self._compile_array(schema))
+        elif schema_type == 'string':
+            checks.extend(self._compile_string(schema))
+        elif schema_type in ('integer', 'number'):
+            checks.extend(self._compile_number(schema))
+
+        # Extensible enums (modelAsString) accept values outside the list.
+        if 'enum' in schema and not schema.get('x-ms-enum', {}).get('modelAsString', False):
+            allowed = list(schema['enum'])
+            def check_enum(value, path, errors):
+                if value not in allowed:
+                    errors.append({"target": path, "message": f"Value must be one of {allowed}."})
+            checks.append(check_enum)
+
+        return self._combine(checks, is_type)
+
+    def _compile_ref(self, ref_path: str) -> Check:
+        cell = self._refs.get(ref_path)
+        if cell is None:
+            cell = self._refs[ref_path] = [None]
+            cell[0] = self.compile(self._resolve(ref_path))
+            return cell[0]
+        if cell[0] is not None:
+            return cell[0]
+
+        # The reference is still being compiled, so it is recursive. Defer the
+        # lookup until the check actually runs.
+        def check_recursive_ref(value, path, errors):
+            cell[0](value, path, errors)
+        return check_recursive_ref
+
+    def _resolve(self, ref_path: str) -> Dict[str, Any]:
+        if ref_path.startswith('#/components/schemas/'):  # OpenAPI 3
+            return self.component_schemas.get(ref_path.split('/')[-1], {})
+        if ref_path.startswith('#/definitions/'):  # OpenAPI 2
+            return self.definitions.get(ref_path.split('/')[-1], {})
+        # External references are not followed; accept anything.
+        return {}
+
+    def _compile_object(self, schema: Dict[str, Any]) -> Check:
+        required = list(schema.get('required', []))
+        properties = {
+            name: self.compile(prop_schema)
+            for name, prop_schema in schema.get('properties', {}).items()
+            if not prop_schema.get('readOnly')
+        }
+        additional = schema.get('additionalProperties')
+        additional_check = self.compile(additional) if isinstance(additional, dict) else None
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append({"target": _child_path(path, name), "message": "Required property is missing."})
+            for name, item in value.items():
+                prop_check = properties.get(name)
+                if prop_check is not None:
+                    prop_check(item, _child_path(path, name), errors)
+                elif additional_check is not None:
+                    additional_check(item, _child_path(path, name), errors)
+        return check_object
+
+    def _compile_array(self, schema: Dict[str, Any]) -> Check:
+        items_check = self.compile(schema.get('items', {}))
+        min_items = schema.get('minItems')
+        max_items = schema.get('maxItems')
+
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return
+            if min_items is not None and len(value) < min_items:
+                errors.append({"target": path, "message": f"Array must have at least {min_items} items."})
+            if max_items is not None and len(value) > max_items:
+                errors.append({"target": path, "message": f"Array must have at most {max_items} items."})
+            for index, item in enumerate(value):
+                items_check(item, f"{path}[{index}]", errors)
+        return check_array
+
+    @staticmethod
+    def _compile_string(schema: Dict[str, Any]) -> List[Check]:
+        checks: List[Check] = []
+        min_length = schema.get('minLength')
+        max_length = schema.get('maxLength')
+        if min_length is not None or max_length is not None:
+            def check_length(value, path, errors):
+                if not isinstance(value, str):
+                    return
+                if min_length is not None and len(value) < min_length:
+                    errors.append({"target": path, "message": f"String must be at least {min_length} characters."})
+                if max_length is not None and len(value) > max_length:
+                    errors.append({"target": path, "message": f"String must be at most {max_length} characters."})
+            checks.append(check_length)
+
+        if 'pattern' in schema:
+            try:
+                pattern = re.compile(schema['pattern'])
+            except re.error:
+                # Some specs use regex dialects Python cannot compile.
+                return checks
+            def check_pattern(value, path, errors):
+                if isinstance(value, str) and not pattern.search(value):
+                    errors.append({"target": path, "message": f"String does not match pattern '{pattern.pattern}'."})
+            checks.append(check_pattern)
+        return checks
+
+    @staticmethod
+    def _compile_number(schema: Dict[str, Any]) -> List[Check]:
+        minimum = schema.get('minimum')
+        maximum = schema.get('maximum')
+        if minimum is None and maximum is None:
+            return []
+
+        def check_range(value, path, errors):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return
+            if minimum is not None and value < minimum:
+                errors.append({"target": path, "message": f"Value must be at least {minimum}."})
+            if maximum is not None and value > maximum:
+                errors.append({"target": path, "message": f"Value must be at most {maximum}."})
+        return [check_range]
+
+    @staticmethod
+    def _combine(checks: List[Check], is_type: Optional[Callable[[Any], bool]]) -> Check:
+        """
+        Folds a list of checks into one, avoiding a loop for the common
+        zero- and single-check cases.
+        """
+        if not checks:
+            return _noop
+        if len(checks) == 1:
+            return checks[0]
+        if is_type is not None:
+            # Skip the structural checks once the type check has failed.
+            type_check, rest = checks[0], checks[1:]
+            def check_typed(value, path, errors):
+                if not is_type(value):
+                    type_check(value, path, errors)
+                    return
+                for check in rest:
+                    check(value, path, errors)
+            return check_typed
+
+        def check_all(value, path, errors):
+            for check in checks:
+                check(value, path, errors)
+        return check_all
+
+class RequestValidator:
+    """
+    A compiled validator for the request body of a single operation.
+    """
+
+    def __init__(self, operation_id: str, check: Check):
+        self.operation_id = operation_id
+        self._check = check
+
+    def __call__(self, body: Any) -> List[Dict[str, str]]:
+        """
+        Validates a request body and returns the list of errors found.
+        """
+        errors: List[Dict[str, str]] = []
+        self._check(body, "", errors)
+        return errors
+
+def definitions_key(spec: Dict[str, Any]) -> str:
+    """
+    Identifies the schemas the `$ref`s of a specification resolve against by
+    their content, so specifications with equal definitions can share one
+    `SchemaCompiler`.
+    """
+    content = json.dumps(
+        [spec.get('definitions'), spec.get('components', {}).get('schemas')],
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def compile_request_validators(
+    operations: Iterable[Dict[str, Any]],
+    compilers: Optional[Dict[str, SchemaCompiler]] = None,
+    key: Optional[str] = None,
+) -> Dict[str, RequestValidator]:
+    """
+    Compiles request validators for operations returned by
+    `OpenAPIParser.parse_request_schemas`, keyed by operationId.
+
+    Args:
+        operations: The operations to compile validators for.
+        compilers: A cache of schema compilers to reuse across calls, by
+            `definitions_key`. Specifications with equal definitions share
+            one compiler and thereby its compiled references.
+        key: The `definitions_key` of the operations, if they all come from
+            one specification whose key is already known.
+    """
+    if compilers is None:
+        compilers = {}
+    validators: Dict[str, RequestValidator] = {}
+    for operation in operations:
+        spec = operation['spec']
+        spec_key = key if key is not None else definitions_key(spec)
+        compiler = compilers.get(spec_key)
+        if compiler is None:
+            compiler = compilers[spec_key] = SchemaCompiler(spec)
+        operation_id = operation['operationId']
+        validators[operation_id] = RequestValidator(operation_id, compiler.compile(operation['request_schema']))
+    return validators
+
+def _parsed_as_json(request: Request) -> bool:
+    """
+    Whether FastAPI parsed the request body as JSON for the route's body
+    parameter, which it does before solving dependencies: for JSON media
+    types only.
+    """
+    media_type = request.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+    return media_type == "application/json" or (media_type.startswith("application/") and media_type.endswith("+json"))
+
+def validate_request_body(operation_id: str):
+    """
+    Returns a FastAPI dependency that validates the JSON request body against
+    the compiled validator for `operation_id`. The validator of the request's
+    `api-version` is used if there is one, otherwise the latest version's.
+
+    The body is the one FastAPI already parsed, which Starlette keeps on the
+    request, so it is not parsed twice. Bodies FastAPI did not parse as JSON
+    are left to the route's body parameter to reject.
+
+    Validation is skipped when no validator was compiled for the operation,
+    for example when the API specifications are not available.
+
+    Raises:
+        AzureError(400): If the body does not match the request schema.
+    """
+    async def dependency(request: Request):
+        validators = getattr(request.app.state, "request_validators", None)
+        if not validators:
+            return
+        validator = None
+        api_version = request.query_params.get("api-version")
+        if api_version:
+            validators_by_version = getattr(request.app.state, "request_validators_by_version", None) or {}
+            validator = validators_by_version.get((operation_id, api_version))
+        if validator is None:
+            validator = validators.get(operation_id)
+        if validator is None or not _parsed_as_json(request) or not await request.body():
+            return
+
+        errors = validator(await request.json())
+        if errors:
+            raise AzureError(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                code="InvalidRequestContent",
+                message=f"The request content for '{operation_id}' is invalid.",
+                details=[{"code": "InvalidRequestContent", **error} for error in errors],
+            )
+    return dependency
@@ -0,0 +1 @@
+# This file intentionally left blank to mark 'benchmarks' as a Python package.
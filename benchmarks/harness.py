@@ -0,0 +1,192 @@
+"""
+Benchmark runner, statistics and baselines.
+
+Workloads are replayed either against an in-process emulator (`create_app()`
+bound to a chosen database, with its lifespan running, called over ASGI) or
+against an emulator listening on a URL. Latencies are grouped by route template, so
+`/virtualMachines/vm-1` and `/virtualMachines/vm-2` are reported together.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.engine import Engine
+from starlette.routing import compile_path
+
+from benchmarks.workloads import BenchRequest, Session
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class RouteMatcher:
+    """
+    Maps a request method and path to the template of the route serving it.
+    """
+
+    def __init__(self, app: FastAPI):
+        # The OpenAPI document lists every route template, including those
+        # of included routers, independently of how the app nests them.
+        self._routes = [
+            ({method.upper() for method in operations}, compile_path(template)[0], template)
+            for template, operations in app.openapi().get('paths', {}).items()
+        ]
+
+    def __call__(self, method: str, path: str) -> str:
+        path = path.split('?', 1)[0]
+        for methods, path_regex, template in self._routes:
+            if method in methods and path_regex.match(path):
+                return f"{method} {template}"
+        return f"{method} <unmatched>"
+
+@asynccontextmanager
+async def in_process_client(app: FastAPI, engine: Engine) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Runs the app bound to `engine`, and yields a client that calls it
+    in-process over ASGI. The transport does not run the app's lifespan,
+    so it is entered here: the app starts up and shuts down as when served.
+    """
+    app.state.engine = engine
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://emulator") as client:
+            yield client
+
+def remote_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Returns a client for an emulator listening on `base_url`. Like
+    `in_process_client`, it is used as an async context manager.
+    """
+    return httpx.AsyncClient(base_url=base_url, timeout=30.0)
+
+class BenchmarkResult:
+    """
+    Latency samples of a benchmark run, grouped by route.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.elapsed = 0.0
+
+    def add(self, samples: List[Tuple[str, float, int]]) -> None:
+        for route, latency, status_code in samples:
+            self.samples.setdefault(route, []).append(latency)
+            if status_code >= 400 and status_code != 404:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns per-route count, req/s and latency percentiles in milliseconds.
+        """
+        summary: Dict[str, Dict[str, float]] = {}
+        all_samples: List[float] = []
+        for route, latencies in sorted(self.samples.items()):
+            all_samples.extend(latencies)
+            summary[route] = self._stats(latencies)
+            summary[route]['errors'] = self.errors.get(route, 0)
+        summary['TOTAL'] = self._stats(all_samples)
+        summary['TOTAL']['errors'] = sum(self.errors.values())
+        return summary
+
+    def _stats(self, latencies: List[float]) -> Dict[str, float]:
+        ordered = sorted(latencies)
+        return {
+            'count': len(ordered),
+            'rps': len(ordered) / self.elapsed if self.elapsed else 0.0,
+            'p50_ms': percentile(ordered, 50) * 1000,
+            'p95_ms': percentile(ordered, 95) * 1000,
+            'p99_ms': percentile(ordered, 99) * 1000,
+        }
+
+async def run_workload(
+    sessions: List[Session],
+    client: httpx.AsyncClient,
+    route_matcher: RouteMatcher,
+    headers: Dict[str, str],
+    concurrency: int = 1,
+) -> BenchmarkResult:
+    """
+    Replays the sessions with up to `concurrency` of them in flight at once.
+    """
+    result = BenchmarkResult()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_session(session: Session) -> None:
+        timed: List[Tuple[BenchRequest, int, float]] = []
+        async with semaphore:
+            for request in session:
+                start = time.perf_counter()
+                response = await client.request(request.method, request.path, json=request.body, headers=headers)
+                timed.append((request, response.status_code, time.perf_counter() - start))
+
+        # Route matching happens after the timed section.
+        result.add([(route_matcher(request.method, request.path), latency, status_code) for request, status_code, latency in timed])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(session) for session in sessions))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def format_summary(summary: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+    """
+    Formats a summary as a table, with p95 changes relative to a baseline.
+    """
+    width = max(len(route) for route in summary)
+    header = f"{'route':<{width}} {'count':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+    if baseline is not None:
+        header += f" {'p95 vs base':>11}"
+    lines = [header]
+    for route, stats in summary.items():
+        line = (
+            f"{route:<{width}} {stats['count']:>7} {stats['rps']:>9.1f} {stats['p50_ms']:>8.2f} "
+            f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['errors']:>6}"
+        )
+        if baseline is not None and route in baseline and baseline[route]['p95_ms']:
+            change = stats['p95_ms'] / baseline[route]['p95_ms'] - 1
+            line += f" {change:>+10.1%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def save_baseline(name: str, summary: Dict[str, Any], directory: str = BASELINE_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return path
+
+def load_baseline(name: str, directory: str = BASELINE_DIR) -> Dict[str, Dict[str, float]]:
+    with open(os.path.join(directory, f"{name}.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def find_regressions(
+    summary: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float = 0.2,
+) -> List[str]:
+    """
+    Returns the routes whose p95 latency grew by more than `threshold`, or
+    whose throughput fell by more than `threshold`, compared to the baseline.
+    """
+    regressions = []
+    for route, stats in summary.items():
+        base = baseline.get(route)
+        if not base:
+            continue
+        if base['p95_ms'] and stats['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{route}: p95 {base['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms")
+        if base['rps'] and stats['rps'] < base['rps'] * (1 - threshold):
+            regressions.append(f"{route}: {base['rps']:.1f} req/s -> {stats['rps']:.1f} req/s")
+    return regressions
@@ -0,0 +1,90 @@
+"""
+Workloads for the emulator benchmark suite.
+
+A workload is a list of sessions, and each session is an ordered list of
+requests that is replayed by a single client. Sessions run concurrently, so
+requests that depend on each other (a PUT followed by a GET of the same
+resource) must be in the same session.
+"""
+import json
+import random
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+class BenchRequest(NamedTuple):
+    method: str
+    path: str
+    body: Optional[Dict[str, Any]] = None
+
+Session = List[BenchRequest]
+
+def load_trace(trace_path: str) -> List[Session]:
+    """
+    Loads a recorded request trace from a JSON Lines file.
+
+    Each line is an object with `method`, `path` and an optional `body`.
+    Lines with the same optional `session` key are replayed in order by one
+    client; lines without one all belong to a single session.
+    """
+    sessions: "OrderedDict[Any, Session]" = OrderedDict()
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            request = BenchRequest(record['method'].upper(), record['path'], record.get('body'))
+            sessions.setdefault(record.get('session'), []).append(request)
+    return list(sessions.values())
+
+def terraform_workload(
+    stacks: int = 10,
+    vms_per_stack: int = 5,
+    plans_per_stack: int = 3,
+    subscription_id: str = "bench-sub",
+    seed: int = 0,
+) -> List[Session]:
+    """
+    Builds a synthetic workload resembling Terraform runs.
+
+    Every stack is one session that applies a resource group's worth of
+    resources, refreshes them several times as `terraform plan` would
+    (GET of every resource plus list calls), re-applies them unchanged, and
+    finally destroys them.
+    """
+    rng = random.Random(seed)
+    sessions: List[Session] = []
+    for stack in range(stacks):
+        resource_group = f"bench-rg-{stack:04d}"
+        base = f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers"
+        location = rng.choice(["eastus", "westus2", "westeurope"])
+
+        resources = [
+            (
+                f"{base}/Microsoft.Network/virtualNetworks/vnet-{stack}",
+                {"location": location, "properties": {"addressSpace": {"addressPrefixes": [f"10.{stack % 256}.0.0/16"]}}},
+            ),
+            (
+                f"{base}/Microsoft.Storage/storageAccounts/benchsa{stack:06d}",
+                {"location": location, "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"},
+            ),
+        ]
+        for index in range(vms_per_stack):
+            resources.append((
+                f"{base}/Microsoft.Compute/virtualMachines/vm-{stack}-{index}",
+                {"location": location, "properties": {"hardwareProfile": {"vmSize": rng.choice(["Standard_B2s", "Standard_D2s_v3"])}}},
+            ))
+        list_paths = [
+            f"{base}/Microsoft.Network/virtualNetworks",
+            f"{base}/Microsoft.Storage/storageAccounts",
+            f"{base}/Microsoft.Compute/virtualMachines",
+        ]
+
+        session: Session = [BenchRequest("PUT", path, body) for path, body in resources]
+        for _ in range(plans_per_stack):
+            session.extend(BenchRequest("GET", path) for path, _ in resources)
+            session.extend(BenchRequest("GET", path) for path in list_paths)
+        session.extend(BenchRequest("PUT", path, body) for path, body in resources)
+        session.extend(BenchRequest("DELETE", path) for path, _ in reversed(resources))
+        sessions.append(session)
+    return sessions
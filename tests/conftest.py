@@ -2,54 +2,30 @@
 Pytest configuration and fixtures for the test suite.
 
 This file sets the APP_ENV to 'test' to ensure the application uses
-a test-specific configuration. It then sets up an isolated, in-memory
-database for the test session.
+a test-specific configuration. The emulator itself is provided by the
+project's pytest plugin (`app.pytest_plugin`), which creates the app and
+an in-memory database once and rolls back each test's changes.
 """
 import os
 os.environ['APP_ENV'] = 'test'
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
-from sqlalchemy.pool import StaticPool
+from typing import Dict
 
-from app.main import create_app
-from app.db import get_session
-from app.config import get_settings
-from app.models import VirtualMachine  # Ensure models are registered
+pytest_plugins = ["app.pytest_plugin"]
 
 @pytest.fixture(name="client")
-def client_fixture():
+def client_fixture(emulator_client: TestClient) -> TestClient:
     """
-    Creates a fully isolated test environment for each test function.
+    A client of the in-process emulator, isolated from other tests.
     """
-    # Use an in-memory SQLite database with a static connection pool.
-    test_engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    SQLModel.metadata.create_all(test_engine)
-
-    def get_session_override():
-        """Override the application's get_session dependency."""
-        with Session(test_engine) as session:
-            yield session
-
-    app = create_app()
-    app.dependency_overrides[get_session] = get_session_override
-
-    client = TestClient(app)
-    yield client
-
-    app.dependency_overrides.clear()
-    SQLModel.metadata.drop_all(test_engine)
+    return emulator_client
 
 @pytest.fixture(name="auth_headers")
-def auth_headers_fixture():
+def auth_headers_fixture(emulator_auth_headers: Dict[str, str]) -> Dict[str, str]:
     """
     Returns valid authorization headers using the test token.
-    This works because get_settings() is now returning the test settings.
+    This works because get_settings() is returning the test settings.
     """
-    settings = get_settings()
-    return {"Authorization": f"Bearer {settings.MOCK_AUTH_TOKEN}"}
+    return emulator_auth_headers
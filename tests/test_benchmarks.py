@@ -0,0 +1,61 @@
+"""
+Tests for the benchmark harness.
+"""
+import asyncio
+import json
+
+from app.config import get_settings
+from app.db import create_db_and_tables, create_db_engine
+from app.main import create_app
+from benchmarks.harness import RouteMatcher, find_regressions, in_process_client, percentile, run_workload
+from benchmarks.workloads import load_trace, terraform_workload
+
+def test_percentile():
+    values = sorted(float(value) for value in range(1, 101))
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+def test_terraform_workload_in_process(tmp_path, monkeypatch):
+    """
+    Tests that the synthetic workload runs cleanly against an in-process
+    emulator, started by its lifespan, and that latencies are grouped by
+    route template.
+    """
+    monkeypatch.setattr(get_settings(), "QUEUE_STORAGE_PATH", str(tmp_path / "queues"))
+    # A file database, since concurrent sessions cannot share the single
+    # connection of an in-memory one.
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'bench.db'}")
+    create_db_and_tables(engine)
+    app = create_app()
+    headers = {"Authorization": f"Bearer {get_settings().MOCK_AUTH_TOKEN}"}
+
+    sessions = terraform_workload(stacks=2, vms_per_stack=2, plans_per_stack=1)
+
+    async def benchmark():
+        async with in_process_client(app, engine) as client:
+            assert app.state.engine is engine
+            assert hasattr(app.state, "queue_store")
+            return await run_workload(sessions, client, RouteMatcher(app), headers, concurrency=2)
+
+    result = asyncio.run(benchmark())
+    summary = result.summary()
+
+    vm_route = "PUT /subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Compute/virtualMachines/{vm_name}"
+    assert summary[vm_route]["count"] == 8
+    assert summary["TOTAL"]["count"] == sum(len(session) for session in sessions)
+    assert summary["TOTAL"]["errors"] == 0
+
+    slower = {route: dict(stats, p95_ms=stats["p95_ms"] * 2) for route, stats in summary.items()}
+    assert find_regressions(summary, summary) == []
+    assert find_regressions(slower, summary)
+
+def test_load_trace_groups_sessions(tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    trace.write_text("\n".join(json.dumps(record) for record in [
+        {"session": "a", "method": "put", "path": "/x", "body": {"location": "eastus"}},
+        {"session": "b", "method": "get", "path": "/y"},
+        {"session": "a", "method": "get", "path": "/x"},
+    ]))
+    sessions = load_trace(str(trace))
+    assert [[request.method for request in session] for session in sessions] == [["PUT", "GET"], ["GET"]]
@@ -0,0 +1,153 @@
+"""
+Tests for the blob storage data plane.
+"""
+import base64
+import os
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+from typing import Dict
+from xml.etree import ElementTree
+
+from app.config import get_settings
+from app.models import Blob, BlobContainer
+
+ACCOUNT_URL = "/blob/teststorage"
+STORAGE_ACCOUNT_URL = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/teststorage"
+ACCOUNT_PAYLOAD = {"location": "eastus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+
+def _error_code(response) -> str:
+    root = ElementTree.fromstring(response.content)
+    assert response.headers["x-ms-error-code"] == root.findtext("Code")
+    return root.findtext("Code")
+
+@pytest.fixture(name="container_url")
+def container_url_fixture(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Creates a storage account and a container.
+    """
+    response = client.put(STORAGE_ACCOUNT_URL, json=ACCOUNT_PAYLOAD, headers=auth_headers)
+    assert response.status_code == 200
+
+    container_url = f"{ACCOUNT_URL}/artifacts"
+    response = client.put(container_url, params={"restype": "container"}, headers=auth_headers)
+    assert response.status_code == 201
+    return container_url
+
+def test_put_and_get_blob_with_ranges(client: TestClient, auth_headers: Dict[str, str], container_url: str):
+    """
+    Tests uploading a blob and reading it whole, by Range and by x-ms-range.
+    """
+    content = bytes(range(256)) * 4096
+    blob_url = f"{container_url}/state/terraform.tfstate"
+    response = client.put(
+        blob_url,
+        content=iter([content[:300000], content[300000:]]),
+        headers={**auth_headers, "x-ms-blob-type": "BlockBlob", "Content-Type": "application/json"},
+    )
+    assert response.status_code == 201
+    etag = response.headers["etag"]
+
+    response = client.get(blob_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == etag
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["x-ms-blob-type"] == "BlockBlob"
+
+    response = client.get(blob_url, headers={**auth_headers, "Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+
+    response = client.get(blob_url, headers={**auth_headers, "Range": "bytes=0-0", "x-ms-range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == content[100:200]
+
+    response = client.head(blob_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(content))
+
+    assert client.delete(blob_url, headers=auth_headers).status_code == 202
+    response = client.get(blob_url, headers=auth_headers)
+    assert response.status_code == 404
+    assert response.headers["x-ms-error-code"] == "BlobNotFound"
+
+def test_put_block_list(client: TestClient, auth_headers: Dict[str, str], container_url: str):
+    """
+    Tests staging blocks and committing them in the listed order.
+    """
+    blob_url = f"{container_url}/large.bin"
+    blocks = {base64.b64encode(f"block-{index:03d}".encode()).decode(): bytes([index]) * 1000 for index in range(3)}
+    for block_id, data in blocks.items():
+        response = client.put(blob_url, params={"comp": "block", "blockid": block_id}, content=data, headers=auth_headers)
+        assert response.status_code == 201
+
+    order = list(reversed(list(blocks)))
+    block_list = "<?xml version='1.0' encoding='utf-8'?><BlockList>" + "".join(f"<Latest>{block_id}</Latest>" for block_id in order) + "</BlockList>"
+    response = client.put(blob_url, params={"comp": "blocklist"}, content=block_list, headers=auth_headers)
+    assert response.status_code == 201
+
+    response = client.get(blob_url, headers=auth_headers)
+    assert response.content == b"".join(blocks[block_id] for block_id in order)
+
+    # Committed blocks are discarded, so the same list cannot be committed again.
+    response = client.put(blob_url, params={"comp": "blocklist"}, content=block_list, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.headers["x-ms-error-code"] == "InvalidBlockList"
+
+def test_list_blobs_and_containers(client: TestClient, auth_headers: Dict[str, str], container_url: str):
+    """
+    Tests listing with prefixes and paging through markers.
+    """
+    for name in ["logs/b", "logs/a", "logs/c", "other"]:
+        assert client.put(f"{container_url}/{name}", content=name.encode(), headers=auth_headers).status_code == 201
+
+    names, marker = [], ""
+    while True:
+        response = client.get(container_url, params={"restype": "container", "comp": "list", "prefix": "logs/", "maxresults": 2, "marker": marker}, headers=auth_headers)
+        assert response.status_code == 200
+        root = ElementTree.fromstring(response.content)
+        names += [element.text for element in root.iter("Name")]
+        marker = root.findtext("NextMarker")
+        if not marker:
+            break
+    assert names == ["logs/a", "logs/b", "logs/c"]
+
+    response = client.get(ACCOUNT_URL, params={"comp": "list"}, headers=auth_headers)
+    assert [element.text for element in ElementTree.fromstring(response.content).iter("Name")] == ["artifacts"]
+
+    response = client.put(container_url, params={"restype": "container"}, headers=auth_headers)
+    assert response.status_code == 409
+    assert _error_code(response) == "ContainerAlreadyExists"
+
+    assert client.delete(container_url, params={"restype": "container"}, headers=auth_headers).status_code == 202
+    response = client.get(f"{container_url}/other", headers=auth_headers)
+    assert response.status_code == 404
+
+def test_blob_requires_storage_account(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that containers can only be created in existing storage accounts.
+    """
+    response = client.put("/blob/missingaccount/artifacts", params={"restype": "container"}, headers=auth_headers)
+    assert response.status_code == 404
+    assert _error_code(response) == "ResourceNotFound"
+
+def test_deleting_account_deletes_its_blobs(client: TestClient, auth_headers: Dict[str, str], container_url: str, emulator_session: Session):
+    """
+    Tests that deleting a storage account deletes its containers and blobs,
+    so an account created with the same name starts empty.
+    """
+    response = client.put(f"{container_url}/a.txt", content=b"data", headers={**auth_headers, "x-ms-blob-type": "BlockBlob"})
+    assert response.status_code == 201
+    account_dir = os.path.join(get_settings().BLOB_STORAGE_PATH, "teststorage")
+    assert os.path.isdir(account_dir)
+
+    assert client.delete(STORAGE_ACCOUNT_URL, headers=auth_headers).status_code == 204
+    assert emulator_session.exec(select(BlobContainer).where(BlobContainer.account_name == "teststorage")).all() == []
+    assert emulator_session.exec(select(Blob).where(Blob.account_name == "teststorage")).all() == []
+    assert not os.path.exists(account_dir)
+
+    assert client.put(STORAGE_ACCOUNT_URL, json=ACCOUNT_PAYLOAD, headers=auth_headers).status_code == 200
+    response = client.get(f"{container_url}/a.txt", headers=auth_headers)
+    assert response.status_code == 404
+    assert _error_code(response) == "ContainerNotFound"
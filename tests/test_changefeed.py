@@ -0,0 +1,203 @@
+"""
+Tests for the resource change feed.
+"""
+import asyncio
+import json
+from fastapi.testclient import TestClient
+from typing import Dict, List
+
+from sqlmodel import Session
+
+from app.changefeed import ChangeBroker, ChangeFilter, PollingChangeListener, PostgresChangeListener, record_change
+from app.config import get_settings
+from app.db import create_db_and_tables, create_db_engine
+from app.models import ResourceChange, VirtualMachine
+
+CHANGES_PATH = "/providers/Microsoft.Emulator/changes"
+
+def _read_events(client: TestClient, auth_headers: Dict[str, str], **params) -> List[dict]:
+    with client.stream("GET", CHANGES_PATH, params=params, headers=auth_headers) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        data = json.loads(fields["data"])
+        assert int(fields["id"]) == data["sequenceNumber"]
+        assert fields["event"] == data["changeType"]
+        events.append(data)
+    return events
+
+def test_change_feed_replay_and_filters(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that creates, updates and deletes are recorded in order and can be
+    filtered and resumed by sequence number.
+    """
+    vm_url = "/subscriptions/sub-a/resourceGroups/rg-one/providers/Microsoft.Compute/virtualMachines/vm-1"
+    vm_payload = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": "Standard_D2_v2"}}}
+    assert client.put(vm_url, json=vm_payload, headers=auth_headers).status_code == 200
+    resized_payload = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": "Standard_D4_v2"}}}
+    assert client.put(vm_url, json=resized_payload, headers=auth_headers).status_code == 200
+    sa_url = "/subscriptions/sub-b/resourceGroups/rg-two/providers/Microsoft.Storage/storageAccounts/sa1"
+    sa_payload = {"location": "westus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+    assert client.put(sa_url, json=sa_payload, headers=auth_headers).status_code == 200
+    assert client.delete(vm_url, headers=auth_headers).status_code == 204
+
+    events = _read_events(client, auth_headers, since=0, limit=4)
+    assert [(event["changeType"], event["name"]) for event in events] == [
+        ("Create", "vm-1"), ("Update", "vm-1"), ("Create", "sa1"), ("Delete", "vm-1"),
+    ]
+    assert events[0]["resourceId"] == vm_url
+    assert events[2]["resourceType"] == "Microsoft.Storage/storageAccounts"
+    sequence_numbers = [event["sequenceNumber"] for event in events]
+    assert sequence_numbers == sorted(sequence_numbers)
+
+    events = _read_events(client, auth_headers, since=0, limit=1, resourceType="microsoft.storage/storageaccounts")
+    assert events[0]["name"] == "sa1"
+
+    events = _read_events(client, auth_headers, since=0, limit=3, subscriptionId="sub-a", resourceGroup="RG-ONE")
+    assert [event["changeType"] for event in events] == ["Create", "Update", "Delete"]
+
+    resume_headers = {**auth_headers, "Last-Event-ID": str(sequence_numbers[2])}
+    events = _read_events(client, resume_headers, limit=1)
+    assert events[0]["changeType"] == "Delete"
+
+def test_change_broker_delivers_live_events():
+    """
+    Tests that published events reach matching subscribers only.
+    """
+    broker = ChangeBroker()
+    event = {"sequenceNumber": 1, "subscriptionId": "sub-a", "resourceGroup": "rg", "resourceType": "Microsoft.Compute/virtualMachines"}
+
+    async def scenario():
+        matching = broker.subscribe(ChangeFilter(subscription_id="sub-a"))
+        other = broker.subscribe(ChangeFilter(subscription_id="sub-b"))
+        await asyncio.get_running_loop().run_in_executor(None, broker.publish, [event])
+        assert await asyncio.wait_for(matching.queue.get(), 1) == event
+        assert other.queue.empty()
+        broker.unsubscribe(matching)
+        broker.unsubscribe(other)
+
+    asyncio.run(scenario())
+
+def test_polling_listener_publishes_other_workers_changes(tmp_path):
+    """
+    Tests that a worker on a SQLite database publishes the changes that
+    another worker committed, read from the database.
+    """
+    database_url = f"sqlite:///{tmp_path / 'emulator.db'}"
+    engine = create_db_engine(get_settings(), database_url)
+    other_worker = create_db_engine(get_settings(), database_url)
+    create_db_and_tables(engine)
+    broker = ChangeBroker()
+    listener = PollingChangeListener(engine, broker, poll_interval=0.05)
+
+    async def scenario():
+        subscription = broker.subscribe(ChangeFilter())
+        listener.start()
+        try:
+            with Session(other_worker) as session:
+                vm = VirtualMachine(name="vm1", location="eastus", subscription_id="sub", resource_group="rg", vm_size="Standard_D2s_v3")
+                session.add(vm)
+                record_change(session, "Create", vm)
+                session.commit()
+            change_event = await asyncio.wait_for(subscription.queue.get(), 5)
+        finally:
+            listener.stop()
+        assert change_event["changeType"] == "Create"
+        assert change_event["resourceId"].endswith("/virtualMachines/vm1")
+
+    asyncio.run(scenario())
+    engine.dispose()
+    other_worker.dispose()
+
+class _SnapshotStub(PostgresChangeListener):
+    """
+    A PostgreSQL listener reading a SQLite database, with the transaction
+    snapshot and the LISTEN connection replaced by stand-ins.
+    """
+    xmin = xmax = 10
+
+    def _snapshot(self, session):
+        return self.xmin, self.xmax
+
+def _add_changes(engine, *ids: int) -> None:
+    with Session(engine) as session:
+        for change_id in ids:
+            session.add(ResourceChange(
+                id=change_id, change_type="Create", subscription_id="sub", resource_group="rg",
+                resource_type="Microsoft.Compute/virtualMachines", name=f"vm{change_id}", resource_id=f"/vm{change_id}",
+            ))
+        session.commit()
+
+def test_postgres_listener_holds_rows_after_a_gap(tmp_path):
+    """
+    Tests that rows after a missing sequence number are published only once
+    the number is committed, or once every transaction that could commit it
+    has ended.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'emulator.db'}")
+    create_db_and_tables(engine)
+    broker = ChangeBroker()
+    published: List[int] = []
+    broker.add_listener(lambda events: published.extend(event["sequenceNumber"] for event in events))
+    listener = _SnapshotStub(engine, broker)
+
+    _add_changes(engine, 1, 3)
+    listener._catch_up()
+    assert published == [1]
+    assert broker.horizon == 1
+
+    _add_changes(engine, 2)
+    listener._catch_up()
+    assert published == [1, 2, 3]
+
+    # Number 4 is held by a transaction that is still running, and rolls back.
+    listener.xmax = 12
+    _add_changes(engine, 5)
+    listener._catch_up()
+    assert published == [1, 2, 3]
+    listener.xmin = 12
+    listener._catch_up()
+    assert published == [1, 2, 3, 5]
+    assert broker.horizon == 5
+    engine.dispose()
+
+def test_postgres_listener_reconnects_and_catches_up(tmp_path, capsys):
+    """
+    Tests that the listener survives a failed connection: it reconnects and
+    publishes the changes committed in the meantime.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'emulator.db'}")
+    create_db_and_tables(engine)
+    broker = ChangeBroker()
+    published: List[int] = []
+    broker.add_listener(lambda events: published.extend(event["sequenceNumber"] for event in events))
+    invalidated = []
+
+    class Connection:
+        def invalidate(self):
+            invalidated.append(self)
+
+    class FlakyListener(_SnapshotStub):
+        attempts = 0
+
+        def _listen(self):
+            self.attempts += 1
+            if self.attempts == 1:
+                raise ConnectionError("server closed the connection")
+            return Connection()
+
+        def _wait(self, connection):
+            self._stop.set()
+            return False
+
+    listener = FlakyListener(engine, broker, poll_interval=0.01)
+    _add_changes(engine, 1, 2)
+    listener._run(None)
+    assert listener.attempts == 2
+    assert published == [1, 2]
+    assert len(invalidated) == 1
+    assert "Change feed listener failed" in capsys.readouterr().out
+    engine.dispose()
@@ -57,6 +57,27 @@ def test_vm_lifecycle(client: TestClient, auth_headers: Dict[str, str]):
     response_get_after_delete = client.get(api_path, headers=auth_headers)
     assert response_get_after_delete.status_code == 404
 
+def test_vms_in_different_subscriptions(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that VMs with the same name and resource group in two
+    subscriptions are separate resources.
+    """
+    path_a = "/subscriptions/sub-a/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm1"
+    path_b = path_a.replace("sub-a", "sub-b")
+    payload = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": "Standard_D2_v2"}}}
+    assert client.put(path_a, json=payload, headers=auth_headers).status_code == 200
+    assert client.get(path_b, headers=auth_headers).status_code == 404
+
+    payload_b = {"location": "westus", "properties": {"hardwareProfile": {"vmSize": "Standard_D4_v2"}}}
+    assert client.put(path_b, json=payload_b, headers=auth_headers).status_code == 200
+    assert client.get(path_a, headers=auth_headers).json()["location"] == "eastus"
+    assert client.get(path_b, headers=auth_headers).json()["location"] == "westus"
+    list_path = path_a.rsplit("/", 1)[0]
+    assert [vm["subscription_id"] for vm in client.get(list_path, headers=auth_headers).json()] == ["sub-a"]
+
+    assert client.delete(path_b, headers=auth_headers).status_code == 204
+    assert client.get(path_a, headers=auth_headers).status_code == 200
+
 def test_vm_auth(client: TestClient):
     """
     Tests that unauthorized and incorrectly authorized requests are rejected.
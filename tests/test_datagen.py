@@ -0,0 +1,51 @@
+"""
+Tests for the synthetic resource generator.
+"""
+import ipaddress
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, func, select
+from sqlalchemy.pool import StaticPool
+
+from app.datagen import SyntheticDataGenerator, generate
+from app.models import StorageAccount, Subnet, VirtualMachine, VirtualNetwork
+
+def test_generate_bulk_loads_all_tables():
+    """
+    Tests that the generator loads the requested number of rows per table.
+    """
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+
+    counts = generate(engine, resource_groups=20, vms=500, vnets=50, storage_accounts=40, seed=7, batch_size=128)
+    assert counts["virtualmachine"] == 500
+    assert counts["virtualnetwork"] == 50
+    assert counts["storageaccount"] == 40
+    assert counts["subnet"] >= 50
+
+    with Session(engine) as session:
+        assert session.exec(select(func.count()).select_from(VirtualMachine)).one() == 500
+        assert session.exec(select(func.count()).select_from(StorageAccount)).one() == 40
+        assert session.exec(select(func.count()).select_from(Subnet)).one() == counts["subnet"]
+        vnet = session.exec(select(VirtualNetwork)).first()
+        assert len(vnet.subnets) >= 1
+        for vnet in session.exec(select(VirtualNetwork)):
+            network = ipaddress.ip_network(vnet.address_space)
+            assert all(ipaddress.ip_network(subnet.address_prefix).subnet_of(network) for subnet in vnet.subnets)
+
+    with pytest.raises(ValueError):
+        generate(engine, resource_groups=1, vms=0, vnets=1, storage_accounts=0, subnets_per_vnet=257)
+
+def test_generator_is_deterministic():
+    """
+    Tests that the same seed always produces the same rows.
+    """
+    first = list(SyntheticDataGenerator(10, seed=1).virtual_machines(100))
+    second = list(SyntheticDataGenerator(10, seed=1).virtual_machines(100))
+    other = list(SyntheticDataGenerator(10, seed=2).virtual_machines(100))
+    assert first == second
+    assert first != other
@@ -0,0 +1,91 @@
+"""
+Tests for the Prometheus metrics middleware and exporter.
+"""
+import threading
+from fastapi.testclient import TestClient
+from typing import Dict
+
+from app.config import get_settings
+from app.db import create_db_and_tables, create_db_engine
+from app.main import create_app
+from app.metrics import Gauge, Histogram
+
+def _sample(metrics_text: str, prefix: str) -> float:
+    """Returns the value of the first sample line starting with `prefix`."""
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+def test_metrics_endpoint(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that per-route requests and auth failures are exported.
+    """
+    route = "/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Storage/storageAccounts/{account_name}"
+    request_prefix = f'emulator_http_requests_total{{method="GET",route="{route}",status="404"}}'
+    before = client.get("/metrics").text
+
+    api_path = "/subscriptions/test-sub-123/resourceGroups/test-rg-metrics/providers/Microsoft.Storage/storageAccounts/missing"
+    assert client.get(api_path, headers=auth_headers).status_code == 404
+    assert client.get(api_path).status_code == 401
+    assert client.get(api_path, headers={"Authorization": "Bearer bad-token"}).status_code == 401
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    after = response.text
+
+    assert _sample(after, request_prefix) == _sample(before, request_prefix) + 1
+    for reason in ("missing_token", "invalid_token"):
+        prefix = f'emulator_auth_failures_total{{reason="{reason}"}}'
+        assert _sample(after, prefix) == _sample(before, prefix) + 1
+    assert "emulator_http_requests_in_flight" in after
+
+def test_histogram_render():
+    histogram = Histogram("test_latency_seconds", "Test histogram.", ("route",), buckets=(0.1, 1.0))
+    child = histogram.labels("/a")
+    for value in (0.05, 0.5, 5.0):
+        child.observe(value)
+
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{route="/a"} 3' in lines
+
+def test_threadsafe_gauge():
+    """
+    Tests that a thread-safe gauge loses no updates under concurrent use.
+    """
+    gauge = Gauge("test_in_flight", "Test gauge.", threadsafe=True)
+    child = gauge.labels()
+
+    def update():
+        for _ in range(10000):
+            child.inc(2)
+            child.dec()
+
+    threads = [threading.Thread(target=update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert "test_in_flight 40000.0" in gauge.render()
+
+def test_session_hold_is_recorded(tmp_path, auth_headers: Dict[str, str]):
+    """
+    Tests that sessions from the real `get_session` dependency, which the
+    test plugin replaces, are timed.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'emulator.db'}")
+    create_db_and_tables(engine)
+    app = create_app()
+    app.state.engine = engine
+    client = TestClient(app)
+    prefix = "emulator_db_session_hold_seconds_count"
+    before = _sample(client.get("/metrics").text, prefix)
+
+    api_path = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/missing"
+    assert client.get(api_path, headers=auth_headers).status_code == 404
+    assert _sample(client.get("/metrics").text, prefix) == before + 1
+    engine.dispose()
@@ -0,0 +1,78 @@
+"""
+Tests for upgrading databases created by earlier releases.
+"""
+from sqlalchemy import inspect
+from sqlmodel import Session, select
+
+from app.config import get_settings
+from app.db import create_db_and_tables, create_db_engine
+from app.migrations import MIGRATIONS
+from app.models import SchemaVersion, Subnet, VirtualMachine, VirtualNetwork
+
+# The schema of the first release, as created by SQLModel on SQLite.
+FIRST_RELEASE_SCHEMA = [
+    """CREATE TABLE virtualmachine (id INTEGER NOT NULL, name VARCHAR NOT NULL, resource_group VARCHAR NOT NULL,
+        location VARCHAR NOT NULL, vm_size VARCHAR NOT NULL, provisioning_state VARCHAR NOT NULL,
+        PRIMARY KEY (id), CONSTRAINT unique_vm_in_rg UNIQUE (name, resource_group))""",
+    "CREATE INDEX ix_virtualmachine_name ON virtualmachine (name)",
+    "CREATE INDEX ix_virtualmachine_resource_group ON virtualmachine (resource_group)",
+    """CREATE TABLE virtualnetwork (id INTEGER NOT NULL, name VARCHAR NOT NULL, resource_group VARCHAR NOT NULL,
+        location VARCHAR NOT NULL, address_space VARCHAR NOT NULL,
+        PRIMARY KEY (id), CONSTRAINT unique_vnet_in_rg UNIQUE (name, resource_group))""",
+    "CREATE INDEX ix_virtualnetwork_name ON virtualnetwork (name)",
+    "CREATE INDEX ix_virtualnetwork_resource_group ON virtualnetwork (resource_group)",
+    """CREATE TABLE storageaccount (id INTEGER NOT NULL, name VARCHAR NOT NULL, resource_group VARCHAR NOT NULL,
+        location VARCHAR NOT NULL, sku VARCHAR NOT NULL, kind VARCHAR NOT NULL,
+        PRIMARY KEY (id), CONSTRAINT unique_sa_in_rg UNIQUE (name, resource_group))""",
+    "CREATE INDEX ix_storageaccount_name ON storageaccount (name)",
+    "CREATE INDEX ix_storageaccount_resource_group ON storageaccount (resource_group)",
+    """CREATE TABLE subnet (id INTEGER NOT NULL, name VARCHAR NOT NULL, address_prefix VARCHAR NOT NULL,
+        virtual_network_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(virtual_network_id) REFERENCES virtualnetwork (id))""",
+    "CREATE INDEX ix_subnet_name ON subnet (name)",
+    "INSERT INTO virtualmachine VALUES (1, 'vm1', 'RG', 'eastus', 'Standard_D2_v2', 'Succeeded')",
+    "INSERT INTO virtualnetwork VALUES (1, 'vnet1', 'rg', 'eastus', '10.0.0.0/16')",
+    "INSERT INTO subnet VALUES (1, 'default', '10.0.0.0/24', 1)",
+]
+
+def test_first_release_database_is_upgraded(tmp_path):
+    """
+    Tests that a database of the first release gets the new columns,
+    constraints and indexes, keeps its rows, and is only migrated once.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        for statement in FIRST_RELEASE_SCHEMA:
+            connection.exec_driver_sql(statement)
+
+    create_db_and_tables(engine)
+    create_db_and_tables(engine)
+
+    inspector = inspect(engine)
+    assert {"subscription_id", "content_hash", "resource_id_key"} <= {column["name"] for column in inspector.get_columns("virtualmachine")}
+    with engine.connect() as connection:
+        indexes = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'virtualmachine'").scalars())
+    assert {"ix_virtualmachine_resource_id_key", "ix_virtualmachine_lower_name", "ix_virtualmachine_subscription_id"} <= indexes
+    assert "resourcechange" in inspector.get_table_names()
+    assert inspector.get_foreign_keys("subnet")[0]["referred_table"] == "virtualnetwork"
+    with Session(engine) as session:
+        assert session.exec(select(SchemaVersion.version)).all() == [len(MIGRATIONS)]
+        vm = session.exec(select(VirtualMachine)).one()
+        assert (vm.name, vm.subscription_id) == ("vm1", "")
+        assert vm.resource_id_key == "/subscriptions//resourcegroups/rg/providers/microsoft.compute/virtualmachines/vm1"
+        assert session.get(Subnet, 1).virtual_network.name == "vnet1"
+
+        # The same name can now be used in another subscription.
+        session.add(VirtualMachine(name="vm1", resource_group="RG", subscription_id="sub", location="eastus", vm_size="Standard_D2_v2"))
+        session.add(VirtualNetwork(name="vnet1", resource_group="rg", subscription_id="sub", location="eastus", address_space="10.1.0.0/16"))
+        session.commit()
+    engine.dispose()
+
+def test_new_database_starts_at_latest_version(tmp_path):
+    """
+    Tests that a new database is created at the latest schema version.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'new.db'}")
+    create_db_and_tables(engine)
+    with Session(engine) as session:
+        assert session.exec(select(SchemaVersion.version)).all() == [len(MIGRATIONS)]
+    engine.dispose()
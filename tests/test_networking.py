@@ -2,8 +2,12 @@
 Tests for the refactored, path-compliant networking service endpoints.
 """
 from fastapi.testclient import TestClient
+from sqlmodel import Session, select
 from typing import Dict
 
+from app.models import ResourceChange
+from app.services import networking
+
 # All fixtures are provided by conftest.py
 
 def test_vnet_lifecycle(client: TestClient, auth_headers: Dict[str, str]):
@@ -74,3 +78,29 @@ def test_vnet_auth(client: TestClient):
     # Test GET with bad token
     response_bad_token = client.get(api_path, headers={"Authorization": "Bearer bad-token"})
     assert response_bad_token.status_code == 401
+
+def test_unchanged_vnet_put_is_not_written(client: TestClient, auth_headers: Dict[str, str], emulator_session: Session, monkeypatch):
+    """
+    Tests that repeating a PUT with an equivalent body returns the stored
+    virtual network without taking the write lock or recording a change.
+    """
+    api_path = "/subscriptions/test-sub-123/resourceGroups/test-rg-net-2/providers/Microsoft.Network/virtualNetworks/test-vnet-02"
+    vnet_payload = {"location": "eastus", "properties": {"addressSpace": {"addressPrefixes": ["10.0.0.0/16"]}}}
+    created = client.put(api_path, json=vnet_payload, headers=auth_headers).json()
+    assert "content_hash" not in created
+
+    write_transactions = []
+    begin_write = networking.begin_write
+    monkeypatch.setattr(networking, "begin_write", lambda session: write_transactions.append(begin_write(session)))
+    reordered = {"properties": {"addressSpace": {"addressPrefixes": ["10.0.0.0/16"]}}, "location": "eastus"}
+    response = client.put(api_path, json=reordered, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == created
+    assert write_transactions == []
+
+    vnet_payload["location"] = "westus"
+    assert client.put(api_path, json=vnet_payload, headers=auth_headers).json()["location"] == "westus"
+    assert len(write_transactions) == 1
+
+    changes = emulator_session.exec(select(ResourceChange).where(ResourceChange.name == "test-vnet-02")).all()
+    assert [change.change_type for change in changes] == ["Create", "Update"]
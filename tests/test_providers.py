@@ -0,0 +1,63 @@
+"""
+Tests for the provider registration, location and metadata endpoints.
+"""
+from fastapi.testclient import TestClient
+from typing import Dict
+
+from app.provider_catalog import ProviderCatalog
+from app.spec_index import SpecEndpoint
+
+def _endpoint(path: str, api_version: str) -> SpecEndpoint:
+    return SpecEndpoint(path, "Op_Get", api_version, "spec.json", {}, b"{}", frozenset())
+
+def test_providers_are_built_from_spec_endpoints(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that namespaces, resource types and API versions come from the
+    spec endpoints and the persisted resource types.
+    """
+    vm_path = "/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Compute/virtualMachines/{vmName}"
+    client.app.state.provider_catalog = ProviderCatalog.build([
+        _endpoint(vm_path, "2023-03-01"),
+        _endpoint(vm_path, "2024-07-01"),
+        _endpoint(vm_path + "/extensions/{vmExtensionName}", "2024-07-01"),
+        _endpoint("/subscriptions/{subscriptionId}/providers/Microsoft.Compute/locations/{location}/usages", "2024-07-01"),
+        _endpoint("/{resourceUri}/providers/Microsoft.Insights/diagnosticSettings", "2021-05-01-preview"),
+    ])
+
+    response = client.get("/subscriptions/sub-1/providers", headers=auth_headers)
+    assert response.status_code == 200
+    providers = {provider["namespace"]: provider for provider in response.json()["value"]}
+    assert set(providers) == {"Microsoft.Compute", "Microsoft.Insights", "Microsoft.Network", "Microsoft.Storage"}
+    assert providers["Microsoft.Compute"]["id"] == "/subscriptions/sub-1/providers/Microsoft.Compute"
+    resource_types = {resource_type["resourceType"]: resource_type for resource_type in providers["Microsoft.Compute"]["resourceTypes"]}
+    assert set(resource_types) == {"virtualMachines", "virtualMachines/extensions", "locations/usages"}
+    assert resource_types["virtualMachines"]["apiVersions"] == ["2024-07-01", "2023-03-01"]
+    assert "East US" in resource_types["virtualMachines"]["locations"]
+
+    response = client.get("/providers/microsoft.insights", headers=auth_headers)
+    assert response.json()["id"] == "/providers/Microsoft.Insights"
+
+    # Every namespace is reported as registered.
+    response = client.post("/subscriptions/sub-1/providers/Microsoft.Web/register", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["registrationState"] == "Registered"
+    response = client.get("/subscriptions/sub-1/providers/not-a-namespace", headers=auth_headers)
+    assert response.status_code == 404
+    assert response.json()["error"]["code"] == "InvalidResourceNamespace"
+
+def test_locations_and_metadata(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests the location list and the cloud metadata pointing at the emulator.
+    """
+    response = client.get("/subscriptions/sub-1/locations", headers=auth_headers)
+    assert response.status_code == 200
+    eastus = next(location for location in response.json()["value"] if location["name"] == "eastus")
+    assert eastus["id"] == "/subscriptions/sub-1/locations/eastus"
+    assert eastus["displayName"] == "East US"
+
+    response = client.get("/metadata/endpoints", params={"api-version": "2022-09-01"})
+    assert response.status_code == 200
+    [cloud] = response.json()
+    assert cloud["resourceManager"] == "http://testserver/"
+    response = client.get("/metadata/endpoints", params={"api-version": "2020-06-01"})
+    assert response.json()["name"] == "AzureCloud"
@@ -0,0 +1,65 @@
+"""
+Tests for the pytest plugin providing the in-process emulator.
+"""
+pytest_plugins = ["pytester"]
+
+def test_plugin_rolls_back_each_test(pytester):
+    """
+    Tests that resources created in one test are gone in the next, while
+    the app and schema are created once.
+    """
+    pytester.makeconftest('pytest_plugins = ["app.pytest_plugin"]')
+    pytester.makepyfile("""
+        VM_URL = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm-1"
+        VM_PAYLOAD = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": "Standard_D2_v2"}}}
+        apps = set()
+
+        def test_create(emulator_app, emulator_client, emulator_auth_headers):
+            apps.add(id(emulator_app))
+            assert emulator_client.put(VM_URL, json=VM_PAYLOAD, headers=emulator_auth_headers).status_code == 200
+            assert emulator_client.get(VM_URL, headers=emulator_auth_headers).status_code == 200
+            emulator_app.state.marker = True
+
+        def test_rolled_back(emulator_app, emulator_client, emulator_auth_headers):
+            apps.add(id(emulator_app))
+            assert emulator_client.get(VM_URL, headers=emulator_auth_headers).status_code == 404
+            assert not hasattr(emulator_app.state, "marker")
+            assert len(apps) == 1
+    """)
+    result = pytester.runpytest_inprocess("-p", "no:cacheprovider")
+    result.assert_outcomes(passed=2)
+
+def test_plugin_isolates_data_planes(pytester):
+    """
+    Tests that each test's blobs and queues are stored in its own temporary
+    directory and are gone in the next test.
+    """
+    pytester.makeconftest('pytest_plugins = ["app.pytest_plugin"]')
+    pytester.makepyfile("""
+        from app.config import get_settings
+
+        ACCOUNT_URL = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/pluginstorage"
+        ACCOUNT_PAYLOAD = {"location": "eastus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+        MESSAGE = "<QueueMessage><MessageText>hello</MessageText></QueueMessage>"
+
+        def test_store(emulator_client, emulator_auth_headers, tmp_path):
+            headers = emulator_auth_headers
+            assert emulator_client.put(ACCOUNT_URL, json=ACCOUNT_PAYLOAD, headers=headers).status_code == 200
+            assert emulator_client.put("/blob/pluginstorage/files?restype=container", headers=headers).status_code == 201
+            response = emulator_client.put("/blob/pluginstorage/files/a.txt", content=b"data", headers={**headers, "x-ms-blob-type": "BlockBlob"})
+            assert response.status_code == 201
+            assert emulator_client.put("/queue/pluginstorage/jobs", headers=headers).status_code == 201
+            assert emulator_client.post("/queue/pluginstorage/jobs/messages", content=MESSAGE, headers=headers).status_code == 201
+
+            assert get_settings().BLOB_STORAGE_PATH.startswith(str(tmp_path))
+            assert any(path.is_file() for path in (tmp_path / "blobs").rglob("*"))
+            assert (tmp_path / "queues" / "queues.log").stat().st_size > 0
+
+        def test_isolated(emulator_app, emulator_client, emulator_auth_headers, tmp_path):
+            assert emulator_client.put(ACCOUNT_URL, json=ACCOUNT_PAYLOAD, headers=emulator_auth_headers).status_code == 200
+            response = emulator_client.get("/queue/pluginstorage/jobs/messages", params={"peekonly": "true"}, headers=emulator_auth_headers)
+            assert response.headers["x-ms-error-code"] == "QueueNotFound"
+            assert emulator_app.state.queue_store.log_path.startswith(str(tmp_path))
+    """)
+    result = pytester.runpytest_inprocess("-p", "no:cacheprovider")
+    result.assert_outcomes(passed=2)
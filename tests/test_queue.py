@@ -0,0 +1,232 @@
+"""
+Tests for the queue storage data plane and its message log.
+"""
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+from typing import Dict
+from xml.etree import ElementTree
+
+from app import queuestore
+from app.queuestore import QueueStore
+
+QUEUE_URL = "/queue/teststorage/jobs"
+
+def _message(text: str) -> str:
+    return f"<QueueMessage><MessageText>{text}</MessageText></QueueMessage>"
+
+def _messages(response) -> list:
+    return [
+        {child.tag: child.text for child in item}
+        for item in ElementTree.fromstring(response.content).iter("QueueMessage")
+    ]
+
+@pytest.fixture(name="store")
+def store_fixture(client: TestClient, auth_headers: Dict[str, str]) -> QueueStore:
+    """
+    Creates a storage account and a queue, and returns the test's queue store.
+    """
+    store = client.app.state.queue_store
+    account_payload = {"location": "eastus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+    response = client.put(
+        "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/teststorage",
+        json=account_payload,
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    assert client.put(QUEUE_URL, headers=auth_headers).status_code == 201
+    return store
+
+def test_put_get_and_delete_messages(client: TestClient, auth_headers: Dict[str, str], store: QueueStore):
+    """
+    Tests the visibility timeout, pop receipts and peeking.
+    """
+    for text in ["first", "second", "hidden"]:
+        params = {"visibilitytimeout": 60} if text == "hidden" else {}
+        response = client.post(f"{QUEUE_URL}/messages", params=params, content=_message(text), headers=auth_headers)
+        assert response.status_code == 201
+
+    response = client.get(f"{QUEUE_URL}/messages", params={"peekonly": "true", "numofmessages": 32}, headers=auth_headers)
+    assert [message["MessageText"] for message in _messages(response)] == ["first", "second"]
+
+    response = client.get(f"{QUEUE_URL}/messages", params={"visibilitytimeout": 1}, headers=auth_headers)
+    [received] = _messages(response)
+    assert received["MessageText"] == "first"
+    assert received["DequeueCount"] == "1"
+
+    response = client.get(f"{QUEUE_URL}/messages", params={"numofmessages": 32}, headers=auth_headers)
+    assert [message["MessageText"] for message in _messages(response)] == ["second"]
+
+    # The first message becomes visible again once its timeout has passed.
+    time.sleep(1.1)
+    response = client.get(f"{QUEUE_URL}/messages", headers=auth_headers)
+    [again] = _messages(response)
+    assert again["MessageId"] == received["MessageId"]
+    assert again["DequeueCount"] == "2"
+
+    message_url = f"{QUEUE_URL}/messages/{again['MessageId']}"
+    response = client.delete(message_url, params={"popreceipt": received["PopReceipt"]}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.headers["x-ms-error-code"] == "PopReceiptMismatch"
+    assert client.delete(message_url, params={"popreceipt": again["PopReceipt"]}, headers=auth_headers).status_code == 204
+    response = client.delete(message_url, params={"popreceipt": again["PopReceipt"]}, headers=auth_headers)
+    assert response.headers["x-ms-error-code"] == "MessageNotFound"
+
+    response = client.get(QUEUE_URL, params={"comp": "metadata"}, headers=auth_headers)
+    assert response.headers["x-ms-approximate-messages-count"] == "2"
+    assert client.delete(f"{QUEUE_URL}/messages", headers=auth_headers).status_code == 204
+    response = client.get(QUEUE_URL, params={"comp": "metadata"}, headers=auth_headers)
+    assert response.headers["x-ms-approximate-messages-count"] == "0"
+
+def test_queues_survive_restart(client: TestClient, auth_headers: Dict[str, str], store: QueueStore):
+    """
+    Tests that the log restores queues and message state, ignoring a torn
+    record at its end.
+    """
+    for text in ["a", "b", "c"]:
+        client.post(f"{QUEUE_URL}/messages", content=_message(text), headers=auth_headers)
+    [received] = _messages(client.get(f"{QUEUE_URL}/messages", params={"visibilitytimeout": 60}, headers=auth_headers))
+    [deleted] = _messages(client.get(f"{QUEUE_URL}/messages", headers=auth_headers))
+    client.delete(f"{QUEUE_URL}/messages/{deleted['MessageId']}", params={"popreceipt": deleted["PopReceipt"]}, headers=auth_headers)
+    store.close()
+    with open(store.log_path, "ab") as log:
+        log.write(b"\x10\x00\x00\x00torn")
+
+    queue_path = os.path.dirname(store.log_path)
+    store = QueueStore(queue_path)
+    client.app.state.queue_store = store
+    try:
+        assert store.list_queues("teststorage") == ["jobs"]
+        response = client.get(f"{QUEUE_URL}/messages", params={"numofmessages": 32}, headers=auth_headers)
+        assert [message["MessageText"] for message in _messages(response)] == ["c"]
+        # The hidden message keeps its pop receipt.
+        response = client.delete(f"{QUEUE_URL}/messages/{received['MessageId']}", params={"popreceipt": received["PopReceipt"]}, headers=auth_headers)
+        assert response.status_code == 204
+        assert client.post(f"{QUEUE_URL}/messages", content=_message("d"), headers=auth_headers).status_code == 201
+    finally:
+        store.close()
+    store = QueueStore(queue_path)
+    assert store.approximate_message_count("teststorage", "jobs") == 2
+    store.close()
+
+def test_queue_log_compaction(tmp_path, monkeypatch):
+    """
+    Tests that compaction keeps only live state and that the compacted log
+    replays to the same messages.
+    """
+    monkeypatch.setattr(queuestore, "COMPACTION_SLACK", 50)
+    store = QueueStore(str(tmp_path), fsync=False)
+    store.create_queue("acct", "work")[1].result()
+    for index in range(200):
+        message, future = store.put_message("acct", "work", f"m{index}", 0, -1)
+        future.result()
+        if index % 10:
+            store.delete_message("acct", "work", message.message_id, message.pop_receipt).result()
+    store.close()
+
+    with open(store.log_path, "rb") as log:
+        assert log.read().count(b'"op"') < 100
+    store = QueueStore(str(tmp_path), fsync=False)
+    assert sorted(message.text for message in store.peek_messages("acct", "work", 32)) == sorted(f"m{index}" for index in range(0, 200, 10))
+    store.close()
+
+def test_failed_compaction_keeps_syncing(tmp_path, monkeypatch):
+    """
+    Tests that changes still complete while compacting the log fails, and
+    that compaction succeeds once the failure is gone.
+    """
+    monkeypatch.setattr(queuestore, "COMPACTION_SLACK", 10)
+    failures = []
+
+    def fail_replace(source, destination):
+        failures.append(source)
+        raise OSError("disk full")
+
+    store = QueueStore(str(tmp_path), fsync=False)
+    try:
+        store.create_queue("acct", "work")[1].result()
+        with monkeypatch.context() as patch:
+            patch.setattr(queuestore.os, "replace", fail_replace)
+            for index in range(30):
+                message, future = store.put_message("acct", "work", f"m{index}", 0, -1)
+                future.result(timeout=5)
+                store.delete_message("acct", "work", message.message_id, message.pop_receipt).result(timeout=5)
+        assert failures
+        store.put_message("acct", "work", "last", 0, -1)[1].result(timeout=5)
+        store.put_message("acct", "work", "after", 0, -1)[1].result(timeout=5)
+    finally:
+        store.close()
+    with open(store.log_path, "rb") as log:
+        assert log.read().count(b'"op"') < 10
+
+def test_queue_requires_storage_account(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that queues can only be created in existing storage accounts.
+    """
+    response = client.put("/queue/missingaccount/jobs", headers=auth_headers)
+    assert response.status_code == 404
+    assert response.headers["x-ms-error-code"] == "ResourceNotFound"
+    response = client.post("/queue/missingaccount/jobs/messages", content=_message("x"), headers=auth_headers)
+    assert response.headers["x-ms-error-code"] == "ResourceNotFound"
+
+def test_queues_are_deleted_with_their_storage_account(client: TestClient, auth_headers: Dict[str, str], store: QueueStore):
+    """
+    Tests that deleting a storage account deletes its queues, and that no
+    queue operation works on the deleted account.
+    """
+    response = client.post(f"{QUEUE_URL}/messages", content=_message("orphan"), headers=auth_headers)
+    assert response.status_code == 201
+    response = client.delete(
+        "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/teststorage",
+        headers=auth_headers,
+    )
+    assert response.status_code == 204
+    assert store.list_queues("teststorage") == []
+
+    requests = [
+        ("GET", QUEUE_URL, {"comp": "metadata"}),
+        ("DELETE", QUEUE_URL, {}),
+        ("POST", f"{QUEUE_URL}/messages", {}),
+        ("GET", f"{QUEUE_URL}/messages", {}),
+        ("GET", f"{QUEUE_URL}/messages", {"peekonly": "true"}),
+        ("DELETE", f"{QUEUE_URL}/messages", {}),
+        ("PUT", f"{QUEUE_URL}/messages/id", {"popreceipt": "receipt", "visibilitytimeout": 0}),
+        ("DELETE", f"{QUEUE_URL}/messages/id", {"popreceipt": "receipt"}),
+    ]
+    for method, url, params in requests:
+        content = _message("x") if method in ("POST", "PUT") else None
+        response = client.request(method, url, params=params, content=content, headers=auth_headers)
+        assert response.status_code == 404, (method, url)
+        assert response.headers["x-ms-error-code"] == "ResourceNotFound"
+
+def test_queue_log_shared_by_processes(tmp_path, monkeypatch):
+    """
+    Tests that stores on the same log, as in separate worker processes,
+    see each other's changes, including after one of them compacts the log.
+    """
+    monkeypatch.setattr(queuestore, "COMPACTION_SLACK", 20)
+    first = QueueStore(str(tmp_path), fsync=False)
+    second = QueueStore(str(tmp_path), fsync=False)
+    try:
+        first.create_queue("acct", "work")[1].result()
+        assert second.list_queues("acct") == ["work"]
+        message, future = second.put_message("acct", "work", "hello", 0, -1)
+        future.result()
+        [received], future = first.get_messages("acct", "work", 1, 30)
+        future.result()
+        assert received.text == "hello"
+        assert second.get_messages("acct", "work", 1, 30)[0] == []
+
+        # Enough churn in the second store to make it compact the log.
+        for index in range(50):
+            put, future = second.put_message("acct", "work", f"m{index}", 0, -1)
+            future.result()
+            second.delete_message("acct", "work", put.message_id, put.pop_receipt).result()
+        with open(second.log_path, "rb") as log:
+            assert log.read().count(b'"op"') < 50
+        first.delete_message("acct", "work", received.message_id, received.pop_receipt).result()
+        assert second.approximate_message_count("acct", "work") == 0
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,85 @@
+"""
+Tests for lookups by resource ID and the references between resources.
+"""
+from fastapi.testclient import TestClient
+from typing import Dict
+
+from sqlmodel import Session
+
+from app.models import ResourceReference
+from app.references import REFERENCE_GRAPH, ReferenceGraph, find_references
+
+SUB = "/subscriptions/sub/resourceGroups/rg"
+VNET_ID = f"{SUB}/providers/Microsoft.Network/virtualNetworks/vnet1"
+SUBNET_ID = f"{VNET_ID}/subnets/default"
+VM_ID = f"{SUB}/providers/Microsoft.Compute/virtualMachines/vm1"
+
+def _vm_payload(subnet_id: str) -> dict:
+    return {
+        "location": "eastus",
+        "properties": {
+            "hardwareProfile": {"vmSize": "Standard_D2s_v3"},
+            "networkProfile": {"networkInterfaceConfigurations": [{"properties": {"ipConfigurations": [
+                {"properties": {"subnet": {"id": subnet_id}}},
+            ]}}]},
+        },
+    }
+
+def test_get_by_resource_id(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that a stored resource is found by its ID in any letter case,
+    and that other IDs still get mock responses or 404s.
+    """
+    payload = {"location": "eastus", "properties": {"addressSpace": {"addressPrefixes": ["10.0.0.0/16"]}}}
+    assert client.put(VNET_ID, json=payload, headers=auth_headers).status_code == 200
+
+    response = client.get(VNET_ID.upper().replace("/SUBSCRIPTIONS/SUB", "/subscriptions/sub"), headers=auth_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["name"] == "vnet1"
+    assert body["address_space"] == "10.0.0.0/16"
+    assert "resource_id_key" not in body
+
+    response = client.get(f"{SUB}/providers/microsoft.network/virtualnetworks/missing", headers=auth_headers)
+    assert response.status_code == 404
+
+def test_reference_graph(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that references in PUT bodies are indexed in both directions and
+    follow updates and deletes.
+    """
+    assert client.put(VM_ID, json=_vm_payload(SUBNET_ID), headers=auth_headers).status_code == 200
+
+    response = client.get("/providers/Microsoft.Emulator/references", params={"resourceId": VM_ID}, headers=auth_headers)
+    assert response.json()["references"] == [SUBNET_ID]
+    response = client.get("/providers/Microsoft.Emulator/references", params={"resourceId": SUBNET_ID.lower()}, headers=auth_headers)
+    assert response.json()["referencedBy"] == [VM_ID]
+
+    other_subnet = f"{VNET_ID}/subnets/backend"
+    assert client.put(VM_ID, json=_vm_payload(other_subnet), headers=auth_headers).status_code == 200
+    assert REFERENCE_GRAPH.referenced_by(SUBNET_ID) == []
+    assert REFERENCE_GRAPH.referenced_by(other_subnet) == [VM_ID]
+
+    assert client.delete(VM_ID, headers=auth_headers).status_code == 204
+    assert REFERENCE_GRAPH.references(VM_ID) == []
+    assert REFERENCE_GRAPH.referenced_by(other_subnet) == []
+
+def test_find_references():
+    """
+    Tests that resource IDs are found anywhere in a body, once each.
+    """
+    body = {"a": [{"id": SUBNET_ID}, {"id": SUBNET_ID.lower()}], "b": {"c": VNET_ID}, "d": "/subscriptions"}
+    assert find_references(body) == [SUBNET_ID, VNET_ID]
+
+def test_refresh_reads_references_of_other_workers(emulator_session: Session):
+    """
+    Tests that refreshing a resource replaces its references with the
+    stored ones, as done for changes made through other workers.
+    """
+    graph = ReferenceGraph()
+    graph.set_references(VM_ID, [VNET_ID])
+    emulator_session.add(ResourceReference(source_key=VM_ID.lower(), source_id=VM_ID, target_key=SUBNET_ID.lower(), target_id=SUBNET_ID))
+    emulator_session.flush()
+    graph.refresh(emulator_session, [VM_ID])
+    assert graph.references(VM_ID) == [SUBNET_ID]
+    assert graph.referenced_by(VNET_ID) == []
@@ -0,0 +1,109 @@
+"""
+Tests for the Resource Graph query endpoint.
+"""
+from fastapi.testclient import TestClient
+from typing import Dict
+
+from app.kql import compile_query, parse
+
+QUERY_PATH = "/providers/Microsoft.ResourceGraph/resources?api-version=2021-03-01"
+
+def _create_resources(client: TestClient, auth_headers: Dict[str, str]):
+    for subscription_id, resource_group in [("sub-a", "RG-One"), ("sub-a", "rg-two"), ("sub-b", "rg-three")]:
+        base = f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers"
+        for index in range(2):
+            vm_payload = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": "Standard_D2_v2"}}}
+            response = client.put(f"{base}/Microsoft.Compute/virtualMachines/vm-{index}", json=vm_payload, headers=auth_headers)
+            assert response.status_code == 200
+        sa_payload = {"location": "westus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+        response = client.put(f"{base}/Microsoft.Storage/storageAccounts/sa{resource_group.replace('-', '').lower()}", json=sa_payload, headers=auth_headers)
+        assert response.status_code == 200
+
+def _query(client: TestClient, auth_headers: Dict[str, str], query: str, **body):
+    return client.post(QUERY_PATH, json={"query": query, **body}, headers=auth_headers)
+
+def test_resource_graph_queries(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests filtering, projection, aggregation and subscription scoping.
+    """
+    _create_resources(client, auth_headers)
+
+    response = _query(client, auth_headers, "Resources | summarize count() by type | order by type asc")
+    assert response.status_code == 200
+    assert response.json()["data"] == [
+        {"type": "microsoft.compute/virtualmachines", "count_": 6},
+        {"type": "microsoft.storage/storageaccounts", "count_": 3},
+    ]
+
+    response = _query(
+        client, auth_headers,
+        "Resources | where type =~ 'Microsoft.Compute/virtualMachines' and resourceGroup =~ 'rg-one' "
+        "| project name, resourceGroup, vmSize = properties.hardwareProfile.vmSize | order by name asc",
+    )
+    assert response.json()["data"] == [
+        {"name": "vm-0", "resourceGroup": "rg-one", "vmSize": "Standard_D2_v2"},
+        {"name": "vm-1", "resourceGroup": "rg-one", "vmSize": "Standard_D2_v2"},
+    ]
+
+    response = _query(client, auth_headers, "Resources | where sku.name == 'Standard_LRS' | take 1")
+    resource = response.json()["data"][0]
+    assert resource["id"].startswith("/subscriptions/sub-")
+    assert resource["sku"] == {"name": "Standard_LRS"}
+    assert resource["kind"] == "StorageV2"
+
+    response = _query(client, auth_headers, "Resources | count", subscriptions=["sub-b"])
+    assert response.json()["data"] == [{"Count": 3}]
+
+def test_resource_graph_id_and_term_matching(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that comparisons with `id` are looked up by the indexed resource
+    ID key, and that `has` matches whole terms only.
+    """
+    _create_resources(client, auth_headers)
+    vm_id = "/subscriptions/sub-a/resourceGroups/RG-One/providers/Microsoft.Compute/virtualMachines/vm-0"
+
+    compiled = compile_query(parse(f"Resources | where id =~ '{vm_id.upper()}'"))
+    assert "resource_id_key" in str(compiled.statement)
+    response = _query(client, auth_headers, f"Resources | where id =~ '{vm_id.upper()}' | project id")
+    assert response.json()["data"] == [{"id": vm_id}]
+    response = _query(client, auth_headers, f"Resources | where id == '{vm_id}' | project id")
+    assert response.json()["data"] == [{"id": vm_id}]
+    response = _query(client, auth_headers, f"Resources | where id == '{vm_id.lower()}' | project id")
+    assert response.json()["data"] == []
+    response = _query(client, auth_headers, f"Resources | where id in~ ('{vm_id.lower()}', '/missing') | project id")
+    assert response.json()["data"] == [{"id": vm_id}]
+
+    def names(query: str):
+        return sorted(row["name"] for row in _query(client, auth_headers, f"Resources | {query} | project name").json()["data"])
+
+    assert names("where resourceGroup == 'rg-one' and name has 'VM'") == ["vm-0", "vm-1"]
+    # Substrings of a term do not match, unlike with `contains`.
+    assert names("where resourceGroup == 'rg-one' and name has 'v'") == []
+    assert names("where resourceGroup == 'rg-one' and name contains 'v'") == ["vm-0", "vm-1"]
+    assert names("where id has 'rg-one' and name !has 'vm'") == ["sargone"]
+    assert names("where type has 'Compute' and id has 'sub-b'") == ["vm-0", "vm-1"]
+    assert names("where type has 'comp'") == []
+
+def test_resource_graph_paging(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that $skipToken pages through all results exactly once.
+    """
+    _create_resources(client, auth_headers)
+
+    seen = []
+    options = {"$top": 4}
+    while True:
+        body = _query(client, auth_headers, "Resources | project id", options=options).json()
+        assert body["totalRecords"] == 9
+        seen.extend(row["id"] for row in body["data"])
+        if "$skipToken" not in body:
+            break
+        options = {"$top": 4, "$skipToken": body["$skipToken"]}
+    assert len(seen) == len(set(seen)) == 9
+
+def test_resource_graph_invalid_query(client: TestClient, auth_headers: Dict[str, str]):
+    response = _query(client, auth_headers, "Resources | extend x = 1")
+    assert response.status_code == 400
+    error = response.json()["error"]
+    assert error["code"] == "BadRequest"
+    assert error["details"][0]["code"] == "InvalidQuery"
@@ -0,0 +1,201 @@
+"""
+Tests for the spec index, its incremental reloading and the mock endpoints.
+"""
+import json
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+from typing import Dict
+
+from app.config import get_settings
+from app.openapi_parser import SchemaInterner
+from app.spec_index import SpecIndex, SpecWatcher
+
+VM_PATH = "/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.Compute/virtualMachines/{vmName}"
+
+def _spec(api_version: str, size_type: str = "string") -> dict:
+    return {
+        "swagger": "2.0",
+        "info": {"version": api_version},
+        "paths": {
+            VM_PATH: {
+                "get": {
+                    "operationId": "VirtualMachines_Get",
+                    "responses": {"200": {"schema": {"$ref": "#/definitions/VirtualMachine"}}},
+                },
+            },
+            "/{resourceUri}/providers/Microsoft.Insights/diagnosticSettings": {
+                "get": {
+                    "operationId": "DiagnosticSettings_List",
+                    "parameters": [{"name": "resourceUri", "in": "path", "type": "string", "x-ms-skip-url-encoding": True}],
+                    "responses": {"200": {"schema": {"type": "object", "properties": {"value": {"type": "array", "items": {"type": "string"}}}}}},
+                },
+            },
+        },
+        "definitions": {
+            "VirtualMachine": {
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "properties": {"type": "object", "properties": {"vmSize": {"type": size_type}}},
+                },
+            },
+        },
+    }
+
+def _write_spec(specs_path, api_version: str, spec: dict) -> str:
+    directory = specs_path / "compute" / "resource-manager" / "Microsoft.Compute" / "stable" / api_version
+    directory.mkdir(parents=True, exist_ok=True)
+    file_path = directory / "compute.json"
+    file_path.write_text(json.dumps(spec))
+    return str(file_path)
+
+@pytest.fixture(name="specs_path")
+def specs_path_fixture(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_settings(), "API_SPECS_PATH", str(tmp_path))
+    return tmp_path
+
+def test_spec_index_refreshes_changed_files_only(specs_path):
+    """
+    Tests matching, latest-version selection and incremental reloads.
+    """
+    old_file = _write_spec(specs_path, "2023-03-01", _spec("2023-03-01"))
+    _write_spec(specs_path, "2024-07-01", _spec("2024-07-01"))
+
+    index = SpecIndex(["compute"])
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+
+    endpoint = index.snapshot.routes.match("/subscriptions/sub/resourceGroups/rg/providers/microsoft.compute/virtualMachines/vm1").latest
+    assert endpoint.operation_id == "VirtualMachines_Get"
+    assert endpoint.api_version == "2024-07-01"
+    assert json.loads(endpoint.render("/x/vm1"))["name"] == "vm1"
+
+    endpoint = index.snapshot.routes.match("/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Web/sites/app/providers/Microsoft.Insights/diagnosticSettings").latest
+    assert endpoint.operation_id == "DiagnosticSettings_List"
+    assert index.snapshot.routes.match("/subscriptions/sub/unknown") is None
+
+    old_snapshot = index.snapshot
+    with open(old_file, "w") as f:
+        json.dump(_spec("2023-03-01", size_type="integer"), f)
+    os.utime(old_file, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    assert index.refresh([old_file]) == 1
+    assert index.snapshot is not old_snapshot
+
+    os.remove(old_file)
+    assert index.refresh() == 1
+    assert index.snapshot.file_count == 1
+
+def test_spec_versions_are_routed_and_deduplicated(specs_path):
+    """
+    Tests that each api-version gets its own endpoint while identical
+    schemas and mocks across versions are stored once.
+    """
+    _write_spec(specs_path, "2023-03-01", _spec("2023-03-01"))
+    _write_spec(specs_path, "2024-07-01", _spec("2024-07-01"))
+    _write_spec(specs_path, "2025-01-01", _spec("2025-01-01", size_type="integer"))
+    index = SpecIndex(["compute"])
+    index.refresh()
+
+    route = index.snapshot.routes.match("/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm1")
+    assert sorted(route.versions) == ["2023-03-01", "2024-07-01", "2025-01-01"]
+    assert route.select(None).api_version == "2025-01-01"
+    assert route.select("2023-03-01").api_version == "2023-03-01"
+    assert route.select("2019-01-01") is None
+
+    old, same, changed = (route.versions[version] for version in ["2023-03-01", "2024-07-01", "2025-01-01"])
+    assert old.mock is same.mock
+    assert old.body is same.body
+    assert changed.mock["properties"] == {"vmSize": 123}
+
+def test_reload_drops_values_of_replaced_files(specs_path):
+    """
+    Tests that schemas, mocks and compilers only used by replaced or removed
+    files are not kept, while equal definitions share one compiler.
+    """
+    def put_spec(api_version: str, size_type: str) -> dict:
+        spec = _spec(api_version, size_type)
+        spec["paths"][VM_PATH]["put"] = {
+            "operationId": "VirtualMachines_CreateOrUpdate",
+            "parameters": [{"name": "parameters", "in": "body", "schema": {"$ref": "#/definitions/VirtualMachine"}}],
+        }
+        return spec
+
+    file_path = _write_spec(specs_path, "2023-03-01", put_spec("2023-03-01", "string"))
+    _write_spec(specs_path, "2024-07-01", put_spec("2024-07-01", "string"))
+    index = SpecIndex(["compute"])
+    index.refresh()
+    assert len(index._compilers) == 1
+
+    with open(file_path, "w") as f:
+        json.dump(put_spec("2023-03-01", "integer"), f)
+    os.utime(file_path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    index.refresh([file_path])
+    assert len(index._compilers) == 2
+    assert "integer" in index._interner._scalars
+
+    os.remove(file_path)
+    index.refresh()
+    assert len(index._compilers) == 1
+    assert "integer" not in index._interner._scalars
+    validator = index.snapshot.request_validators["VirtualMachines_CreateOrUpdate"]
+    assert validator({"properties": {"vmSize": 1}})
+    assert validator({"properties": {"vmSize": "Standard_D2_v2"}}) == []
+
+def test_schema_interner_shares_equal_values():
+    """
+    Tests that equal JSON values are shared and unequal ones are not.
+    """
+    interner = SchemaInterner()
+    first = json.loads('{"a": [1, {"b": true}], "c": "x"}', object_pairs_hook=interner.object_pairs_hook)
+    second = interner.intern({"a": [1, {"b": True}], "c": "x"})
+    assert first is second
+    assert first["a"] is second["a"]
+    assert interner.intern({"b": 1}) is not first["a"][1]
+    assert interner.intern([1.0]) is not interner.intern([1])
+
+def test_spec_watcher_reloads_in_background(specs_path):
+    """
+    Tests that the polling watcher picks up new spec files.
+    """
+    index = SpecIndex(["compute"])
+    index.refresh()
+    watcher = SpecWatcher(index, interval=0.05, use_watchfiles=False)
+    watcher.start()
+    try:
+        _write_spec(specs_path, "2024-07-01", _spec("2024-07-01"))
+        deadline = time.monotonic() + 5
+        while index.snapshot.file_count == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+    assert index.snapshot.file_count == 1
+
+def test_mock_endpoint_serves_spec_responses(client: TestClient, auth_headers: Dict[str, str], specs_path):
+    """
+    Tests that unhandled GETs are answered from the spec index, after the
+    service routers.
+    """
+    _write_spec(specs_path, "2024-07-01", _spec("2024-07-01"))
+    index = SpecIndex(["compute"])
+    index.refresh()
+    client.app.state.spec_index = index
+
+    diagnostics_url = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Web/sites/app/providers/Microsoft.Insights/diagnosticSettings"
+    response = client.get(diagnostics_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == {"value": ["example_string"]}
+
+    response = client.get(diagnostics_url, params={"api-version": "2024-07-01"}, headers=auth_headers)
+    assert response.status_code == 200
+    response = client.get(diagnostics_url, params={"api-version": "2019-01-01"}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["error"]["code"] == "InvalidApiVersionParameter"
+
+    # Paths owned by a service router are not answered with mocks.
+    response = client.get("/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/missing", headers=auth_headers)
+    assert response.status_code == 404
+
+    response = client.get("/subscriptions/sub/nothing-here", headers=auth_headers)
+    assert response.status_code == 404
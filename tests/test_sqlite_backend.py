@@ -0,0 +1,55 @@
+"""
+Tests for the file-backed SQLite database backend.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from typing import Dict
+from sqlmodel import Session, func, select
+
+from app.config import Settings, get_settings
+from app.db import create_db_and_tables, create_db_engine, pool_size
+from app.main import create_app
+from app.models import ResourceChange, VirtualMachine
+
+def test_sqlite_settings():
+    """
+    Tests that the sqlite backend needs no PostgreSQL settings.
+    """
+    settings = Settings(_env_file=None, DATABASE_BACKEND="sqlite", SQLITE_PATH="/tmp/emulator.db")
+    assert settings.DATABASE_URL == "sqlite:////tmp/emulator.db"
+
+def test_concurrent_writes(tmp_path, auth_headers: Dict[str, str]):
+    """
+    Tests that concurrent upserts of the same and of different resources
+    all succeed on a WAL database, without lost or failed writes.
+    """
+    engine = create_db_engine(get_settings(), f"sqlite:///{tmp_path / 'data' / 'emulator.db'}")
+    create_db_and_tables(engine)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+    app = create_app()
+    app.state.engine = engine
+    client = TestClient(app)
+
+    def put_vm(index: int) -> int:
+        url = f"/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm-{index % 4}"
+        payload = {"location": "eastus", "properties": {"hardwareProfile": {"vmSize": f"Standard_D{index}_v2"}}}
+        return client.put(url, json=payload, headers=auth_headers).status_code
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert set(executor.map(put_vm, range(64))) == {200}
+
+    with Session(engine) as session:
+        assert session.exec(select(func.count()).select_from(VirtualMachine)).one() == 4
+        assert session.exec(select(func.count()).select_from(ResourceChange)).one() == 64
+    engine.dispose()
+
+def test_pool_size_is_divided_between_workers():
+    """
+    Tests that each worker's PostgreSQL pool gets a share of the allowed
+    connections.
+    """
+    settings = Settings(_env_file=None, DATABASE_BACKEND="sqlite", DATABASE_MAX_CONNECTIONS=90, WEB_CONCURRENCY=4)
+    assert pool_size(settings) == 22
+    assert pool_size(Settings(_env_file=None, DATABASE_BACKEND="sqlite", WEB_CONCURRENCY=100)) == 2
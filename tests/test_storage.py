@@ -1,9 +1,14 @@
 """
 Tests for the database-driven storage service endpoints.
 """
+import os
 from fastapi.testclient import TestClient
+from sqlmodel import Session
 from typing import Dict
 
+from app.config import get_settings
+from app.models import StorageAccount
+
 # All fixtures are provided by conftest.py
 
 def test_storage_account_lifecycle(client: TestClient, auth_headers: Dict[str, str]):
@@ -52,6 +57,41 @@ def test_storage_account_lifecycle(client: TestClient, auth_headers: Dict[str, s
     response_get_after_delete = client.get(api_path, headers=auth_headers)
     assert response_get_after_delete.status_code == 404
 
+def test_storage_account_names_are_global(client: TestClient, auth_headers: Dict[str, str]):
+    """
+    Tests that a storage account name can only be used once across all
+    subscriptions and resource groups.
+    """
+    path = "/subscriptions/sub-a/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/sharedname"
+    payload = {"location": "eastus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+    assert client.put(path, json=payload, headers=auth_headers).status_code == 200
+
+    response = client.put(path.replace("sub-a", "sub-b"), json=payload, headers=auth_headers)
+    assert response.status_code == 409
+    assert response.json()["error"]["code"] == "StorageAccountAlreadyTaken"
+    assert client.get(path.replace("sub-a", "sub-b"), headers=auth_headers).status_code == 404
+
+def test_storage_account_names_are_validated(client: TestClient, auth_headers: Dict[str, str], emulator_session: Session):
+    """
+    Tests that invalid account names are rejected, and that deleting an
+    account stored under such a name never removes files outside the blob
+    storage directory.
+    """
+    base = "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts"
+    payload = {"location": "eastus", "sku": {"name": "Standard_LRS"}, "kind": "StorageV2"}
+    for name in ["%2e%2e", "ab", "Upper1", "name-with-dash", "a" * 25]:
+        response = client.put(f"{base}/{name}", json=payload, headers=auth_headers)
+        assert response.status_code == 400, name
+        assert response.json()["error"]["code"] == "AccountNameInvalid"
+
+    sibling = os.path.join(os.path.dirname(get_settings().BLOB_STORAGE_PATH), "precious.db")
+    with open(sibling, "w") as f:
+        f.write("data")
+    emulator_session.add(StorageAccount(name="..", resource_group="rg", subscription_id="sub", location="eastus", sku="Standard_LRS", kind="StorageV2"))
+    emulator_session.commit()
+    assert client.delete(f"{base}/%2e%2e", headers=auth_headers).status_code == 204
+    assert os.path.exists(sibling)
+
 def test_storage_account_auth(client: TestClient):
     """
     Tests that unauthorized requests to the Storage Account endpoints are rejected.
@@ -0,0 +1,106 @@
+"""
+Tests for the emulation of ARM request throttling.
+"""
+from fastapi.testclient import TestClient
+from types import SimpleNamespace
+from typing import Dict
+
+from app import throttling
+from app.config import get_settings
+from app.main import create_app
+from app.throttling import BucketLimits, SharedBuckets
+
+def test_throttling(monkeypatch, auth_headers: Dict[str, str]):
+    """
+    Tests the rate limit headers and 429 responses of separate read and
+    write buckets per subscription.
+    """
+    settings = get_settings()
+    monkeypatch.setattr(settings, "THROTTLING_ENABLED", True)
+    monkeypatch.setattr(settings, "THROTTLE_READS_BUCKET_SIZE", 3)
+    monkeypatch.setattr(settings, "THROTTLE_READS_PER_SECOND", 0.01)
+    monkeypatch.setattr(settings, "THROTTLE_WRITES_BUCKET_SIZE", 1)
+    monkeypatch.setattr(settings, "THROTTLE_WRITES_PER_SECOND", 0.5)
+    client = TestClient(create_app())
+
+    remaining = []
+    for _ in range(3):
+        response = client.get("/subscriptions/sub-a/providers", headers=auth_headers)
+        assert response.status_code == 200
+        remaining.append(response.headers["x-ms-ratelimit-remaining-subscription-reads"])
+    assert remaining == ["2", "1", "0"]
+
+    response = client.get("/subscriptions/sub-a/providers/Microsoft.Compute", headers=auth_headers)
+    assert response.status_code == 429
+    assert response.json()["error"]["code"] == "SubscriptionRequestsThrottled"
+    assert response.headers["Retry-After"] == "100"
+
+    # Writes, other subscriptions and the tenant have buckets of their own.
+    response = client.post("/subscriptions/sub-a/providers/Microsoft.Compute/register", headers=auth_headers)
+    assert response.headers["x-ms-ratelimit-remaining-subscription-writes"] == "0"
+    response = client.post("/subscriptions/sub-a/providers/Microsoft.Compute/register", headers=auth_headers)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    response = client.get("/subscriptions/SUB-B/providers", headers=auth_headers)
+    assert response.headers["x-ms-ratelimit-remaining-subscription-reads"] == "2"
+    response = client.get("/providers", headers=auth_headers)
+    assert response.headers["x-ms-ratelimit-remaining-tenant-reads"] == "2"
+
+    # Unauthenticated requests take no tokens.
+    assert client.get("/subscriptions/sub-c/providers").status_code == 401
+    response = client.get("/subscriptions/sub-c/providers", headers=auth_headers)
+    assert response.headers["x-ms-ratelimit-remaining-subscription-reads"] == "2"
+
+def _take(buckets: SharedBuckets, key: str, write: bool):
+    taken, tokens, _ = buckets.take(key, write)
+    return taken, int(tokens)
+
+def test_shared_buckets(tmp_path):
+    """
+    Tests that buckets in the same file, as in separate workers, share
+    their tokens.
+    """
+    limits = BucketLimits(size=2, refill_rate=0.01)
+    first = SharedBuckets(str(tmp_path / "throttle.bin"), limits, limits, slots=8)
+    second = SharedBuckets(str(tmp_path / "throttle.bin"), limits, limits, slots=8)
+    try:
+        assert _take(first, "sub", write=False) == (True, 1)
+        assert _take(second, "sub", write=False) == (True, 0)
+        assert first.take("sub", write=False)[0] is False
+        assert _take(second, "sub", write=True) == (True, 1)
+        # Keys colliding in the table get slots of their own.
+        for index in range(7):
+            assert _take(first, f"other-{index}", write=False) == (True, 1)
+        assert second.take("sub", write=False)[0] is False
+    finally:
+        first.close()
+        second.close()
+
+def test_shared_buckets_reset_and_reclaim(tmp_path, monkeypatch):
+    """
+    Tests that a new run starts from a reset file, that idle slots are taken
+    over by new keys, and that new keys are throttled while none is idle.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(throttling, "time", SimpleNamespace(time=lambda: now[0]))
+    path = str(tmp_path / "throttle.bin")
+    limits = BucketLimits(size=2, refill_rate=1.0)
+
+    previous_run = SharedBuckets(path, limits, limits, slots=2, run_id=1)
+    assert _take(previous_run, "sub", write=False) == (True, 1)
+    assert _take(previous_run, "sub", write=False) == (True, 0)
+    previous_run.close()
+    buckets = SharedBuckets(path, limits, limits, slots=2, run_id=2)
+    try:
+        assert _take(buckets, "sub", write=False) == (True, 1)
+        assert _take(buckets, "other", write=True) == (True, 1)
+
+        # Both slots are in use until "other" has refilled, a second from now.
+        taken, _, retry_after = buckets.take("new", write=False)
+        assert taken is False
+        assert retry_after == 1.0
+        now[0] += 1.0
+        assert _take(buckets, "new", write=False) == (True, 1)
+        assert _take(buckets, "sub", write=False) == (True, 1)
+    finally:
+        buckets.close()